@@ -1,41 +1,100 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+from flask import Blueprint, Flask, current_app, render_template, request, redirect, url_for, flash, jsonify, Response, stream_with_context, session, make_response, has_request_context
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
-from flask_migrate import Migrate
+from datetime import date, datetime, timedelta, timezone
 from dotenv import load_dotenv
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_caching import Cache
 from flask_session import Session
+from metrics import metrics
+from audit import audit
+from compression import compression
+from routing import ReplicaRouter, RoutingSession, configure_pools
+from session_store import DatabaseSessionInterface
+from werkzeug.datastructures import MultiDict
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from collections import Counter, OrderedDict
+from functools import lru_cache, wraps
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy.sql import visitors
+import base64
+import click
+import csv
+import hashlib
+import heapq
+import io
+import json
+import logging
+import operator
 import os
+import re
+import threading
+import time
+import zlib
 
 # Load environment variables
 load_dotenv()
 
-# Ensure the instance folder exists before initializing the app
-instance_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance')
-os.makedirs(instance_path, exist_ok=True)
+# Extensions are bound to an application in create_app()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+cache = Cache()
+login_manager = LoginManager()
+login_manager.login_view = 'main.login'
+bp = Blueprint('main', __name__, cli_group=None)
+
+def create_app(config_object=None):
+    """Create and configure the application.
+
+    Nothing here touches the database, so web and worker processes start
+    without a connection; the schema is created or upgraded once per
+    deployment with ``flask init-db``.
+    """
+    # Ensure the instance folder exists before initializing the app
+    instance_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance')
+    os.makedirs(instance_path, exist_ok=True)
 
-app = Flask(__name__, instance_path=instance_path)
+    app = Flask(__name__, instance_path=instance_path)
 
-# Load the appropriate configuration
-env = os.getenv('FLASK_ENV', 'development')
-if env == 'production':
-    app.config.from_object('config.ProductionConfig')
-else:
-    app.config.from_object('config.DevelopmentConfig')
+    # Load the appropriate configuration
+    if config_object is None:
+        env = os.getenv('FLASK_ENV', 'development')
+        config_object = 'config.ProductionConfig' if env == 'production' else 'config.DevelopmentConfig'
+    app.config.from_object(config_object)
 
-# Initialize Simple Cache
-app.config['CACHE_TYPE'] = 'SimpleCache'
-app.config['SESSION_TYPE'] = 'filesystem'
-cache = Cache(app)
+    # Initialize cache (SimpleCache unless CACHE_TYPE is configured). Sessions live in
+    # the users database by default; 'cookie' keeps Flask's signed cookie sessions and
+    # any other SESSION_TYPE is handled by Flask-Session.
+    cache.init_app(app)
+    # Registered first so it runs after every other after_request hook
+    compression.init_app(app)
+    session_type = app.config.get('SESSION_TYPE', 'database')
+    if session_type not in ('database', 'cookie'):
+        Session(app)
+
+    configure_pools(app)
+    db.init_app(app)
+    login_manager.init_app(app)
+    metrics.init_app(app)
+    with app.app_context():
+        for bind_key, engine in db.engines.items():
+            metrics.instrument_engine(engine, bind_key or 'default')
+        # Reads of read-only requests on the leads bind go to LEADS_REPLICA_URLS, if any
+        router = ReplicaRouter(app, db.engines.get('leads'))
+        for engine in router.replicas:
+            metrics.instrument_engine(engine, 'leads_replica')
+        audit.init_app(app, db.engines.get('leads'), AuditEvent.__table__)
+        if session_type == 'database':
+            app.session_interface = DatabaseSessionInterface(app, db.engine, UserSession.__table__)
+    user_cache.init_app(app)
+    schema_cache.init_app(app)
 
-# Initialize Flask-Session
-Session(app)
+    # Alembic is slow to import and only needed by the `flask db` commands
+    if click.get_current_context(silent=True) is not None:
+        from flask_migrate import Migrate
+        Migrate(app, db)
 
-# Initialize database
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
+    app.register_blueprint(bp)
+    return app
 
 # User Model for MySQL
 class MySQLUser(db.Model):
@@ -64,9 +123,230 @@ class Lead(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    # Normalized blocking keys for duplicate detection
+    email_key = db.Column(db.String(120), index=True)
+    phone_key = db.Column(db.String(20), index=True)
+    company_key = db.Column(db.String(100), index=True)
+
+    # Lead scoring
+    industry = db.Column(db.String(100))
+    score = db.Column(db.Integer)
+    scored_at = db.Column(db.DateTime)
+
+    # Where the lead came from (web, api, import, dashboard or a value given on import/create)
+    source = db.Column(db.String(50))
+    # When the lead entered its current stage, for time-in-stage analytics
+    stage_changed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # Filled in by the enrichment worker
+    company_size = db.Column(db.String(20))
+    contact_valid = db.Column(db.Boolean)
+    enriched_at = db.Column(db.DateTime)
+
+    # Optimistic concurrency: bumped on every update and checked by the ORM
+    # and by PATCH /api/leads, so concurrent edits cannot silently overwrite
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+
     created_by = db.relationship('MySQLUser', foreign_keys=[created_by_id], backref=db.backref('created_leads', lazy=True, cascade='all, delete-orphan'))
     assigned_to = db.relationship('MySQLUser', foreign_keys=[assigned_to_id], backref=db.backref('assigned_leads', lazy=True))
 
+    # Composite indexes backing keyset pagination on (created_at, id)
+    __table_args__ = (
+        db.Index('ix_lead_created_at_id', 'created_at', 'id'),
+        db.Index('ix_lead_stage_created_at_id', 'stage', 'created_at', 'id'),
+        db.Index('ix_lead_assigned_to_created_at_id', 'assigned_to_id', 'created_at', 'id'),
+        db.Index('ix_lead_created_by_created_at_id', 'created_by_id', 'created_at', 'id'),
+        db.Index('ix_lead_email', 'email'),
+        db.Index('ix_lead_phone', 'phone'),
+        db.Index('ix_lead_score_id', 'score', 'id'),
+        # Never reuse the id of a deleted lead, which may still be in lead_archive
+        {'sqlite_autoincrement': True},
+    )
+    __mapper_args__ = {'version_id_col': version, 'version_id_generator': False}
+
+# Closed or stale leads moved out of the lead table by archive_leads(); same
+# columns as lead (added by init-db as lead gains them) plus archived_at
+lead_archive = db.Table(
+    'lead_archive',
+    *[db.Column(column.name, column.type, primary_key=column.primary_key, autoincrement=False,
+                nullable=column.nullable) for column in Lead.__table__.columns],
+    db.Column('archived_at', db.DateTime, nullable=False),
+    db.Index('ix_lead_archive_created_at_id', 'created_at', 'id'),
+    db.Index('ix_lead_archive_assigned_to_id_created_at_id', 'assigned_to_id', 'created_at', 'id'),
+    db.Index('ix_lead_archive_archived_at', 'archived_at'),
+    bind_key='leads'
+)
+
+# Materialized lead counts per stage and assignee (assignee_id 0 means unassigned)
+class LeadStageCount(db.Model):
+    __bind_key__ = 'leads'
+    __tablename__ = 'lead_stage_count'
+    stage = db.Column(db.String(50), primary_key=True)
+    assignee_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    lead_count = db.Column(db.Integer, nullable=False, default=0)
+
+# Score changes made by rescoring a lead that already had a score
+class LeadScoreHistory(db.Model):
+    __bind_key__ = 'leads'
+    __tablename__ = 'lead_score_history'
+    id = db.Column(db.Integer, primary_key=True)
+    lead_id = db.Column(db.Integer, nullable=False, index=True)
+    previous_score = db.Column(db.Integer)
+    score = db.Column(db.Integer, nullable=False)
+    rule_set = db.Column(db.String(100))
+    scored_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+# Merge candidates found by duplicate detection, one cluster per lead
+class LeadDuplicate(db.Model):
+    __bind_key__ = 'leads'
+    __tablename__ = 'lead_duplicate'
+    lead_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    cluster_id = db.Column(db.Integer, nullable=False, index=True)
+    match_keys = db.Column(db.String(50))
+    detected_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+# Append-only log of lead changes; seq orders the change feed
+class LeadChange(db.Model):
+    __bind_key__ = 'leads'
+    __tablename__ = 'lead_change'
+    seq = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    lead_id = db.Column(db.Integer, nullable=False)
+    op = db.Column(db.String(10), nullable=False)  # 'upsert' or 'delete'
+    assigned_to_id = db.Column(db.Integer)
+    # Set when the change moved the lead away from this assignee
+    previous_assigned_to_id = db.Column(db.Integer)
+    changed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+    __table_args__ = (
+        db.Index('ix_lead_change_assigned_to_id_seq', 'assigned_to_id', 'seq'),
+        db.Index('ix_lead_change_previous_assigned_to_id_seq', 'previous_assigned_to_id', 'seq'),
+        # Never reuse a sequence number after the log is pruned
+        {'sqlite_autoincrement': True},
+    )
+
+# Every stage a lead has entered; from_stage is NULL for the stage it was created in
+class LeadStageTransition(db.Model):
+    __bind_key__ = 'leads'
+    __tablename__ = 'lead_stage_transition'
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    lead_id = db.Column(db.Integer, nullable=False)
+    from_stage = db.Column(db.String(50))
+    to_stage = db.Column(db.String(50))
+    assigned_to_id = db.Column(db.Integer)
+    source = db.Column(db.String(50))
+    transitioned_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # Seconds the lead spent in from_stage
+    seconds_in_stage = db.Column(db.Float)
+
+    __table_args__ = (
+        db.Index('ix_lead_stage_transition_lead_id_transitioned_at', 'lead_id', 'transitioned_at'),
+        db.Index('ix_lead_stage_transition_transitioned_at', 'transitioned_at'),
+    )
+
+# Daily stage rollups maintained with each transition (assignee_id 0 means
+# unassigned, source '' means unknown); analytics endpoints read only these
+class LeadStageDaily(db.Model):
+    __bind_key__ = 'leads'
+    __tablename__ = 'lead_stage_daily'
+    day = db.Column(db.Date, primary_key=True)
+    stage = db.Column(db.String(50), primary_key=True)
+    assignee_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    source = db.Column(db.String(50), primary_key=True)
+    entered = db.Column(db.Integer, nullable=False, default=0)
+    exited = db.Column(db.Integer, nullable=False, default=0)
+    exited_seconds = db.Column(db.Float, nullable=False, default=0)
+
+# Audit trail of logins and changes, written in batches by audit.py
+class AuditEvent(db.Model):
+    __bind_key__ = 'leads'
+    __tablename__ = 'audit_event'
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    occurred_at = db.Column(db.DateTime, nullable=False)
+    actor_id = db.Column(db.Integer)
+    actor_username = db.Column(db.String(80))
+    action = db.Column(db.String(50), nullable=False)
+    entity_type = db.Column(db.String(50))
+    entity_id = db.Column(db.Integer)
+    ip_address = db.Column(db.String(45))
+    details = db.Column(db.Text)
+
+    # Newest-first pages by actor, entity, action or time
+    __table_args__ = (
+        db.Index('ix_audit_event_occurred_at_id', 'occurred_at', 'id'),
+        db.Index('ix_audit_event_actor_id_occurred_at_id', 'actor_id', 'occurred_at', 'id'),
+        db.Index('ix_audit_event_entity_occurred_at_id', 'entity_type', 'entity_id', 'occurred_at', 'id'),
+        db.Index('ix_audit_event_action_occurred_at_id', 'action', 'occurred_at', 'id'),
+    )
+
+# Webhook endpoints, the transactional outbox of lead events, and delivery state
+class WebhookEndpoint(db.Model):
+    __bind_key__ = 'leads'
+    __tablename__ = 'webhook_endpoint'
+    id = db.Column(db.Integer, primary_key=True)
+    url = db.Column(db.String(500), nullable=False)
+    events = db.Column(db.String(200), nullable=False, default='*')
+    secret = db.Column(db.String(100))
+    rate_limit = db.Column(db.Float)  # requests per second, None for unlimited
+    active = db.Column(db.Boolean, nullable=False, default=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class WebhookOutbox(db.Model):
+    __bind_key__ = 'leads'
+    __tablename__ = 'webhook_outbox'
+    id = db.Column(db.Integer, primary_key=True)
+    event_type = db.Column(db.String(50), nullable=False)
+    lead_id = db.Column(db.Integer)
+    payload = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    dispatched_at = db.Column(db.DateTime, index=True)
+
+class WebhookDelivery(db.Model):
+    __bind_key__ = 'leads'
+    __tablename__ = 'webhook_delivery'
+    id = db.Column(db.Integer, primary_key=True)
+    event_id = db.Column(db.Integer, nullable=False)
+    endpoint_id = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_status_code = db.Column(db.Integer)
+    last_error = db.Column(db.String(500))
+    delivered_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_webhook_delivery_due', 'status', 'next_attempt_at'),
+        db.Index('ix_webhook_delivery_endpoint', 'endpoint_id', 'id'),
+    )
+
+class WebhookAttempt(db.Model):
+    __bind_key__ = 'leads'
+    __tablename__ = 'webhook_attempt'
+    id = db.Column(db.Integer, primary_key=True)
+    delivery_id = db.Column(db.Integer, nullable=False, index=True)
+    attempted_at = db.Column(db.DateTime, default=datetime.utcnow)
+    status_code = db.Column(db.Integer)
+    error = db.Column(db.String(500))
+    duration_ms = db.Column(db.Integer)
+
+# Background enrichment jobs, claimed by the enrichment worker
+class EnrichmentJob(db.Model):
+    __bind_key__ = 'leads'
+    __tablename__ = 'enrichment_job'
+    id = db.Column(db.Integer, primary_key=True)
+    lead_id = db.Column(db.Integer, nullable=False, index=True)
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    run_after = db.Column(db.DateTime, default=datetime.utcnow)
+    locked_at = db.Column(db.DateTime)
+    last_error = db.Column(db.String(500))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_enrichment_job_due', 'status', 'run_after'),
+    )
+
 class User(UserMixin, db.Model):
     __tablename__ = 'user'
     id = db.Column(db.Integer, primary_key=True)
@@ -82,106 +362,1974 @@ class User(UserMixin, db.Model):
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
 
-# Initialize databases
-with app.app_context():
+# Server-side sessions (SESSION_TYPE=database), keyed by a hash of the session cookie
+class UserSession(db.Model):
+    __tablename__ = 'user_session'
+    id = db.Column(db.String(64), primary_key=True)
+    data = db.Column(db.Text, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+# Schema upgrades for tables created by older versions
+def add_missing_columns(engine, table):
+    """ALTER ``table`` to add model columns it lacks; new columns are added as
+    nullable, filled with their server default if they have one."""
+    existing = {column['name'] for column in db.inspect(engine).get_columns(table.name)}
+    with engine.begin() as connection:
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=engine.dialect)
+                default = f' DEFAULT {column.server_default.arg}' if column.server_default is not None else ''
+                connection.exec_driver_sql(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}{default}')
+
+# Lead normalization and duplicate blocking keys
+COMPANY_SUFFIXES = {'inc', 'incorporated', 'llc', 'ltd', 'limited', 'corp', 'corporation',
+                    'co', 'company', 'gmbh', 'plc', 'sa', 'ag', 'the'}
+
+def normalize_email(email):
+    email = (email or '').strip().lower()
+    return email or None
+
+def normalize_phone(phone):
+    """Reduce a phone number to its digits, dropping a leading 00 international prefix."""
+    digits = re.sub(r'\D', '', phone or '')
+    if digits.startswith('00'):
+        digits = digits[2:]
+    return digits if len(digits) >= 7 else None
+
+def normalize_company(company):
+    """Lowercase a company name and drop punctuation and legal-form suffixes."""
+    words = [word for word in re.findall(r'\w+', (company or '').lower()) if word not in COMPANY_SUFFIXES]
+    return ' '.join(words)[:100] or None
+
+def lead_blocking_keys(email, phone, company):
+    return {'email_key': normalize_email(email),
+            'phone_key': normalize_phone(phone),
+            'company_key': normalize_company(company)}
+
+@db.event.listens_for(Lead, 'before_insert')
+@db.event.listens_for(Lead, 'before_update')
+def _set_lead_blocking_keys(mapper, connection, target):
+    for key, value in lead_blocking_keys(target.email, target.phone, target.company).items():
+        setattr(target, key, value)
+
+@db.event.listens_for(Lead, 'before_update')
+def _bump_lead_version(mapper, connection, target):
+    target.version = (target.version or 0) + 1
+
+def update_lead_columns(rows):
+    """executemany UPDATE of lead columns from mappings keyed by 'id'.
+
+    Used for derived columns (scores, blocking keys), so it goes through Core
+    and neither checks nor bumps the lead version like an ORM update would.
+    """
+    table = Lead.__table__
+    db.session.execute(table.update().where(table.c.id == db.bindparam('lead_id')),
+                       [{'lead_id' if key == 'id' else key: value for key, value in row.items()} for row in rows])
+
+# Lead scoring
+SCORE_BATCH_SIZE = 5000
+SCORE_FIELD_COLUMNS = {'email': 'email_key', 'phone': 'phone_key', 'company': 'company_key',
+                       'notes': 'notes', 'industry': 'industry'}
+SCORE_INPUTS = ('email_key', 'phone_key', 'company_key', 'notes', 'industry', 'stage')
+
+def scoring_rule_set(industry):
+    """Return (name, rules) for an industry, falling back to the default rule set."""
+    rules = current_app.config['LEAD_SCORING_RULES']
+    name = (industry or '').strip().lower()
+    return (name, rules[name]) if name in rules else ('default', rules['default'])
+
+def score_columns(columns, rules):
+    """Score a batch given as {input name: list of values}, one rule at a time over whole columns."""
+    scores = [0] * len(columns['stage'])
+    for field, weight in rules.get('fields', {}).items():
+        scores = [score + weight if value else score
+                  for score, value in zip(scores, columns[SCORE_FIELD_COLUMNS[field]])]
+    stage_points = rules.get('stages', {})
+    scores = [score + stage_points.get(stage, 0) for score, stage in zip(scores, columns['stage'])]
+    return [max(0, min(100, score)) for score in scores]
+
+def score_rows(rows):
+    """Score mappings holding SCORE_INPUTS, batching rows that share a rule set.
+
+    Returns [(score, rule_set_name)] in input order.
+    """
+    groups = {}
+    for position, row in enumerate(rows):
+        name, rules = scoring_rule_set(row['industry'])
+        groups.setdefault(name, (rules, []))[1].append(position)
+    results = [None] * len(rows)
+    for name, (rules, positions) in groups.items():
+        columns = {column: [rows[position][column] for position in positions] for column in SCORE_INPUTS}
+        for position, score in zip(positions, score_columns(columns, rules)):
+            results[position] = (score, name)
+    return results
+
+@db.event.listens_for(Lead, 'before_insert')
+@db.event.listens_for(Lead, 'before_update')
+def _score_lead(mapper, connection, target):
+    attrs = db.inspect(target).attrs
+    if target.score is not None and not any(attrs[column].history.has_changes() for column in SCORE_INPUTS):
+        return
+    (score, target._rule_set), = score_rows([{column: getattr(target, column) for column in SCORE_INPUTS}])
+    if score != target.score:
+        target.score = score
+        target.scored_at = datetime.utcnow()
+
+@db.event.listens_for(Lead, 'after_update')
+def _record_score_change(mapper, connection, target):
+    history = db.inspect(target).attrs.score.history
+    if history.has_changes() and history.deleted and history.deleted[0] is not None:
+        connection.execute(LeadScoreHistory.__table__.insert().values(
+            lead_id=target.id, previous_score=history.deleted[0], score=target.score,
+            rule_set=getattr(target, '_rule_set', None), scored_at=target.scored_at))
+
+def rescore_leads(rescore_all=False, batch_size=SCORE_BATCH_SIZE):
+    """Score leads in id-ordered batches; only unscored leads unless ``rescore_all``."""
+    columns = [Lead.id, Lead.score] + [getattr(Lead, column) for column in SCORE_INPUTS]
+    last_id, scored = 0, 0
+    while True:
+        query = db.select(*columns).where(Lead.id > last_id).order_by(Lead.id).limit(batch_size)
+        if not rescore_all:
+            query = query.where(Lead.score.is_(None))
+        rows = [row._mapping for row in db.session.execute(query)]
+        if not rows:
+            if scored:
+                invalidate_lead_cache()
+            return scored
+        now = datetime.utcnow()
+        updates, history = [], []
+        for row, (score, rule_set) in zip(rows, score_rows(rows)):
+            if score == row['score']:
+                continue
+            updates.append({'id': row['id'], 'score': score, 'scored_at': now})
+            if row['score'] is not None:
+                history.append({'lead_id': row['id'], 'previous_score': row['score'], 'score': score,
+                                'rule_set': rule_set, 'scored_at': now})
+        if updates:
+            update_lead_columns(updates)
+            log_lead_changes(leads_connection(), Lead.id.in_([row['id'] for row in updates]))
+        if history:
+            db.session.execute(db.insert(LeadScoreHistory), history)
+        db.session.commit()
+        scored += len(updates)
+        last_id = rows[-1]['id']
+
+# Webhook outbox events, written on the flush connection of the lead change
+WEBHOOK_EVENTS = ('lead.created', 'lead.stage_changed', 'lead.score_updated')
+
+WEBHOOK_LEAD_FIELDS = ('id', 'name', 'company', 'email', 'phone', 'stage', 'score', 'assigned_to_id')
+
+def _lead_event_data(lead):
+    return lead_to_dict(lead, WEBHOOK_LEAD_FIELDS)
+
+def write_outbox_event(connection, event_type, lead_id, data):
+    now = datetime.utcnow()
+    connection.execute(WebhookOutbox.__table__.insert().values(
+        event_type=event_type, lead_id=lead_id, created_at=now,
+        payload=json.dumps({'type': event_type, 'created_at': now.isoformat(), 'data': data})))
+
+def write_created_events(connection, condition):
+    """lead.created events for leads matching ``condition`` that were inserted with Core."""
+    now = datetime.utcnow()
+    events = [{
+        'event_type': 'lead.created', 'lead_id': lead.id, 'created_at': now,
+        'payload': json.dumps({'type': 'lead.created', 'created_at': now.isoformat(),
+                               'data': _lead_event_data(lead)}),
+    } for lead in connection.execute(db.select(*lead_columns(WEBHOOK_LEAD_FIELDS)).where(condition))]
+    if events:
+        connection.execute(WebhookOutbox.__table__.insert(), events)
+
+@db.event.listens_for(Lead, 'after_insert')
+def _outbox_lead_created(mapper, connection, target):
+    write_outbox_event(connection, 'lead.created', target.id, _lead_event_data(target))
+
+@db.event.listens_for(Lead, 'after_update')
+def _outbox_lead_updated(mapper, connection, target):
+    attrs = db.inspect(target).attrs
+    stage, score = attrs.stage.history, attrs.score.history
+    if stage.has_changes():
+        previous = stage.deleted[0] if stage.deleted else None
+        write_outbox_event(connection, 'lead.stage_changed', target.id,
+                           dict(_lead_event_data(target), previous_stage=previous))
+    if score.has_changes() and score.deleted and score.deleted[0] is not None:
+        write_outbox_event(connection, 'lead.score_updated', target.id,
+                           dict(_lead_event_data(target), previous_score=score.deleted[0]))
+
+# Lead change feed, written on the same connection as the lead change
+def record_lead_changes(connection, rows):
+    """Append change rows ({lead_id, op, assigned_to_id, previous_assigned_to_id}) to the log."""
+    if rows:
+        now = datetime.utcnow()
+        connection.execute(LeadChange.__table__.insert(), [
+            dict({'previous_assigned_to_id': None}, **row, changed_at=now) for row in rows
+        ])
+
+def log_lead_changes(connection, condition, assign_to=None):
+    """Set-based change rows for every lead matching ``condition``.
+
+    Pass ``assign_to`` when logging ahead of an UPDATE that reassigns the
+    leads, so the log records both the new and the previous assignee.
+    """
+    if assign_to is None:
+        assigned_to_id, previous = Lead.assigned_to_id, db.null()
+    else:
+        assigned_to_id, previous = db.literal(assign_to, db.Integer), Lead.assigned_to_id
+    connection.execute(LeadChange.__table__.insert().from_select(
+        ['lead_id', 'op', 'assigned_to_id', 'previous_assigned_to_id', 'changed_at'],
+        db.select(Lead.id, db.literal('upsert'), assigned_to_id, previous, db.literal(datetime.utcnow()))
+        .where(condition)
+    ))
+
+@db.event.listens_for(Lead, 'after_insert')
+def _log_inserted_lead(mapper, connection, target):
+    record_lead_changes(connection, [{'lead_id': target.id, 'op': 'upsert',
+                                      'assigned_to_id': target.assigned_to_id}])
+
+@db.event.listens_for(Lead, 'after_update')
+def _log_updated_lead(mapper, connection, target):
+    history = db.inspect(target).attrs.assigned_to_id.history
+    previous = history.deleted[0] if history.has_changes() and history.deleted else None
+    record_lead_changes(connection, [{'lead_id': target.id, 'op': 'upsert',
+                                      'assigned_to_id': target.assigned_to_id,
+                                      'previous_assigned_to_id': previous}])
+
+@db.event.listens_for(Lead, 'after_delete')
+def _log_deleted_lead(mapper, connection, target):
+    record_lead_changes(connection, [{'lead_id': target.id, 'op': 'delete',
+                                      'assigned_to_id': target.assigned_to_id}])
+
+# Lead JSON serialization, shared by the lead endpoints, the change feed and webhooks
+LEAD_FIELDS = ('id', 'name', 'company', 'email', 'phone', 'stage', 'notes', 'industry', 'score',
+               'source', 'assigned_to_id', 'version', 'created_at', 'updated_at')
+DEFAULT_LEAD_FIELDS = ('id', 'name', 'company', 'email', 'phone', 'stage', 'notes', 'score',
+                       'version', 'created_at', 'updated_at')
+LEAD_DATETIME_FIELDS = frozenset(('created_at', 'updated_at'))
+LEAD_RESPONSE_FORMATS = ('objects', 'columnar')
+
+@lru_cache(maxsize=256)
+def lead_values(fields):
+    """Compile a function returning the JSON values of ``fields`` for a lead or row, as a tuple."""
+    getter = operator.attrgetter(*fields)
+    dates = [index for index, field in enumerate(fields) if field in LEAD_DATETIME_FIELDS]
+    single = len(fields) == 1
+
+    def values(lead):
+        row = (getter(lead),) if single else getter(lead)
+        if not dates:
+            return row
+        row = list(row)
+        for index in dates:
+            if row[index] is not None:
+                row[index] = row[index].isoformat()
+        return row
+    return values
+
+def lead_to_dict(lead, fields=LEAD_FIELDS):
+    return dict(zip(fields, lead_values(fields)(lead)))
+
+def serialize_leads(leads, fields, columnar=False):
+    """A list of lead dicts or, with ``columnar``, a dict of one value list per field."""
+    values = lead_values(fields)
+    if not columnar:
+        return [dict(zip(fields, values(lead))) for lead in leads]
+    columns = list(zip(*map(values, leads))) or [()] * len(fields)
+    return {field: list(column) for field, column in zip(fields, columns)}
+
+def lead_columns(fields, *extra):
+    """Lead columns for ``fields`` plus ``extra`` names, so reads select only what is sent."""
+    return [getattr(Lead, name) for name in dict.fromkeys(('id',) + tuple(fields) + extra)]
+
+def lead_fields_from_args(args, default=DEFAULT_LEAD_FIELDS):
+    """Fields named by ``fields=a,b`` in LEAD_FIELDS order (id is always included), else ``default``."""
+    value = args.get('fields', '').strip()
+    if not value:
+        return default
+    requested = {field.strip() for field in value.split(',') if field.strip()}
+    unknown = requested.difference(LEAD_FIELDS)
+    if unknown:
+        raise ValueError(f'Unknown fields: {", ".join(sorted(unknown))}; '
+                         f'choose from {", ".join(LEAD_FIELDS)}')
+    return tuple(field for field in LEAD_FIELDS if field == 'id' or field in requested)
+
+def lead_format_from_args(args):
+    response_format = args.get('format', 'objects')
+    if response_format not in LEAD_RESPONSE_FORMATS:
+        raise ValueError(f'format must be one of {", ".join(LEAD_RESPONSE_FORMATS)}')
+    return response_format
+
+class ChangeLogGone(Exception):
+    """The requested position is older than the retained change log."""
+
+def latest_change_seq():
+    return db.session.scalar(db.select(db.func.max(LeadChange.seq))) or 0
+
+def _change_horizon(since, limit):
+    """Highest seq up to which the log is known complete, and whether more rows follow.
+
+    Sequence numbers are handed out at insert time but become visible at
+    commit, so a gap may be a transaction still in flight. Reading stops at
+    the first gap until the row after it is older than CHANGE_FEED_SETTLE_SECONDS,
+    after which the gap is taken to be a rollback.
+    """
+    rows = db.session.execute(
+        db.select(LeadChange.seq, LeadChange.changed_at)
+        .where(LeadChange.seq > since).order_by(LeadChange.seq).limit(limit)
+    ).all()
+    settled = datetime.utcnow() - timedelta(seconds=current_app.config.get('CHANGE_FEED_SETTLE_SECONDS', 5))
+    horizon = since
+    for seq, changed_at in rows:
+        if seq != horizon + 1 and changed_at > settled:
+            return horizon, False
+        horizon = seq
+    return horizon, len(rows) == limit
+
+def read_lead_changes(since, user, limit):
+    """Changes after ``since`` visible to ``user``, one entry per lead with its current data.
+
+    Returns (changes, next_since, has_more). Clients see their own leads, and
+    a delete for each lead that was reassigned away from them.
+    """
+    if since:
+        first = db.session.scalar(db.select(db.func.min(LeadChange.seq)))
+        if first is not None and since < first - 1:
+            raise ChangeLogGone()
+    horizon, has_more = _change_horizon(since, limit)
+    if horizon == since:
+        return [], since, False
+
+    latest = (db.select(LeadChange.lead_id, db.func.max(LeadChange.seq).label('seq'))
+              .where(LeadChange.seq > since, LeadChange.seq <= horizon)
+              .group_by(LeadChange.lead_id))
+    if user.role != 'admin':
+        latest = latest.where(db.or_(LeadChange.assigned_to_id == user.id,
+                                     LeadChange.previous_assigned_to_id == user.id))
+    latest = dict(db.session.execute(latest).all())
+    leads = {lead.id: lead for lead in db.session.execute(
+        db.select(*lead_columns(LEAD_FIELDS)).where(Lead.id.in_(latest)))} if latest else {}
+
+    changes = []
+    for lead_id, seq in sorted(latest.items(), key=lambda item: item[1]):
+        lead = leads.get(lead_id)
+        if lead is None or (user.role != 'admin' and lead.assigned_to_id != user.id):
+            changes.append({'seq': seq, 'op': 'delete', 'id': lead_id})
+        else:
+            changes.append({'seq': seq, 'op': 'upsert', 'id': lead_id, 'lead': lead_to_dict(lead)})
+    return changes, horizon, has_more
+
+def prune_lead_changes(days):
+    """Delete change log rows older than ``days``; the caller commits.
+
+    The newest row is always kept so the feed position survives an idle period.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    return db.session.execute(
+        db.delete(LeadChange).where(LeadChange.changed_at < cutoff, LeadChange.seq < latest_change_seq())
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+# Enrichment job queue
+def enqueue_enrichment(connection, lead_ids):
+    """Queue enrichment for ``lead_ids``."""
+    now = datetime.utcnow()
+    if lead_ids:
+        connection.execute(EnrichmentJob.__table__.insert(), [
+            {'lead_id': lead_id, 'status': 'pending', 'attempts': 0, 'run_after': now, 'created_at': now}
+            for lead_id in lead_ids
+        ])
+
+@db.event.listens_for(Lead, 'after_insert')
+def _enqueue_new_lead(mapper, connection, target):
+    enqueue_enrichment(connection, [target.id])
+
+# Pipeline summary maintenance
+def _stage_key(stage, assigned_to_id):
+    return (stage or '', assigned_to_id or 0)
+
+def _counter_upsert(dialect_name, table, values):
+    """INSERT ``values``, or add its non-key values to the row with the same primary key."""
+    keys = [column.name for column in table.primary_key]
+    counters = [name for name in values if name not in keys]
+    if dialect_name == 'mysql':
+        stmt = mysql.insert(table).values(**values)
+        return stmt.on_duplicate_key_update({name: table.c[name] + stmt.inserted[name] for name in counters})
+    dialect = sqlite if dialect_name == 'sqlite' else postgresql
+    stmt = dialect.insert(table).values(**values)
+    return stmt.on_conflict_do_update(index_elements=keys,
+                                      set_={name: table.c[name] + stmt.excluded[name] for name in counters})
+
+def _stage_count_upsert(dialect_name, stage, assignee_id, delta):
+    return _counter_upsert(dialect_name, LeadStageCount.__table__,
+                           {'stage': stage, 'assignee_id': assignee_id, 'lead_count': delta})
+
+def apply_stage_count_deltas(connection, deltas):
+    """Add {(stage, assignee_id): delta} to the summary within the caller's transaction."""
+    for (stage, assignee_id), delta in deltas.items():
+        if delta:
+            connection.execute(_stage_count_upsert(connection.dialect.name, stage, assignee_id, delta))
+
+def leads_connection():
+    """The leads-bind primary connection of the current session transaction."""
+    return db.session.connection(bind_arguments={'mapper': Lead, 'primary': True})
+
+def rebuild_pipeline_summary():
+    """Recompute the pipeline summary from the lead table; the caller commits."""
+    table = LeadStageCount.__table__
+    stage = db.func.coalesce(Lead.stage, '')
+    assignee_id = db.func.coalesce(Lead.assigned_to_id, 0)
+    connection = leads_connection()
+    connection.execute(db.delete(table))
+    connection.execute(table.insert().from_select(
+        ['stage', 'assignee_id', 'lead_count'],
+        db.select(stage, assignee_id, db.func.count(Lead.id)).group_by(stage, assignee_id)
+    ))
+
+# Keep previous stage/assignee values in attribute history even when unloaded
+for _attribute in (Lead.stage, Lead.assigned_to_id):
+    db.event.listen(_attribute, 'set', lambda target, value, oldvalue, initiator: None, active_history=True)
+
+@db.event.listens_for(Lead, 'after_insert')
+def _count_inserted_lead(mapper, connection, target):
+    apply_stage_count_deltas(connection, {_stage_key(target.stage, target.assigned_to_id): 1})
+
+@db.event.listens_for(Lead, 'after_update')
+def _count_updated_lead(mapper, connection, target):
+    attrs = db.inspect(target).attrs
+    stage, assigned_to_id = attrs.stage.history, attrs.assigned_to_id.history
+    if not stage.has_changes() and not assigned_to_id.has_changes():
+        return
+    old_stage = stage.deleted[0] if stage.deleted else target.stage
+    old_assigned_to_id = assigned_to_id.deleted[0] if assigned_to_id.deleted else target.assigned_to_id
+    deltas = Counter()
+    deltas[_stage_key(old_stage, old_assigned_to_id)] -= 1
+    deltas[_stage_key(target.stage, target.assigned_to_id)] += 1
+    apply_stage_count_deltas(connection, deltas)
+
+@db.event.listens_for(Lead, 'after_delete')
+def _count_deleted_lead(mapper, connection, target):
+    apply_stage_count_deltas(connection, {_stage_key(target.stage, target.assigned_to_id): -1})
+
+# Stage transition history and daily rollups
+LEAD_STAGES = ('New', 'Contacted', 'Qualified', 'Proposal', 'Negotiation', 'Closed Won', 'Closed Lost')
+# The funnel steps; Closed Lost is reported beside them
+FUNNEL_STAGES = LEAD_STAGES[:-1]
+
+def _rollup_day(value):
+    if isinstance(value, str):
+        return date.fromisoformat(value[:10])
+    return value.date() if isinstance(value, datetime) else value
+
+def _rollup_key(day, stage, assigned_to_id, source):
+    return (_rollup_day(day), stage or '', assigned_to_id or 0, source or '')
+
+def apply_stage_rollup_deltas(connection, deltas):
+    """Add {(day, stage, assignee_id, source): [entered, exited, exited_seconds]} to the daily rollups."""
+    table = LeadStageDaily.__table__
+    for (day, stage, assignee_id, source), (entered, exited, seconds) in deltas.items():
+        connection.execute(_counter_upsert(connection.dialect.name, table, {
+            'day': day, 'stage': stage, 'assignee_id': assignee_id, 'source': source,
+            'entered': entered, 'exited': exited, 'exited_seconds': seconds}))
+
+def _stage_rollup_deltas(transitions):
+    deltas = {}
+    for row in transitions:
+        key = _rollup_key(row['transitioned_at'], row['to_stage'], row['assigned_to_id'], row['source'])
+        deltas.setdefault(key, [0, 0, 0.0])[0] += 1
+        if row['from_stage'] is not None:
+            counts = deltas.setdefault(_rollup_key(row['transitioned_at'], row['from_stage'],
+                                                   row['assigned_to_id'], row['source']), [0, 0, 0.0])
+            counts[1] += 1
+            counts[2] += row['seconds_in_stage'] or 0
+    return deltas
+
+def record_stage_transitions(connection, transitions):
+    """Insert transition rows and fold them into the daily rollups, in the caller's transaction."""
+    if transitions:
+        connection.execute(LeadStageTransition.__table__.insert(), transitions)
+        apply_stage_rollup_deltas(connection, _stage_rollup_deltas(transitions))
+
+def record_created_leads(connection, condition):
+    """Set-based creation transitions and rollups for Core-inserted leads matching ``condition``."""
+    # Rows added through the dashboard have no created_at default
+    created_at = db.func.coalesce(Lead.created_at, db.literal(datetime.utcnow()))
+    connection.execute(LeadStageTransition.__table__.insert().from_select(
+        ['lead_id', 'from_stage', 'to_stage', 'assigned_to_id', 'source', 'transitioned_at'],
+        db.select(Lead.id, db.null(), Lead.stage, Lead.assigned_to_id, Lead.source, created_at)
+        .where(condition)
+    ))
+    day = db.func.date(created_at)
+    counts = connection.execute(
+        db.select(day, Lead.stage, Lead.assigned_to_id, Lead.source, db.func.count(Lead.id))
+        .where(condition).group_by(day, Lead.stage, Lead.assigned_to_id, Lead.source)
+    )
+    deltas = Counter()
+    for day_value, stage, assigned_to_id, source, count in counts:
+        deltas[_rollup_key(day_value, stage, assigned_to_id, source)] += count
+    apply_stage_rollup_deltas(connection, {key: [count, 0, 0.0] for key, count in deltas.items()})
+
+@db.event.listens_for(Lead, 'after_insert')
+def _record_created_lead_stage(mapper, connection, target):
+    record_stage_transitions(connection, [{
+        'lead_id': target.id, 'from_stage': None, 'to_stage': target.stage,
+        'assigned_to_id': target.assigned_to_id, 'source': target.source,
+        'transitioned_at': target.stage_changed_at or datetime.utcnow(), 'seconds_in_stage': None}])
+
+@db.event.listens_for(Lead, 'before_update')
+def _record_stage_transition(mapper, connection, target):
+    history = db.inspect(target).attrs.stage.history
+    previous = history.deleted[0] if history.deleted else None
+    if not history.has_changes() or previous == target.stage:
+        return
+    now = datetime.utcnow()
+    entered_at = target.stage_changed_at
+    record_stage_transitions(connection, [{
+        'lead_id': target.id, 'from_stage': previous, 'to_stage': target.stage,
+        'assigned_to_id': target.assigned_to_id, 'source': target.source, 'transitioned_at': now,
+        'seconds_in_stage': (now - entered_at).total_seconds() if entered_at else None}])
+    target.stage_changed_at = now
+
+def backfill_stage_transitions():
+    """Record creation transitions for leads with no history (created before it was kept)."""
+    transitions = LeadStageTransition.__table__
+    return leads_connection().execute(transitions.insert().from_select(
+        ['lead_id', 'from_stage', 'to_stage', 'assigned_to_id', 'source', 'transitioned_at'],
+        db.select(Lead.id, db.null(), Lead.stage, Lead.assigned_to_id, Lead.source,
+                  db.func.coalesce(Lead.created_at, Lead.updated_at, db.literal(datetime.utcnow())))
+        .where(~db.exists().where(transitions.c.lead_id == Lead.id))
+    )).rowcount
+
+def rebuild_stage_rollups():
+    """Recompute the daily rollups from the transition table; the caller commits."""
+    connection = leads_connection()
+    transition = LeadStageTransition
+    day = db.func.date(transition.transitioned_at)
+    deltas = {}
+    entered = connection.execute(
+        db.select(day, transition.to_stage, transition.assigned_to_id, transition.source, db.func.count())
+        .group_by(day, transition.to_stage, transition.assigned_to_id, transition.source))
+    for day_value, stage, assigned_to_id, source, count in entered:
+        deltas.setdefault(_rollup_key(day_value, stage, assigned_to_id, source), [0, 0, 0.0])[0] += count
+    exited = connection.execute(
+        db.select(day, transition.from_stage, transition.assigned_to_id, transition.source,
+                  db.func.count(), db.func.coalesce(db.func.sum(transition.seconds_in_stage), 0))
+        .where(transition.from_stage.isnot(None))
+        .group_by(day, transition.from_stage, transition.assigned_to_id, transition.source))
+    for day_value, stage, assigned_to_id, source, count, seconds in exited:
+        counts = deltas.setdefault(_rollup_key(day_value, stage, assigned_to_id, source), [0, 0, 0.0])
+        counts[1] += count
+        counts[2] += seconds
+    connection.execute(db.delete(LeadStageDaily.__table__))
+    rows = [{'day': key[0], 'stage': key[1], 'assignee_id': key[2], 'source': key[3],
+             'entered': entered, 'exited': exited, 'exited_seconds': seconds}
+            for key, (entered, exited, seconds) in deltas.items()]
+    if rows:
+        connection.execute(LeadStageDaily.__table__.insert(), rows)
+    return len(rows)
+
+def stage_rollup_filters(args, user):
+    """Rollup conditions for since/until (dates), assigned_to_id and source; clients see their own leads."""
+    filters = []
+    since = _parse_datetime_arg(args, 'since')
+    if since is not None:
+        filters.append(LeadStageDaily.day >= since.date())
+    until = _parse_datetime_arg(args, 'until')
+    if until is not None:
+        filters.append(LeadStageDaily.day < until.date())
+    if user.role != 'admin':
+        filters.append(LeadStageDaily.assignee_id == user.id)
+    elif args.get('assigned_to_id', '').lower() in ('none', 'null'):
+        filters.append(LeadStageDaily.assignee_id == 0)
+    else:
+        assigned_to_id = _parse_int_arg(args, 'assigned_to_id')
+        if assigned_to_id is not None:
+            filters.append(LeadStageDaily.assignee_id == assigned_to_id)
+    if 'source' in args:
+        filters.append(LeadStageDaily.source == args['source'])
+    return filters
+
+def _ordered_stages(stages):
+    return [stage for stage in LEAD_STAGES if stage in stages] + sorted(set(stages) - set(LEAD_STAGES))
+
+# Full-text search index over leads
+SEARCH_COLUMNS = ('name', 'company', 'email', 'phone', 'notes')
+SQLITE_SEARCH_DDL = [
+    """CREATE VIRTUAL TABLE lead_fts USING fts5(
+        name, company, email, phone, notes,
+        content='lead', content_rowid='id', tokenize='unicode61', prefix='2 3')""",
+    """CREATE TRIGGER lead_fts_ai AFTER INSERT ON lead BEGIN
+        INSERT INTO lead_fts(rowid, name, company, email, phone, notes)
+        VALUES (new.id, new.name, new.company, new.email, new.phone, new.notes);
+    END""",
+    """CREATE TRIGGER lead_fts_ad AFTER DELETE ON lead BEGIN
+        INSERT INTO lead_fts(lead_fts, rowid, name, company, email, phone, notes)
+        VALUES ('delete', old.id, old.name, old.company, old.email, old.phone, old.notes);
+    END""",
+    """CREATE TRIGGER lead_fts_au AFTER UPDATE OF name, company, email, phone, notes ON lead BEGIN
+        INSERT INTO lead_fts(lead_fts, rowid, name, company, email, phone, notes)
+        VALUES ('delete', old.id, old.name, old.company, old.email, old.phone, old.notes);
+        INSERT INTO lead_fts(rowid, name, company, email, phone, notes)
+        VALUES (new.id, new.name, new.company, new.email, new.phone, new.notes);
+    END""",
+    "INSERT INTO lead_fts(lead_fts) VALUES ('rebuild')"
+]
+
+def ensure_lead_autoincrement(engine):
+    """Rebuild a SQLite lead table created without AUTOINCREMENT.
+
+    Without it SQLite hands out the id of the newest lead again once that
+    lead is deleted, clashing with archived leads. The search index is dropped
+    too, so ensure_lead_search_index() rebuilds it and its triggers.
+    """
+    if engine.dialect.name != 'sqlite':
+        return
+    with engine.begin() as connection:
+        inspector = db.inspect(connection)
+        ddl = connection.exec_driver_sql(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'lead'").scalar()
+        if ddl is None or 'AUTOINCREMENT' in ddl.upper():
+            return
+        names = ', '.join(column.name for column in Lead.__table__.columns)
+        for index in inspector.get_indexes('lead'):
+            connection.exec_driver_sql(f'DROP INDEX {index["name"]}')
+        for (trigger,) in connection.exec_driver_sql(
+                "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'lead'"):
+            connection.exec_driver_sql(f'DROP TRIGGER {trigger}')
+        connection.exec_driver_sql('DROP TABLE IF EXISTS lead_fts')
+        connection.exec_driver_sql('ALTER TABLE lead RENAME TO lead_rebuild')
+        Lead.__table__.create(bind=connection)
+        connection.exec_driver_sql(f'INSERT INTO lead ({names}) SELECT {names} FROM lead_rebuild')
+        connection.exec_driver_sql('DROP TABLE lead_rebuild')
+        # Start above every id already used, including archived ones
+        if inspector.has_table('lead_archive'):
+            connection.exec_driver_sql("DELETE FROM sqlite_sequence WHERE name = 'lead'")
+            connection.exec_driver_sql(
+                "INSERT INTO sqlite_sequence (name, seq) SELECT 'lead', max("
+                "(SELECT coalesce(max(id), 0) FROM lead), (SELECT coalesce(max(id), 0) FROM lead_archive))")
+
+def ensure_lead_search_index(engine):
+    """Create the lead text index: FTS5 kept in sync by triggers on SQLite, FULLTEXT on MySQL."""
+    inspector = db.inspect(engine)
+    with engine.begin() as connection:
+        if engine.dialect.name == 'sqlite':
+            if not inspector.has_table('lead_fts'):
+                for statement in SQLITE_SEARCH_DDL:
+                    connection.exec_driver_sql(statement)
+        elif engine.dialect.name == 'mysql':
+            if 'ft_lead_search' not in {index['name'] for index in inspector.get_indexes('lead')}:
+                connection.exec_driver_sql(
+                    f'ALTER TABLE lead ADD FULLTEXT INDEX ft_lead_search ({", ".join(SEARCH_COLUMNS)})')
+
+def _search_terms(query):
+    return re.findall(r'\w+', query.lower())
+
+def _like_search_lead_ids(terms, assigned_to_id=None, limit=20, offset=0):
+    """Unindexed search for databases without a full-text index: every term
+    appears somewhere in the searched columns, ranked by how many columns match."""
+    matches = [[getattr(Lead, column).ilike(f'%{term}%'.replace('_', r'\_'), escape='\\')
+                for column in SEARCH_COLUMNS] for term in terms]
+    rank = sum(db.case((match, 1), else_=0) for columns in matches for match in columns).label('rank')
+    statement = (db.select(Lead.id, rank).where(*[db.or_(*columns) for columns in matches])
+                 .order_by(rank.desc(), Lead.id.desc()).limit(limit).offset(offset))
+    if assigned_to_id is not None:
+        statement = statement.where(Lead.assigned_to_id == assigned_to_id)
+    return [tuple(row) for row in db.session.execute(statement)]
+
+def search_lead_ids(query, assigned_to_id=None, limit=20, offset=0):
+    """Return [(lead_id, rank)] best match first; every term matches as a prefix.
+
+    Databases other than SQLite and MySQL fall back to a LIKE scan, where a
+    term may match anywhere in a word.
+    """
+    terms = _search_terms(query)
+    if not terms:
+        return []
+    dialect_name = db.engines['leads'].dialect.name
+    params = {'limit': limit, 'offset': offset}
+    scope = ''
+    if assigned_to_id is not None:
+        scope = 'AND lead.assigned_to_id = :assigned_to_id'
+        params['assigned_to_id'] = assigned_to_id
+    if dialect_name == 'sqlite':
+        params['terms'] = ' '.join(f'"{term}"*' for term in terms)
+        statement = f"""
+            SELECT lead.id, -bm25(lead_fts) AS rank
+            FROM lead_fts JOIN lead ON lead.id = lead_fts.rowid
+            WHERE lead_fts MATCH :terms {scope}
+            ORDER BY bm25(lead_fts), lead.id DESC
+            LIMIT :limit OFFSET :offset"""
+    elif dialect_name == 'mysql':
+        params['terms'] = ' '.join(f'+{term}*' for term in terms)
+        match = f'MATCH ({", ".join(SEARCH_COLUMNS)}) AGAINST (:terms IN BOOLEAN MODE)'
+        statement = f"""
+            SELECT lead.id, {match} AS rank
+            FROM lead
+            WHERE {match} {scope}
+            ORDER BY rank DESC, lead.id DESC
+            LIMIT :limit OFFSET :offset"""
+    else:
+        return _like_search_lead_ids(terms, assigned_to_id, limit, offset)
+    return [tuple(row) for row in db.session.execute(db.text(statement), params,
+                                                   bind_arguments={'mapper': Lead})]
+
+def init_db():
+    """Create missing tables, columns and indexes and the default admin user.
+
+    Idempotent; run it with ``flask init-db`` on deploy and after upgrades.
+    """
+    # Create tables for SQLite database (User model)
+    db.create_all()
+    print('SQLite database initialized successfully')
+
+    # Create default admin user if it doesn't exist
+    admin_user = User.query.filter_by(username='admin').first()
+    if not admin_user:
+        admin_user = User(username='admin', email='admin@example.com', role='admin')
+        admin_user.set_password('admin')
+        db.session.add(admin_user)
+        db.session.commit()
+        print('Default admin user created successfully')
+
+    # Create tables for MySQL database (Lead and MySQLUser models)
+    if 'leads' in current_app.config['SQLALCHEMY_BINDS']:
+        leads_engine = db.engines['leads']
+        # First create the user table in MySQL
+        db.Table('user', db.metadata,
+            db.Column('id', db.Integer, primary_key=True),
+            db.Column('username', db.String(80)),
+            db.Column('email', db.String(120)),
+            db.Column('role', db.String(20)),
+            db.Column('created_at', db.DateTime, default=datetime.utcnow),
+            extend_existing=True
+        ).create(bind=leads_engine, checkfirst=True)
+
+        # Then create MySQLUser and Lead tables
+        MySQLUser.__table__.create(bind=leads_engine, checkfirst=True)
+        Lead.__table__.create(bind=leads_engine, checkfirst=True)
+        # Add columns and indexes missing from tables created by older versions
+        add_missing_columns(leads_engine, Lead.__table__)
+        for index in Lead.__table__.indexes:
+            index.create(bind=leads_engine, checkfirst=True)
+        lead_archive.create(bind=leads_engine, checkfirst=True)
+        add_missing_columns(leads_engine, lead_archive)
+        for index in lead_archive.indexes:
+            index.create(bind=leads_engine, checkfirst=True)
+        ensure_lead_autoincrement(leads_engine)
+        LeadStageCount.__table__.create(bind=leads_engine, checkfirst=True)
+        LeadScoreHistory.__table__.create(bind=leads_engine, checkfirst=True)
+        LeadDuplicate.__table__.create(bind=leads_engine, checkfirst=True)
+        LeadChange.__table__.create(bind=leads_engine, checkfirst=True)
+        AuditEvent.__table__.create(bind=leads_engine, checkfirst=True)
+        LeadStageTransition.__table__.create(bind=leads_engine, checkfirst=True)
+        LeadStageDaily.__table__.create(bind=leads_engine, checkfirst=True)
+        for model in (WebhookEndpoint, WebhookOutbox, WebhookDelivery, WebhookAttempt, EnrichmentJob):
+            model.__table__.create(bind=leads_engine, checkfirst=True)
+        ensure_lead_search_index(leads_engine)
+        # Populate the pipeline summary the first time it is deployed
+        if LeadStageCount.query.first() is None and Lead.query.first() is not None:
+            rebuild_pipeline_summary()
+            db.session.commit()
+        # Leads from before stage history start the clock at their creation
+        db.session.execute(db.update(Lead).where(Lead.stage_changed_at.is_(None))
+                           .values(stage_changed_at=Lead.created_at)
+                           .execution_options(synchronize_session=False))
+        if LeadStageDaily.query.first() is None and Lead.query.first() is not None:
+            backfill_stage_transitions()
+            rebuild_stage_rollups()
+        db.session.commit()
+        print('MySQL database initialized successfully')
+
+class CachedUser(UserMixin):
+    """Detached identity of an authenticated user, safe to share between requests."""
+
+    def __init__(self, id, username, role):
+        self.id = id
+        self.username = username
+        self.role = role
+
+class UserIdentityCache:
+    """Bounded LRU of user identities whose entries expire after ``ttl`` seconds."""
+
+    def __init__(self, max_size=1024, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def init_app(self, app):
+        self.max_size = app.config.get('USER_CACHE_SIZE', self.max_size)
+        self.ttl = app.config.get('USER_CACHE_TTL', self.ttl)
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and time.monotonic() - entry[1] <= self.ttl:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[user_id]
+            self.misses += 1
+            return None
+
+    def put(self, identity):
+        with self._lock:
+            self._entries[identity.id] = (identity, time.monotonic())
+            self._entries.move_to_end(identity.id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'max_size': self.max_size,
+                    'hits': self.hits, 'misses': self.misses}
+
+user_cache = UserIdentityCache()
+
+@db.event.listens_for(User, 'after_update')
+@db.event.listens_for(User, 'after_delete')
+def _invalidate_cached_user(mapper, connection, target):
+    user_cache.invalidate(target.id)
+
+@login_manager.user_loader
+def load_user(id):
+    user_id = int(id)
+    identity = user_cache.get(user_id)
+    if identity is None:
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None
+        identity = CachedUser(user.id, user.username, user.role)
+        user_cache.put(identity)
+    return identity
+
+# Lead query helpers
+LEADS_PAGE_SIZE = 50
+LEADS_MAX_PAGE_SIZE = 500
+
+def _parse_datetime_arg(args, name):
+    value = args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'Invalid {name}: expected an ISO 8601 date or datetime')
+
+def _parse_int_arg(args, name):
+    value = args.get(name)
+    if value is None or value == '':
+        return None
     try:
-        # Create tables for SQLite database (User model)
-        db.create_all()
-        print('SQLite database initialized successfully')
+        return int(value)
+    except ValueError:
+        raise ValueError(f'Invalid {name}: expected an integer')
+
+LEAD_TEXT_FILTERS = ('name', 'company', 'email')
+
+def lead_filters_from_args(args):
+    """Build SQL conditions for the stage, assignee, creator, date and text filters.
+
+    ``stage`` may be repeated, ``assigned_to_id=none`` selects unassigned leads
+    and ``name``, ``company`` and ``email`` match substrings case-insensitively.
+    Raises ValueError on malformed input.
+    """
+    filters = []
+    for field in LEAD_TEXT_FILTERS:
+        value = args.get(field, '').strip()
+        if value:
+            pattern = value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            filters.append(getattr(Lead, field).ilike(f'%{pattern}%', escape='\\'))
+    stages = [stage for stage in args.getlist('stage') if stage]
+    if stages:
+        filters.append(Lead.stage.in_(stages))
+    if args.get('assigned_to_id', '').lower() in ('none', 'null'):
+        filters.append(Lead.assigned_to_id.is_(None))
+    else:
+        assigned_to_id = _parse_int_arg(args, 'assigned_to_id')
+        if assigned_to_id is not None:
+            filters.append(Lead.assigned_to_id == assigned_to_id)
+    created_by_id = _parse_int_arg(args, 'created_by_id')
+    if created_by_id is not None:
+        filters.append(Lead.created_by_id == created_by_id)
+    created_after = _parse_datetime_arg(args, 'created_after')
+    if created_after is not None:
+        filters.append(Lead.created_at >= created_after)
+    created_before = _parse_datetime_arg(args, 'created_before')
+    if created_before is not None:
+        filters.append(Lead.created_at < created_before)
+    return filters
+
+LEAD_SORT_COLUMNS = {'created_at': Lead.created_at, 'score': Lead.score}
+
+def encode_lead_cursor(lead, sort='created_at'):
+    payload = json.dumps([sort, _export_value(getattr(lead, sort)), lead.id])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+def decode_lead_cursor(cursor):
+    """Return (sort, value, lead_id) from a cursor."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded))
+        # Cursors issued before score sorting carry only (created_at, id)
+        sort, value, lead_id = payload if len(payload) == 3 else ['created_at'] + payload
+        return sort, _cursor_value(LEAD_SORT_COLUMNS[sort], value), int(lead_id)
+    except (ValueError, TypeError, KeyError):
+        raise ValueError('Invalid cursor')
+
+def lead_keyset_after(created_at, lead_id):
+    """Keyset condition for rows following (created_at, id) in DESC order."""
+    return db.or_(
+        Lead.created_at < created_at,
+        db.and_(Lead.created_at == created_at, Lead.id < lead_id)
+    )
+
+def after_lead_cursor(cursor, sort='created_at'):
+    cursor_sort, value, lead_id = decode_lead_cursor(cursor)
+    if cursor_sort != sort:
+        raise ValueError('Cursor does not match sort')
+    if sort == 'created_at':
+        return lead_keyset_after(value, lead_id)
+    return _table_keyset_after(LEAD_SORT_COLUMNS[sort], Lead.id, value, lead_id, descending=True)
+
+def on_lead_archive(clause):
+    """``clause`` with lead columns replaced by the matching lead_archive columns."""
+    def replace(element):
+        if isinstance(element, db.Column) and element.table is Lead.__table__:
+            return lead_archive.c[element.name]
+        return None
+    return visitors.replacement_traverse(clause, {}, replace)
+
+def _archived_lead_page(filters, limit, sort, names=None):
+    """Top ``limit`` rows of lead and lead_archive, each read through its own indexes, then merged."""
+    names = names or Lead.__table__.columns.keys()
+    order = [LEAD_SORT_COLUMNS[sort].desc(), Lead.id.desc()]
+    active = (db.select(*[Lead.__table__.c[name] for name in names], db.literal(False, db.Boolean).label('archived'))
+              .where(*filters).order_by(*order).limit(limit))
+    archived = (db.select(*[lead_archive.c[name] for name in names],
+                          db.literal(True, db.Boolean).label('archived'))
+                .where(*[on_lead_archive(condition) for condition in filters])
+                .order_by(*[on_lead_archive(column) for column in order]).limit(limit))
+    leads = db.union_all(db.select(active.subquery()), db.select(archived.subquery())).subquery('leads')
+    return db.session.execute(
+        db.select(leads).order_by(leads.c[sort].desc(), leads.c.id.desc()).limit(limit),
+        bind_arguments={'mapper': Lead}
+    ).all()
+
+def lead_page(filters, limit=LEADS_PAGE_SIZE, sort='created_at', include_archived=False, fields=None):
+    """Return (leads, next_cursor) for one page, newest first by ``sort``.
+
+    With ``include_archived``, archived leads are merged in and the page holds
+    rows (with an ``archived`` flag) rather than Lead instances. With
+    ``fields``, only those columns (plus id and the sort key) are read, as rows.
+    """
+    # Fetch one extra row to learn whether another page exists
+    if include_archived:
+        names = [column.key for column in lead_columns(fields, sort)] if fields else None
+        leads = _archived_lead_page(filters, limit + 1, sort, names)
+    elif fields:
+        leads = db.session.execute(
+            db.select(*lead_columns(fields, sort)).where(*filters)
+            .order_by(LEAD_SORT_COLUMNS[sort].desc(), Lead.id.desc()).limit(limit + 1)
+        ).all()
+    else:
+        leads = (Lead.query.filter(*filters)
+                 .order_by(LEAD_SORT_COLUMNS[sort].desc(), Lead.id.desc())
+                 .limit(limit + 1).all())
+    next_cursor = encode_lead_cursor(leads[limit - 1], sort) if len(leads) > limit else None
+    return leads[:limit], next_cursor
+
+def lead_row_context(leads):
+    """Template context for lead_rows.html, with assignee names loaded in one query."""
+    assignees = {}
+    assignee_ids = {lead.assigned_to_id for lead in leads if lead.assigned_to_id}
+    if assignee_ids and current_user.role == 'admin':
+        assignees = dict(db.session.execute(
+            db.select(MySQLUser.id, MySQLUser.username).where(MySQLUser.id.in_(assignee_ids))
+        ).all())
+    return {'leads': leads, 'assignees': assignees}
 
-        # Create default admin user if it doesn't exist
-        admin_user = User.query.filter_by(username='admin').first()
-        if not admin_user:
-            admin_user = User(username='admin', email='admin@example.com', role='admin')
-            admin_user.set_password('admin')
-            db.session.add(admin_user)
+def render_lead_rows(leads):
+    return render_template('lead_rows.html', **lead_row_context(leads))
+
+# Lead export helpers
+EXPORT_BATCH_SIZE = 1000
+EXPORT_FIELDS = ('id', 'name', 'company', 'email', 'phone', 'stage', 'notes',
+                 'created_by_id', 'assigned_to_id', 'created_at', 'updated_at')
+
+def iter_lead_rows(filters, batch_size=EXPORT_BATCH_SIZE):
+    """Yield export rows in (created_at, id) DESC order, one keyset batch at a time.
+
+    Only plain column tuples are loaded, so memory stays bounded by the batch
+    size no matter how many leads match.
+    """
+    columns = [getattr(Lead, field) for field in EXPORT_FIELDS]
+    keyset = []
+    while True:
+        query = (db.select(*columns)
+                 .where(*filters, *keyset)
+                 .order_by(Lead.created_at.desc(), Lead.id.desc())
+                 .limit(batch_size))
+        batch = db.session.execute(query).all()
+        if not batch:
+            return
+        yield from batch
+        if len(batch) < batch_size:
+            return
+        last = batch[-1]
+        keyset = [lead_keyset_after(last.created_at, last.id)]
+
+def _export_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+def iter_ndjson_export(rows):
+    for row in rows:
+        yield json.dumps({field: _export_value(value) for field, value in zip(EXPORT_FIELDS, row)}) + '\n'
+
+def iter_csv_export(rows, batch_size=EXPORT_BATCH_SIZE):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    for count, row in enumerate(rows, 1):
+        writer.writerow([_export_value(value) for value in row])
+        if count % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def iter_gzip(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+# Lead import helpers
+IMPORT_BATCH_SIZE = 1000
+IMPORT_MAX_ERRORS = 1000
+IMPORT_FIELDS = ('name', 'company', 'email', 'phone', 'stage', 'notes', 'industry', 'source')
+
+def iter_import_records(stream, import_format):
+    """Yield (row_number, record) pairs from a CSV or NDJSON byte stream."""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if import_format == 'csv':
+        for row_number, record in enumerate(csv.DictReader(text), 1):
+            yield row_number, record
+        return
+    for row_number, line in enumerate(text, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        yield row_number, record if isinstance(record, dict) else None
+
+def _clean_import_record(record):
+    """Return (values, error) for one uploaded record."""
+    if record is None:
+        return None, 'Malformed record'
+    values = {}
+    for field in IMPORT_FIELDS:
+        value = record.get(field)
+        if isinstance(value, (dict, list)):
+            return None, f'{field} must be a string, number or null'
+        if value is not None and not isinstance(value, str):
+            value = str(value)
+        value = value.strip() if value else None
+        max_length = Lead.__table__.c[field].type.length
+        if value and max_length and len(value) > max_length:
+            return None, f'{field} exceeds {max_length} characters'
+        values[field] = value
+    if not values['name']:
+        return None, 'Name is required'
+    values['email'] = normalize_email(values['email'])
+    values['stage'] = values['stage'] or 'New'
+    values['source'] = values['source'] or 'import'
+    return values, None
+
+def _existing_contact_keys(emails, phones):
+    """Look up which email and phone keys from a batch already exist in the lead table."""
+    existing_emails, existing_phones = set(), set()
+    if emails:
+        query = db.select(Lead.email_key).where(Lead.email_key.in_(emails))
+        existing_emails = set(db.session.scalars(query))
+    if phones:
+        query = db.select(Lead.phone_key).where(Lead.phone_key.in_(phones))
+        existing_phones = set(db.session.scalars(query))
+    return existing_emails, existing_phones
+
+def insert_lead_rows(rows):
+    """INSERT ``rows`` into lead in the session's transaction and return their ids.
+
+    Ids come from executemany RETURNING where the database supports it and
+    from each row's cursor otherwise (MySQL), never from an id range, which
+    would also take in leads inserted concurrently.
+    """
+    table = Lead.__table__
+    if db.engines['leads'].dialect.insert_executemany_returning:
+        return db.session.execute(table.insert().returning(table.c.id), rows,
+                                  bind_arguments={'mapper': Lead}).scalars().all()
+    return [db.session.execute(table.insert(), row, bind_arguments={'mapper': Lead}).inserted_primary_key[0]
+            for row in rows]
+
+class LeadImporter:
+    """Insert uploaded lead records in batches, one transaction per batch.
+
+    Rows are deduplicated on normalized email and phone, both within the
+    upload and against leads already stored.
+    """
+
+    def __init__(self, created_by_id, batch_size=IMPORT_BATCH_SIZE):
+        self.created_by_id = created_by_id
+        self.batch_size = batch_size
+        self.seen_emails = set()
+        self.seen_phones = set()
+        self.batch = []
+        self.imported = 0
+        self.skipped = 0
+        self.errors = []
+
+    def add_error(self, row_number, message):
+        self.skipped += 1
+        if len(self.errors) < IMPORT_MAX_ERRORS:
+            self.errors.append({'row': row_number, 'error': message})
+
+    def add(self, row_number, record):
+        values, error = _clean_import_record(record)
+        if error:
+            self.add_error(row_number, error)
+            return
+        values.update(lead_blocking_keys(values['email'], values['phone'], values['company']))
+        email, phone = values['email_key'], values['phone_key']
+        if email and email in self.seen_emails:
+            self.add_error(row_number, f'Duplicate email in file: {email}')
+            return
+        if phone and phone in self.seen_phones:
+            self.add_error(row_number, f'Duplicate phone in file: {values["phone"]}')
+            return
+        if email:
+            self.seen_emails.add(email)
+        if phone:
+            self.seen_phones.add(phone)
+        self.batch.append((row_number, values))
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.batch:
+            return
+        batch, self.batch = self.batch, []
+        emails = {values['email_key'] for _, values in batch if values['email_key']}
+        phones = {values['phone_key'] for _, values in batch if values['phone_key']}
+        existing_emails, existing_phones = _existing_contact_keys(emails, phones)
+
+        rows, row_numbers = [], []
+        for row_number, values in batch:
+            if values['email_key'] and values['email_key'] in existing_emails:
+                self.add_error(row_number, f'Lead with email {values["email"]} already exists')
+            elif values['phone_key'] and values['phone_key'] in existing_phones:
+                self.add_error(row_number, f'Lead with phone {values["phone"]} already exists')
+            else:
+                rows.append(dict(values, created_by_id=self.created_by_id, is_custom=False))
+                row_numbers.append(row_number)
+        if not rows:
+            return
+        scored_at = datetime.utcnow()
+        for row, (score, _) in zip(rows, score_rows(rows)):
+            row.update(score=score, scored_at=scored_at)
+        try:
+            ids = insert_lead_rows(rows)
+            apply_stage_count_deltas(leads_connection(),
+                                     Counter(_stage_key(row['stage'], None) for row in rows))
+            enqueue_enrichment(leads_connection(), ids)
+            log_lead_changes(leads_connection(), Lead.id.in_(ids))
+            record_created_leads(leads_connection(), Lead.id.in_(ids))
+            write_created_events(leads_connection(), Lead.id.in_(ids))
             db.session.commit()
-            print('Default admin user created successfully')
+            invalidate_lead_cache()
+            self.imported += len(rows)
+        except Exception as e:
+            db.session.rollback()
+            for row_number in row_numbers:
+                self.add_error(row_number, f'Insert failed: {str(e)}')
 
-        # Create tables for MySQL database (Lead and MySQLUser models)
-        if 'leads' in app.config['SQLALCHEMY_BINDS']:
-            try:
-                leads_engine = db.engines['leads']
-                # First create the user table in MySQL
-                db.Table('user', db.metadata,
-                    db.Column('id', db.Integer, primary_key=True),
-                    db.Column('username', db.String(80)),
-                    db.Column('email', db.String(120)),
-                    db.Column('role', db.String(20)),
-                    db.Column('created_at', db.DateTime, default=datetime.utcnow),
-                    extend_existing=True
-                ).create(bind=leads_engine, checkfirst=True)
-                
-                # Then create MySQLUser and Lead tables
-                MySQLUser.__table__.create(bind=leads_engine, checkfirst=True)
-                Lead.__table__.create(bind=leads_engine, checkfirst=True)
-                print('MySQL database initialized successfully')
-            except Exception as mysql_error:
-                print(f'Error initializing MySQL database: {str(mysql_error)}')
-                app.config['SQLALCHEMY_BINDS'] = {}
-                print('Disabled MySQL bindings due to connection error...')
-    except Exception as e:
-        print(f'Error initializing database: {str(e)}')
-        app.config['SQLALCHEMY_BINDS'] = {}
-        print('Falling back to SQLite only mode...')
+    def report(self):
+        return {
+            'imported': self.imported,
+            'skipped': self.skipped,
+            'errors': self.errors,
+            'errors_truncated': self.skipped > len(self.errors)
+        }
 
+# Duplicate detection
+DEDUPE_BATCH_SIZE = 1000
+DUPLICATE_MATCH_LIMIT = 20
 
-# Initialize Flask-Login
-login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = 'login'
+def _duplicate_conditions(email_key, phone_key, company_key, name):
+    conditions = []
+    if email_key:
+        conditions.append(('email', Lead.email_key == email_key))
+    if phone_key:
+        conditions.append(('phone', Lead.phone_key == phone_key))
+    if company_key and name:
+        conditions.append(('company', db.and_(Lead.company_key == company_key,
+                                              db.func.lower(Lead.name) == name.strip().lower())))
+    return conditions
+
+def find_duplicate_ids(lead):
+    """Ids of leads sharing a blocking key with ``lead``, found through the key indexes."""
+    conditions = _duplicate_conditions(lead.email_key, lead.phone_key, lead.company_key, lead.name)
+    if not conditions:
+        return {}
+    matches = {}
+    for match_key, condition in conditions:
+        query = db.select(Lead.id).where(condition, Lead.id != lead.id).limit(DUPLICATE_MATCH_LIMIT)
+        for lead_id in db.session.scalars(query):
+            matches.setdefault(lead_id, []).append(match_key)
+    return matches
+
+def record_duplicate_candidates(lead):
+    """Add a newly flushed lead to the merge-candidate cluster of its matches."""
+    matches = find_duplicate_ids(lead)
+    if not matches:
+        return []
+    existing = {row.lead_id: row for row in LeadDuplicate.query.filter(LeadDuplicate.lead_id.in_(matches))}
+    cluster_id = min([row.cluster_id for row in existing.values()] + list(matches))
+    match_keys = ','.join(sorted({key for keys in matches.values() for key in keys}))
+    db.session.add(LeadDuplicate(lead_id=lead.id, cluster_id=cluster_id, match_keys=match_keys))
+    for lead_id, keys in matches.items():
+        if lead_id not in existing:
+            db.session.add(LeadDuplicate(lead_id=lead_id, cluster_id=cluster_id, match_keys=','.join(keys)))
+    return sorted(matches)
+
+def backfill_blocking_keys(batch_size=DEDUPE_BATCH_SIZE):
+    """Compute blocking keys for leads written without them, in id-ordered batches."""
+    missing = db.or_(
+        db.and_(Lead.email_key.is_(None), Lead.email.isnot(None)),
+        db.and_(Lead.phone_key.is_(None), Lead.phone.isnot(None)),
+        db.and_(Lead.company_key.is_(None), Lead.company.isnot(None)),
+    )
+    last_id, updated = 0, 0
+    while True:
+        rows = db.session.execute(
+            db.select(Lead.id, Lead.email, Lead.phone, Lead.company)
+            .where(missing, Lead.id > last_id).order_by(Lead.id).limit(batch_size)
+        ).all()
+        if not rows:
+            return updated
+        update_lead_columns([dict(lead_blocking_keys(row.email, row.phone, row.company), id=row.id)
+                             for row in rows])
+        db.session.commit()
+        updated += len(rows)
+        last_id = rows[-1].id
+
+def rebuild_duplicate_clusters(batch_size=DEDUPE_BATCH_SIZE):
+    """Rebuild lead_duplicate by grouping on each blocking key and merging groups with union-find.
+
+    Each key costs one GROUP BY over an indexed column, so no pairwise
+    comparison of leads is needed. Returns the number of clusters found.
+    """
+    parent = {}
+    match_keys = {}
+
+    def find(lead_id):
+        root = lead_id
+        while parent.setdefault(root, root) != root:
+            root = parent[root]
+        while parent[lead_id] != root:
+            parent[lead_id], lead_id = root, parent[lead_id]
+        return root
+
+    name_key = db.func.lower(Lead.name)
+    blocks = [
+        ('email', [Lead.email_key]),
+        ('phone', [Lead.phone_key]),
+        ('company', [Lead.company_key, name_key]),
+    ]
+    for match_key, columns in blocks:
+        duplicated = (db.select(*columns)
+                      .where(*[column.isnot(None) for column in columns])
+                      .group_by(*columns).having(db.func.count(Lead.id) > 1).subquery())
+        query = (db.select(Lead.id, *columns)
+                 .join(duplicated, db.and_(*[column == duplicated.c[index] for index, column in enumerate(columns)]))
+                 .order_by(*columns, Lead.id))
+        previous_block, first_id = None, None
+        for row in db.session.execute(query.execution_options(yield_per=batch_size)):
+            lead_id, block = row[0], tuple(row[1:])
+            match_keys.setdefault(lead_id, set()).add(match_key)
+            if block != previous_block:
+                previous_block, first_id = block, lead_id
+            else:
+                root, other = find(first_id), find(lead_id)
+                if root != other:
+                    parent[max(root, other)] = min(root, other)
+
+    db.session.execute(db.delete(LeadDuplicate))
+    detected_at = datetime.utcnow()
+    rows = [{'lead_id': lead_id, 'cluster_id': find(lead_id),
+             'match_keys': ','.join(sorted(match_keys[lead_id])), 'detected_at': detected_at}
+            for lead_id in list(parent)]
+    for start in range(0, len(rows), batch_size):
+        db.session.execute(db.insert(LeadDuplicate), rows[start:start + batch_size])
+    db.session.commit()
+    return len({row['cluster_id'] for row in rows})
+
+DUPLICATE_SUMMARY_FIELDS = ('id', 'name', 'company', 'email', 'phone', 'stage')
+
+def _duplicate_summary(lead):
+    return lead_to_dict(lead, DUPLICATE_SUMMARY_FIELDS)
+
+# Lead assignment helpers
+ASSIGN_STRATEGIES = ('round_robin', 'least_loaded')
+CLOSED_STAGES = ('Closed Won', 'Closed Lost')
+UPDATE_CHUNK_SIZE = 500
+
+def open_lead_counts(client_ids):
+    """Count open leads per client with a single aggregate query."""
+    query = (db.select(Lead.assigned_to_id, db.func.count(Lead.id))
+             .where(Lead.assigned_to_id.in_(client_ids), Lead.stage.notin_(CLOSED_STAGES))
+             .group_by(Lead.assigned_to_id))
+    counts = dict.fromkeys(client_ids, 0)
+    counts.update(db.session.execute(query).all())
+    return counts
+
+def distribute_leads(lead_ids, client_ids, strategy, loads=None):
+    """Split ``lead_ids`` between clients, returning {client_id: [lead_id, ...]}."""
+    allocation = {client_id: [] for client_id in client_ids}
+    if strategy == 'round_robin':
+        for position, lead_id in enumerate(lead_ids):
+            allocation[client_ids[position % len(client_ids)]].append(lead_id)
+        return allocation
+    heap = [(loads.get(client_id, 0), client_id) for client_id in client_ids]
+    heapq.heapify(heap)
+    for lead_id in lead_ids:
+        load, client_id = heapq.heappop(heap)
+        allocation[client_id].append(lead_id)
+        heapq.heappush(heap, (load + 1, client_id))
+    return allocation
+
+def assign_lead_ids(allocation):
+    """Apply an allocation with one UPDATE per client and chunk of ids."""
+    now = datetime.utcnow()
+    for client_id, lead_ids in allocation.items():
+        for start in range(0, len(lead_ids), UPDATE_CHUNK_SIZE):
+            chunk = lead_ids[start:start + UPDATE_CHUNK_SIZE]
+            deltas = Counter()
+            previous = (db.select(Lead.stage, Lead.assigned_to_id, db.func.count(Lead.id))
+                        .where(Lead.id.in_(chunk))
+                        .group_by(Lead.stage, Lead.assigned_to_id))
+            for stage, assigned_to_id, count in db.session.execute(previous):
+                deltas[_stage_key(stage, assigned_to_id)] -= count
+                deltas[_stage_key(stage, client_id)] += count
+            apply_stage_count_deltas(leads_connection(), deltas)
+            log_lead_changes(leads_connection(), Lead.id.in_(chunk), assign_to=client_id)
+            db.session.execute(
+                db.update(Lead)
+                .where(Lead.id.in_(chunk))
+                .values(assigned_to_id=client_id, version=Lead.version + 1, updated_at=now)
+                .execution_options(synchronize_session=False)
+            )
+
+# Batch lead updates with optimistic version checks
+LEAD_PATCH_FIELDS = ('name', 'company', 'email', 'phone', 'notes', 'stage', 'industry', 'assigned_to_id')
+LEAD_PATCH_MAX_ITEMS = 1000
+
+def _is_int(value):
+    # JSON true/false arrive as bools, which are ints to isinstance
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def _check_patch_item(item, is_admin):
+    """Return (status, error) for a malformed or disallowed PATCH item, else (None, None)."""
+    if not isinstance(item, dict) or not _is_int(item.get('id')):
+        return 'invalid', 'id is required'
+    if 'version' in item:
+        if not _is_int(item['version']):
+            return 'invalid', 'version must be an integer'
+    elif not isinstance(item.get('updated_at'), str):
+        return 'invalid', 'version or updated_at is required'
+    fields = set(item) - {'id', 'version', 'updated_at'}
+    unknown = fields - set(LEAD_PATCH_FIELDS)
+    if unknown:
+        return 'invalid', f'Unknown fields: {", ".join(sorted(unknown))}'
+    if not fields:
+        return 'invalid', 'No fields to update'
+    for field in fields:
+        value = item[field]
+        if field == 'assigned_to_id':
+            if value is not None and not _is_int(value):
+                return 'invalid', 'assigned_to_id must be an integer or null'
+        elif value is not None and not isinstance(value, str):
+            return 'invalid', f'{field} must be a string or null'
+    if 'name' in item and not item['name']:
+        return 'invalid', 'name cannot be empty'
+    if 'assigned_to_id' in item and not is_admin:
+        return 'forbidden', 'Only admins can assign leads'
+    return None, None
+
+def _lead_version_matches(lead, item):
+    if 'version' in item:
+        return lead.version == item['version']
+    return lead.updated_at is not None and lead.updated_at.isoformat() == item['updated_at']
+
+def apply_lead_patches(items, user):
+    """Check versions and apply PATCH items in the current transaction; returns one result per item.
+
+    The leads are read once and locked (FOR UPDATE where the database supports
+    it). Items that only reassign leads run as one compare-and-set UPDATE per
+    assignee. Other changes go through the ORM, so scores, duplicate keys,
+    pipeline counts and webhook events stay in step, and flush as batched
+    UPDATEs. A lead modified concurrently raises StaleDataError on flush.
+    """
+    is_admin = user.role == 'admin'
+    results = [None] * len(items)
+    checked = []
+    for position, item in enumerate(items):
+        status, error = _check_patch_item(item, is_admin)
+        if status:
+            results[position] = {'id': item.get('id') if isinstance(item, dict) else None,
+                                 'status': status, 'error': error}
+        else:
+            checked.append((position, item))
+
+    ids = {item['id'] for _, item in checked}
+    leads = {lead.id: lead for lead in Lead.query.filter(Lead.id.in_(ids)).with_for_update()} if ids else {}
+    assignee_ids = {item['assigned_to_id'] for _, item in checked if item.get('assigned_to_id') is not None}
+    clients = set(db.session.execute(
+        db.select(MySQLUser.id).where(MySQLUser.id.in_(assignee_ids), MySQLUser.role == 'client')
+    ).scalars()) if assignee_ids else set()
+
+    assignments, changed, seen = {}, [], set()
+    for position, item in checked:
+        lead = leads.get(item['id'])
+        result = results[position] = {'id': item['id']}
+        if lead is None:
+            result.update(status='not_found')
+        elif item['id'] in seen:
+            result.update(status='invalid', error='Lead appears more than once')
+        elif not is_admin and lead.assigned_to_id != user.id:
+            result.update(status='forbidden', error='Access denied')
+        elif not _lead_version_matches(lead, item):
+            result.update(status='conflict', version=lead.version,
+                          updated_at=lead.updated_at.isoformat() if lead.updated_at else None)
+        elif item.get('assigned_to_id') is not None and item['assigned_to_id'] not in clients:
+            result.update(status='invalid', error='Can only assign leads to clients')
+        else:
+            changes = {field: item[field] for field in LEAD_PATCH_FIELDS if field in item}
+            if list(changes) == ['assigned_to_id']:
+                assignments.setdefault(changes['assigned_to_id'], []).append((position, lead))
+            else:
+                for field, value in changes.items():
+                    setattr(lead, field, value)
+                changed.append((position, lead))
+        seen.add(item['id'])
+
+    now = datetime.utcnow()
+    for client_id, entries in assignments.items():
+        pairs = [(lead.id, lead.version) for _, lead in entries]
+        updated = db.session.execute(
+            db.update(Lead)
+            .where(db.tuple_(Lead.id, Lead.version).in_(pairs))
+            .values(assigned_to_id=client_id, version=Lead.version + 1, updated_at=now)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        done = {lead_id for lead_id, _ in pairs}
+        if updated != len(pairs):
+            # Without row locks (SQLite) another writer can win between the check and the
+            # update; the rows this statement changed are the ones stamped with ``now``
+            done = set(db.session.execute(
+                db.select(Lead.id).where(Lead.id.in_(done), Lead.updated_at == now,
+                                         Lead.assigned_to_id == client_id)
+            ).scalars())
+        deltas, changes = Counter(), []
+        for position, lead in entries:
+            if lead.id in done:
+                deltas[_stage_key(lead.stage, lead.assigned_to_id)] -= 1
+                deltas[_stage_key(lead.stage, client_id)] += 1
+                changes.append({'lead_id': lead.id, 'op': 'upsert', 'assigned_to_id': client_id,
+                                'previous_assigned_to_id': lead.assigned_to_id})
+                results[position].update(status='updated', version=lead.version + 1, updated_at=now.isoformat())
+            else:
+                results[position].update(status='conflict')
+        apply_stage_count_deltas(leads_connection(), deltas)
+        record_lead_changes(leads_connection(), changes)
+
+    if changed:
+        db.session.flush()
+        for position, lead in changed:
+            results[position].update(status='updated', version=lead.version, updated_at=lead.updated_at.isoformat())
+    return results
+
+# Lead archival
+def archivable_lead_conditions(now=None):
+    """Leads to archive: closed ones untouched for ARCHIVE_CLOSED_AFTER_DAYS and, when
+    ARCHIVE_STALE_AFTER_DAYS is set, any lead untouched for that long."""
+    now = now or datetime.utcnow()
+    config = current_app.config
+    touched = db.func.coalesce(Lead.updated_at, Lead.created_at)
+    conditions = [db.and_(Lead.stage.in_(CLOSED_STAGES),
+                          touched < now - timedelta(days=config['ARCHIVE_CLOSED_AFTER_DAYS']))]
+    if config.get('ARCHIVE_STALE_AFTER_DAYS'):
+        conditions.append(touched < now - timedelta(days=config['ARCHIVE_STALE_AFTER_DAYS']))
+    return db.or_(*conditions)
+
+def _stage_deltas(table, ids, sign):
+    deltas = Counter()
+    for stage, assigned_to_id, count in leads_connection().execute(
+            db.select(table.c.stage, table.c.assigned_to_id, db.func.count())
+            .where(table.c.id.in_(ids)).group_by(table.c.stage, table.c.assigned_to_id)):
+        deltas[_stage_key(stage, assigned_to_id)] += sign * count
+    return deltas
+
+def archive_lead_ids(ids):
+    """Move leads to lead_archive in the current transaction; the caller commits.
+
+    Pipeline counts and the change feed treat the leads as deleted, and their
+    queued enrichment jobs and duplicate-cluster rows are dropped.
+    """
+    connection = leads_connection()
+    table = Lead.__table__
+    apply_stage_count_deltas(connection, _stage_deltas(table, ids, -1))
+    record_lead_changes(connection, [
+        {'lead_id': lead_id, 'op': 'delete', 'assigned_to_id': assigned_to_id}
+        for lead_id, assigned_to_id in connection.execute(
+            db.select(table.c.id, table.c.assigned_to_id).where(table.c.id.in_(ids)))
+    ])
+    connection.execute(lead_archive.insert().from_select(
+        list(table.columns.keys()) + ['archived_at'],
+        db.select(*table.columns, db.literal(datetime.utcnow())).where(table.c.id.in_(ids))
+    ))
+    connection.execute(db.delete(EnrichmentJob.__table__).where(
+        EnrichmentJob.lead_id.in_(ids), EnrichmentJob.status == 'pending'))
+    connection.execute(db.delete(LeadDuplicate.__table__).where(LeadDuplicate.lead_id.in_(ids)))
+    connection.execute(db.delete(table).where(table.c.id.in_(ids)))
+
+def archive_leads(batch_size=None, limit=None):
+    """Archive every archivable lead in id-ordered batches, committing each; returns the count."""
+    batch_size = batch_size or current_app.config['ARCHIVE_BATCH_SIZE']
+    condition = archivable_lead_conditions()
+    archived, last_id = 0, 0
+    while limit is None or archived < limit:
+        size = batch_size if limit is None else min(batch_size, limit - archived)
+        ids = db.session.scalars(
+            db.select(Lead.id).where(condition, Lead.id > last_id)
+            .order_by(Lead.id).limit(size)
+        ).all()
+        if not ids:
+            break
+        archive_lead_ids(ids)
+        db.session.commit()
+        archived += len(ids)
+        last_id = ids[-1]
+    return archived
+
+def restore_lead_ids(ids):
+    """Move archived leads back into the lead table; returns (restored, conflicts). The caller commits.
+
+    Restored leads get a new version and updated_at, so clients holding the
+    old version re-read them and the archiver leaves them alone for a while.
+    An archived lead whose id is taken by a lead in the table (possible in
+    SQLite databases created before lead used AUTOINCREMENT) stays archived
+    and is reported as a conflict.
+    """
+    connection = leads_connection()
+    ids = connection.execute(db.select(lead_archive.c.id).where(lead_archive.c.id.in_(ids))).scalars().all()
+    conflicts = connection.execute(db.select(Lead.id).where(Lead.id.in_(ids))).scalars().all() if ids else []
+    ids = sorted(set(ids) - set(conflicts))
+    if not ids:
+        return [], sorted(conflicts)
+    names = list(Lead.__table__.columns.keys())
+    restored = {'version': lead_archive.c.version + 1, 'updated_at': db.literal(datetime.utcnow())}
+    connection.execute(Lead.__table__.insert().from_select(
+        names, db.select(*[restored.get(name, lead_archive.c[name]) for name in names])
+        .where(lead_archive.c.id.in_(ids))
+    ))
+    connection.execute(db.delete(lead_archive).where(lead_archive.c.id.in_(ids)))
+    apply_stage_count_deltas(connection, _stage_deltas(Lead.__table__, ids, 1))
+    log_lead_changes(connection, Lead.id.in_(ids))
+    write_created_events(connection, Lead.id.in_(ids))
+    return ids, sorted(conflicts)
+
+# Audit trail
+AUDIT_PAGE_SIZE = 100
+AUDIT_MAX_PAGE_SIZE = 1000
+
+def audit_event(action, entity_type=None, entity_id=None, actor=None, **details):
+    """Buffer an audit event; it is written in the background, so call it after committing."""
+    if actor is None and has_request_context() and current_user.is_authenticated:
+        actor = current_user
+    audit.record({
+        'occurred_at': datetime.utcnow(),
+        'actor_id': actor.id if actor else None,
+        'actor_username': actor.username if actor else None,
+        'action': action,
+        'entity_type': entity_type,
+        'entity_id': entity_id,
+        'ip_address': request.remote_addr if has_request_context() else None,
+        'details': json.dumps(details, default=str) if details else None,
+    })
+
+def pending_lead_changes(lead):
+    """{field: [old, new]} for unflushed changes to ``lead``; call before committing."""
+    attrs = db.inspect(lead).attrs
+    changes = {}
+    for field in LEAD_PATCH_FIELDS:
+        history = attrs[field].history
+        if history.has_changes():
+            changes[field] = [history.deleted[0] if history.deleted else None,
+                              history.added[0] if history.added else None]
+    return changes
+
+def encode_audit_cursor(event):
+    payload = json.dumps([_export_value(event.occurred_at), event.id])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+def after_audit_cursor(cursor):
+    """Keyset condition for events following a cursor in (occurred_at, id) DESC order."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        occurred_at, event_id = json.loads(base64.urlsafe_b64decode(padded))
+        occurred_at, event_id = datetime.fromisoformat(occurred_at), int(event_id)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    return db.or_(AuditEvent.occurred_at < occurred_at,
+                  db.and_(AuditEvent.occurred_at == occurred_at, AuditEvent.id < event_id))
+
+def audit_filters_from_args(args):
+    filters = []
+    for name in ('actor_id', 'entity_id'):
+        value = _parse_int_arg(args, name)
+        if value is not None:
+            filters.append(getattr(AuditEvent, name) == value)
+    for name in ('action', 'entity_type'):
+        if args.get(name):
+            filters.append(getattr(AuditEvent, name) == args[name])
+    since = _parse_datetime_arg(args, 'since')
+    if since is not None:
+        filters.append(AuditEvent.occurred_at >= since)
+    until = _parse_datetime_arg(args, 'until')
+    if until is not None:
+        filters.append(AuditEvent.occurred_at < until)
+    if args.get('cursor'):
+        filters.append(after_audit_cursor(args['cursor']))
+    return filters
+
+# Dashboard table browser helpers
+DASHBOARD_PAGE_SIZE = 50
+DASHBOARD_MAX_PAGE_SIZE = 500
+# Live session data is never browsable
+DASHBOARD_HIDDEN_TABLES = frozenset(('user_session',))
+
+class SchemaCache:
+    """Reflected table metadata per bind, reloaded after ``ttl`` seconds or on invalidate()."""
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._binds = {}
+
+    def init_app(self, app):
+        self.ttl = app.config.get('SCHEMA_CACHE_TTL', self.ttl)
+
+    def _load(self, bind_key):
+        with self._lock:
+            entry = self._binds.get(bind_key)
+            if entry is None or time.monotonic() - entry['loaded_at'] > self.ttl:
+                engine = _bind_engine(bind_key)
+                entry = {
+                    'loaded_at': time.monotonic(),
+                    'table_names': db.inspect(engine).get_table_names(),
+                    'metadata': db.MetaData(),
+                    'tables': {}
+                }
+                self._binds[bind_key] = entry
+            return entry
+
+    def table_names(self, bind_key=None):
+        return self._load(bind_key)['table_names']
+
+    def table(self, bind_key, table_name):
+        entry = self._load(bind_key)
+        if table_name not in entry['table_names']:
+            return None
+        with self._lock:
+            if table_name not in entry['tables']:
+                entry['tables'][table_name] = db.Table(
+                    table_name, entry['metadata'], autoload_with=_bind_engine(bind_key))
+            return entry['tables'][table_name]
+
+    def invalidate(self, bind_key=None):
+        with self._lock:
+            if bind_key is None:
+                self._binds.clear()
+            else:
+                self._binds.pop(bind_key, None)
+
+schema_cache = SchemaCache()
+
+def _bind_engine(bind_key):
+    return db.engines[bind_key] if bind_key else db.engine
+
+def _dashboard_bind_key(table_name):
+    # The user table is served from SQLite, everything else from the leads bind
+    if table_name == 'user':
+        return None
+    if 'leads' in current_app.config['SQLALCHEMY_BINDS']:
+        return 'leads'
+    raise LookupError('Database connection error')
+
+def dashboard_table_names():
+    names = [name for name in schema_cache.table_names() if name not in DASHBOARD_HIDDEN_TABLES]
+    if 'leads' in current_app.config['SQLALCHEMY_BINDS']:
+        names += [name for name in schema_cache.table_names('leads')
+                  if name not in names and name not in DASHBOARD_HIDDEN_TABLES]
+    return names
+
+def resolve_dashboard_table(table_name):
+    """Return (bind_key, reflected table) for a dashboard table, or None if unknown."""
+    if table_name in DASHBOARD_HIDDEN_TABLES:
+        return None
+    try:
+        bind_key = _dashboard_bind_key(table_name)
+    except LookupError:
+        return None
+    table = schema_cache.table(bind_key, table_name)
+    return (bind_key, table) if table is not None else None
+
+def _primary_key_column(table):
+    pk_columns = list(table.primary_key.columns)
+    if len(pk_columns) != 1:
+        raise ValueError('Only tables with a single-column primary key can be browsed')
+    return pk_columns[0]
+
+def _cursor_value(column, value):
+    if value is None:
+        return None
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return value
+    if python_type is datetime:
+        return datetime.fromisoformat(value)
+    if python_type in (int, float):
+        return python_type(value)
+    return value
+
+def _table_keyset_after(sort_column, pk, value, pk_value, descending):
+    """Keyset condition for rows after (value, pk_value); NULLs sort lowest on SQLite and MySQL."""
+    if descending:
+        if value is None:
+            return db.and_(sort_column.is_(None), pk < pk_value)
+        return db.or_(sort_column < value,
+                      db.and_(sort_column == value, pk < pk_value),
+                      sort_column.is_(None))
+    if value is None:
+        return db.or_(db.and_(sort_column.is_(None), pk > pk_value), sort_column.isnot(None))
+    return db.or_(sort_column > value, db.and_(sort_column == value, pk > pk_value))
+
+def fetch_table_page(bind_key, table, sort, descending, cursor, page_size):
+    """Fetch one page of rows ordered by (sort, primary key) and the cursor for the next page."""
+    pk = _primary_key_column(table)
+    sort_column = table.c[sort] if sort else pk
+    order = [sort_column.desc(), pk.desc()] if descending else [sort_column.asc(), pk.asc()]
+    query = db.select(table).order_by(*order).limit(page_size + 1)
+    if cursor:
+        try:
+            value, pk_value = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+            value, pk_value = _cursor_value(sort_column, value), _cursor_value(pk, pk_value)
+        except (ValueError, TypeError):
+            raise ValueError('Invalid cursor')
+        if sort_column is pk:
+            query = query.where(pk < pk_value if descending else pk > pk_value)
+        else:
+            query = query.where(_table_keyset_after(sort_column, pk, value, pk_value, descending))
+
+    result = db.session.execute(query, bind_arguments={'bind': _bind_engine(bind_key)})
+    rows = [dict(row._mapping) for row in result]
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        payload = json.dumps([_export_value(last[sort_column.name]), _export_value(last[pk.name])])
+        next_cursor = base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+    return rows, next_cursor
+
+def _count_dashboard_lead_row(lead_id, delta):
+    row = db.session.execute(db.select(Lead.stage, Lead.assigned_to_id).where(Lead.id == lead_id)).first()
+    if row is not None:
+        apply_stage_count_deltas(leads_connection(), {_stage_key(*row): delta})
+
+# Lead read cache
+LEADS_CACHE_VERSION_KEY = 'leads:version'
+
+def leads_cache_version():
+    """Current lead data version: the millisecond timestamp of the last lead write."""
+    version = cache.get(LEADS_CACHE_VERSION_KEY)
+    if version is None:
+        # Unknown after a cache flush or restart, so start a fresh version
+        cache.add(LEADS_CACHE_VERSION_KEY, int(time.time() * 1000), timeout=0)
+        version = cache.get(LEADS_CACHE_VERSION_KEY) or int(time.time() * 1000)
+    return version
+
+def invalidate_lead_cache():
+    """Retire every cached lead payload; call after committing a lead write."""
+    version = cache.get(LEADS_CACHE_VERSION_KEY) or 0
+    cache.set(LEADS_CACHE_VERSION_KEY, max(int(time.time() * 1000), version + 1), timeout=0)
+
+def cached_lead_read(per_user=False):
+    """Serve a lead read from the versioned cache, answering revalidations with 304.
+
+    Entries are keyed by data version, scope and full request path. Admin
+    JSON is shared by role unless ``per_user`` is set; clients are always
+    cached per user.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            # Pages showing flashed messages are one-off renders
+            if '_flashes' in session:
+                return view(*args, **kwargs)
+
+            # Read the version before the data so a racing write can't be cached under it
+            version = leads_cache_version()
+            if per_user or current_user.role != 'admin':
+                scope = f'user:{current_user.id}'
+            else:
+                scope = 'role:admin'
+            key = f'leads:{version}:{scope}:{request.full_path}'
+            etag = hashlib.sha1(key.encode()).hexdigest()
+            last_modified = datetime.fromtimestamp(version // 1000, timezone.utc)
+            # HTTP dates have whole seconds: until the version's second is over, a
+            # later write could share it, so Last-Modified is neither sent nor trusted
+            settled = version // 1000 < int(time.time())
 
-@login_manager.user_loader
-def load_user(id):
-    return User.query.get(int(id))
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains_weak(etag)
+            else:
+                not_modified = settled and bool(request.if_modified_since
+                                                and request.if_modified_since >= last_modified)
+            if not_modified:
+                response = Response(status=304)
+            else:
+                cached = cache.get(key)
+                if cached is not None:
+                    body, mimetype = cached
+                    response = Response(body, mimetype=mimetype)
+                else:
+                    response = make_response(view(*args, **kwargs))
+                    # Errors and pages that flashed a message are not the data for this version
+                    if response.status_code != 200 or '_flashes' in session:
+                        return response
+                    # A replica may not have the last write yet; don't pin its answer to this version
+                    router = current_app.extensions.get('leads_router')
+                    if router is not None and router.replicas and time.time() * 1000 - version < router.window * 1000:
+                        return response
+                    cache.set(key, (response.get_data(), response.mimetype),
+                              timeout=current_app.config.get('LEADS_CACHE_TIMEOUT', 300))
+            response.set_etag(etag, weak=True)
+            if settled:
+                response.last_modified = last_modified
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
 
 # Routes
-@app.route('/')
+@bp.route('/')
 @login_required
+@cached_lead_read(per_user=True)
 def index():
+    # Only the first page is rendered here; the table loads the rest from lead_rows
     try:
-        if current_user.role == 'admin':
-            leads = Lead.query.order_by(Lead.created_at.desc()).all()
-            users = User.query.filter_by(role='client').all()
-        else:
-            leads = Lead.query.filter_by(assigned_to_id=current_user.id).order_by(Lead.created_at.desc()).all()
-            users = []
-        return render_template('index.html', leads=leads, users=users)
+        filters = [] if current_user.role == 'admin' else [Lead.assigned_to_id == current_user.id]
+        leads, next_cursor = lead_page(filters)
+        return render_template('index.html', next_cursor=next_cursor, **lead_row_context(leads))
     except Exception as e:
         print(f'Error accessing leads database: {str(e)}')
         flash('Unable to access leads database. Please try again later.', 'danger')
-        return render_template('index.html', leads=[], users=[])
+        return render_template('index.html', leads=[], assignees={}, next_cursor=None), 503
+
+@bp.route('/leads/rows')
+@login_required
+@cached_lead_read(per_user=True)
+def lead_rows():
+    """One page of index table rows as HTML, filtered like /api/leads."""
+    try:
+        filters = lead_filters_from_args(request.args)
+        if current_user.role != 'admin':
+            filters.append(Lead.assigned_to_id == current_user.id)
+        if request.args.get('cursor'):
+            filters.append(after_lead_cursor(request.args['cursor']))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        leads, next_cursor = lead_page(filters)
+        return jsonify({'html': render_lead_rows(leads), 'next_cursor': next_cursor})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/leads/<int:id>/row')
+@login_required
+def lead_row(id):
+    """A single index table row, used to refresh it in place after a change."""
+    lead = Lead.query.get_or_404(id)
+    if current_user.role != 'admin' and lead.assigned_to_id != current_user.id:
+        return jsonify({'error': 'Access denied'}), 403
+    return jsonify({'html': render_lead_rows([lead])})
 
-@app.route('/clients')
+@bp.route('/clients')
 @login_required
 def client_list():
     if current_user.role != 'admin':
         flash('Access denied.', 'danger')
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     try:
-        if not app.config['SQLALCHEMY_BINDS']:
+        if not current_app.config['SQLALCHEMY_BINDS']:
             flash('Database connection is currently unavailable. Please try again later.', 'danger')
-            return redirect(url_for('index'))
+            return redirect(url_for('main.index'))
         clients = MySQLUser.query.filter_by(role='client').all()
         return render_template('client_list.html', clients=clients)
     except Exception as e:
         print(f'Error accessing client database: {str(e)}')
         flash('Unable to access client database. Please try again later.', 'danger')
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
 
-@app.route('/api/unassigned_leads')
+@bp.route('/api/clients')
+@login_required
+def get_clients():
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Access denied'}), 403
+    clients = db.session.execute(
+        db.select(MySQLUser.id, MySQLUser.username, MySQLUser.email)
+        .where(MySQLUser.role == 'client').order_by(MySQLUser.username)
+    ).all()
+    return jsonify([{'id': client.id, 'username': client.username, 'email': client.email}
+                    for client in clients])
+
+@bp.route('/api/unassigned_leads')
 @login_required
 def get_unassigned_leads():
     if current_user.role != 'admin':
         return jsonify({'error': 'Access denied'}), 403
-    leads = Lead.query.filter_by(assigned_to_id=None).all()
-    return jsonify([{
-        'id': lead.id,
-        'name': lead.name,
-        'company': lead.company
-    } for lead in leads])
+    try:
+        fields = lead_fields_from_args(request.args, default=('id', 'name', 'company'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    leads = db.session.execute(db.select(*lead_columns(fields)).where(Lead.assigned_to_id.is_(None))).all()
+    return jsonify(serialize_leads(leads, fields))
 
-@app.route('/api/leads/<int:lead_id>/assign', methods=['POST'])
+@bp.route('/api/leads/<int:lead_id>/assign', methods=['POST'])
 @login_required
 def assign_lead(lead_id):
     if current_user.role != 'admin':
@@ -198,11 +2346,81 @@ def assign_lead(lead_id):
         return jsonify({'error': 'Can only assign leads to clients'}), 400
     
     lead.assigned_to_id = user.id
-    db.session.commit()
+    changes = pending_lead_changes(lead)
+    try:
+        db.session.commit()
+    except StaleDataError:
+        db.session.rollback()
+        return jsonify({'error': 'Lead has been modified'}), 409
+    invalidate_lead_cache()
+    audit_event('lead.assign', 'lead', lead.id, changes=changes)
     
     return jsonify({'success': True})
 
-@app.route('/lead/new', methods=['GET', 'POST'])
+@bp.route('/api/leads/assign', methods=['POST'])
+@login_required
+def bulk_assign_leads():
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Access denied'}), 403
+
+    data = request.get_json(silent=True) or {}
+    strategy = data.get('strategy', 'round_robin')
+    if strategy not in ASSIGN_STRATEGIES:
+        return jsonify({'error': f'strategy must be one of {", ".join(ASSIGN_STRATEGIES)}'}), 400
+    if 'lead_ids' not in data and 'filter' not in data:
+        return jsonify({'error': 'lead_ids or filter is required'}), 400
+
+    try:
+        filters = lead_filters_from_args(MultiDict(data.get('filter') or {}))
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        if 'lead_ids' in data:
+            if not isinstance(data['lead_ids'], list):
+                raise TypeError
+            filters.append(Lead.id.in_([int(lead_id) for lead_id in data['lead_ids']]))
+    except (ValueError, TypeError):
+        return jsonify({'error': 'lead_ids must be a list of integers'}), 400
+    user_ids = None
+    try:
+        if 'user_ids' in data:
+            if not isinstance(data['user_ids'], list) or not data['user_ids']:
+                raise TypeError
+            user_ids = {int(user_id) for user_id in data['user_ids']}
+    except (ValueError, TypeError):
+        return jsonify({'error': 'user_ids must be a non-empty list of integers'}), 400
+
+    client_query = db.select(MySQLUser.id).where(MySQLUser.role == 'client').order_by(MySQLUser.id)
+    if user_ids is not None:
+        client_query = client_query.where(MySQLUser.id.in_(user_ids))
+
+    try:
+        client_ids = db.session.scalars(client_query).all()
+        if user_ids is not None and len(client_ids) < len(user_ids):
+            unknown = sorted(user_ids - set(client_ids))
+            return jsonify({'error': f'Not clients: {", ".join(map(str, unknown))}'}), 400
+        if not client_ids:
+            return jsonify({'error': 'No clients available for assignment'}), 400
+        lead_ids = db.session.scalars(db.select(Lead.id).where(*filters).order_by(Lead.id)).all()
+        loads = open_lead_counts(client_ids) if strategy == 'least_loaded' else None
+        allocation = distribute_leads(lead_ids, client_ids, strategy, loads)
+        assign_lead_ids(allocation)
+        db.session.commit()
+        invalidate_lead_cache()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+    for client_id, ids in allocation.items():
+        for lead_id in ids:
+            audit_event('lead.assign', 'lead', lead_id, assigned_to_id=client_id, strategy=strategy)
+
+    return jsonify({
+        'success': True,
+        'assigned': len(lead_ids),
+        'counts': {str(client_id): len(ids) for client_id, ids in allocation.items()}
+    })
+
+@bp.route('/lead/new', methods=['GET', 'POST'])
 @login_required
 def new_lead():
     if request.method == 'POST':
@@ -212,17 +2430,24 @@ def new_lead():
             email=request.form['email'],
             phone=request.form['phone'],
             notes=request.form['notes'],
+            source='web',
             created_by_id=current_user.id,
             assigned_to_id=current_user.id if current_user.role == 'client' else None,
             is_custom=current_user.role == 'client'
         )
         db.session.add(lead)
+        db.session.flush()
+        duplicate_ids = record_duplicate_candidates(lead)
         db.session.commit()
+        invalidate_lead_cache()
+        audit_event('lead.create', 'lead', lead.id)
         flash('Lead added successfully!', 'success')
-        return redirect(url_for('index'))
+        if duplicate_ids:
+            flash(f'Possible duplicate of lead(s) {", ".join(map(str, duplicate_ids))}.', 'warning')
+        return redirect(url_for('main.index'))
     return render_template('new_lead.html')
 
-@app.route('/lead/<int:id>/edit', methods=['GET', 'POST'])
+@bp.route('/lead/<int:id>/edit', methods=['GET', 'POST'])
 @login_required
 def edit_lead(id):
     lead = Lead.query.get_or_404(id)
@@ -232,151 +2457,309 @@ def edit_lead(id):
         lead.email = request.form['email']
         lead.phone = request.form['phone']
         lead.notes = request.form['notes']
-        db.session.commit()
+        changes = pending_lead_changes(lead)
+        try:
+            db.session.commit()
+        except StaleDataError:
+            db.session.rollback()
+            flash('This lead was changed by someone else. Review it and save again.', 'warning')
+            return redirect(url_for('main.edit_lead', id=id))
+        invalidate_lead_cache()
+        if changes:
+            audit_event('lead.update', 'lead', lead.id, changes=changes)
         flash('Lead updated successfully!', 'success')
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     return render_template('edit_lead.html', lead=lead)
 
-@app.route('/lead/<int:id>/stage', methods=['POST'])
+@bp.route('/lead/<int:id>/stage', methods=['POST'])
 @login_required
 def update_stage(id):
     lead = Lead.query.get_or_404(id)
     lead.stage = request.form['stage']
-    db.session.commit()
+    changes = pending_lead_changes(lead)
+    try:
+        db.session.commit()
+    except StaleDataError:
+        db.session.rollback()
+        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+            return jsonify({'error': 'Lead has been modified'}), 409
+        flash('This lead was changed by someone else. Try again.', 'warning')
+        return redirect(url_for('main.index'))
+    invalidate_lead_cache()
+    if changes:
+        audit_event('lead.stage', 'lead', lead.id, changes=changes)
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        return jsonify({'success': True, 'html': render_lead_rows([lead])})
     flash('Lead stage updated successfully!', 'success')
-    return redirect(url_for('index'))
+    return redirect(url_for('main.index'))
 
-@app.route('/dashboard')
+@bp.route('/dashboard')
 @login_required
 def dashboard():
-    inspector = db.inspect(db.engine)
-    tables = inspector.get_table_names()
-    return render_template('dashboard.html', tables=tables)
+    return render_template('dashboard.html', tables=dashboard_table_names())
 
-@app.route('/dashboard/<table_name>')
+@bp.route('/dashboard/refresh', methods=['POST'])
 @login_required
-def view_table(table_name):
+def refresh_dashboard_schema():
     if not current_user.role == 'admin':
         flash('Access denied. Admin privileges required.', 'error')
-        return redirect(url_for('index'))
-    try:
-        # Handle user table from SQLite database
-        if table_name == 'user':
-            inspector = db.inspect(db.engine)
-            tables = inspector.get_table_names()
-        # Handle tables from MySQL database
-        elif 'leads' in app.config['SQLALCHEMY_BINDS']:
-            inspector = db.inspect(db.engines['leads'])
-            tables = inspector.get_table_names()
-        else:
-            flash('Database connection error', 'error')
-            return redirect(url_for('dashboard'))
+        return redirect(url_for('main.index'))
+    schema_cache.invalidate()
+    flash('Table schema reloaded.', 'success')
+    return redirect(request.referrer or url_for('main.dashboard'))
 
-        if table_name not in tables:
+@bp.route('/dashboard/<table_name>')
+@login_required
+def view_table(table_name):
+    if not current_user.role == 'admin':
+        flash('Access denied. Admin privileges required.', 'error')
+        return redirect(url_for('main.index'))
+    try:
+        tables = dashboard_table_names()
+        resolved = resolve_dashboard_table(table_name)
+        if resolved is None:
             flash('Table not found', 'error')
-            return redirect(url_for('dashboard'))
-        
-        # Get table columns and data
-        if table_name == 'user':
-            table = db.Table(table_name, db.metadata, autoload_with=db.engine)
-        else:
-            table = db.Table(table_name, db.metadata, autoload_with=db.engines['leads'])
-            
+            return redirect(url_for('main.dashboard'))
+        bind_key, table = resolved
         columns = [col.name for col in table.columns]
-        
-        # Execute select query
-        result = db.session.execute(db.select(table))
-        rows = [dict(row) for row in result]
+        try:
+            _primary_key_column(table)
+        except ValueError as e:
+            # Not browsable at all; redirecting back to the table would loop
+            flash(str(e), 'error')
+            return redirect(url_for('main.dashboard'))
+
+        sort = request.args.get('sort')
+        if sort not in columns:
+            sort = None
+        descending = request.args.get('dir') == 'desc'
+        page_size = _parse_int_arg(request.args, 'page_size') or DASHBOARD_PAGE_SIZE
+        page_size = max(1, min(page_size, DASHBOARD_MAX_PAGE_SIZE))
+        rows, next_cursor = fetch_table_page(bind_key, table, sort, descending,
+                                             request.args.get('cursor'), page_size)
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('main.view_table', table_name=table_name))
     except Exception as e:
         flash(f'Error accessing database: {str(e)}', 'error')
-        return redirect(url_for('dashboard'))
-    
-    return render_template('dashboard.html', 
+        return redirect(url_for('main.dashboard'))
+
+    return render_template('dashboard.html',
                           tables=tables,
                           current_table=table_name,
                           columns=columns,
-                          rows=rows)
+                          rows=rows,
+                          sort=sort,
+                          direction='desc' if descending else 'asc',
+                          page_size=page_size,
+                          next_cursor=next_cursor)
 
-@app.route('/dashboard/<table_name>/add', methods=['POST'])
+@bp.route('/dashboard/<table_name>/add', methods=['POST'])
+@login_required
 def add_row(table_name):
-    inspector = db.inspect(db.engine)
-    tables = inspector.get_table_names()
-    if table_name not in tables:
+    if not current_user.role == 'admin':
+        flash('Access denied. Admin privileges required.', 'error')
+        return redirect(url_for('main.index'))
+    resolved = resolve_dashboard_table(table_name)
+    if resolved is None:
         flash('Table not found', 'error')
-        return redirect(url_for('dashboard'))
-    
-    table = db.Table(table_name, db.metadata, autoload_with=db.engine)
-    data = {key: value for key, value in request.form.items() if key != 'id'}
-    
+        return redirect(url_for('main.dashboard'))
+
+    bind_key, table = resolved
+    data = {key: value for key, value in request.form.items() if key != 'id' and key in table.c}
+    if table_name == 'lead' and bind_key == 'leads':
+        data.setdefault('source', 'dashboard')
+
     try:
-        db.session.execute(table.insert().values(**data))
+        result = db.session.execute(table.insert().values(**data), bind_arguments={'bind': _bind_engine(bind_key)})
+        if table_name == 'lead' and bind_key == 'leads':
+            _count_dashboard_lead_row(result.inserted_primary_key[0], 1)
+            log_lead_changes(leads_connection(), Lead.id == result.inserted_primary_key[0])
+            record_created_leads(leads_connection(), Lead.id == result.inserted_primary_key[0])
+            write_created_events(leads_connection(), Lead.id == result.inserted_primary_key[0])
         db.session.commit()
+        invalidate_lead_cache()
+        audit_event('row.add', table_name, result.inserted_primary_key[0], bind=bind_key or 'default')
         flash('Row added successfully!', 'success')
     except Exception as e:
         db.session.rollback()
         flash(f'Error adding row: {str(e)}', 'error')
     
-    return redirect(url_for('view_table', table_name=table_name))
+    return redirect(url_for('main.view_table', table_name=table_name))
 
-@app.route('/dashboard/<table_name>/delete/<int:id>', methods=['POST'])
+@bp.route('/dashboard/<table_name>/delete/<int:id>', methods=['POST'])
+@login_required
 def delete_row(table_name, id):
-    inspector = db.inspect(db.engine)
-    tables = inspector.get_table_names()
-    if table_name not in tables:
+    if not current_user.role == 'admin':
+        flash('Access denied. Admin privileges required.', 'error')
+        return redirect(url_for('main.index'))
+    resolved = resolve_dashboard_table(table_name)
+    if resolved is None:
         flash('Table not found', 'error')
-        return redirect(url_for('dashboard'))
-    
-    table = db.Table(table_name, db.metadata, autoload_with=db.engine)
+        return redirect(url_for('main.dashboard'))
+
+    bind_key, table = resolved
     try:
-        db.session.execute(table.delete().where(table.c.id == id))
+        pk = _primary_key_column(table)
+        if table_name == 'lead' and bind_key == 'leads':
+            _count_dashboard_lead_row(id, -1)
+            assigned_to_id = db.session.scalar(db.select(Lead.assigned_to_id).where(Lead.id == id))
+            record_lead_changes(leads_connection(), [{'lead_id': id, 'op': 'delete', 'assigned_to_id': assigned_to_id}])
+        db.session.execute(table.delete().where(pk == id), bind_arguments={'bind': _bind_engine(bind_key)})
         db.session.commit()
+        invalidate_lead_cache()
+        if table_name == 'user' and bind_key is None:
+            user_cache.invalidate(id)
+        audit_event('row.delete', table_name, id, bind=bind_key or 'default')
         flash('Row deleted successfully!', 'success')
     except Exception as e:
         db.session.rollback()
         flash(f'Error deleting row: {str(e)}', 'error')
     
-    return redirect(url_for('view_table', table_name=table_name))
+    return redirect(url_for('main.view_table', table_name=table_name))
 
 # API Routes
-@app.route('/api/leads', methods=['GET'])
+@bp.route('/api/leads', methods=['GET'])
 @login_required
+@cached_lead_read()
 def get_leads():
     try:
-        leads = Lead.query.order_by(Lead.created_at.desc()).all()
-        return jsonify([{
-            'id': lead.id,
-            'name': lead.name,
-            'company': lead.company,
-            'email': lead.email,
-            'phone': lead.phone,
-            'stage': lead.stage,
-            'notes': lead.notes,
-            'created_at': lead.created_at.isoformat(),
-            'updated_at': lead.updated_at.isoformat()
-        } for lead in leads])
+        limit = _parse_int_arg(request.args, 'limit') or LEADS_PAGE_SIZE
+        limit = max(1, min(limit, LEADS_MAX_PAGE_SIZE))
+        sort = request.args.get('sort', 'created_at')
+        if sort not in LEAD_SORT_COLUMNS:
+            raise ValueError(f'sort must be one of {", ".join(LEAD_SORT_COLUMNS)}')
+        filters = lead_filters_from_args(request.args)
+        if request.args.get('cursor'):
+            filters.append(after_lead_cursor(request.args['cursor'], sort))
+        fields = lead_fields_from_args(request.args)
+        columnar = lead_format_from_args(request.args) == 'columnar'
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    include_archived = request.args.get('include_archived') == '1'
+
+    try:
+        leads, next_cursor = lead_page(filters, limit, sort, include_archived, fields)
+        rows = serialize_leads(leads, fields, columnar)
+        if include_archived:
+            if columnar:
+                rows['archived'] = [lead.archived for lead in leads]
+            else:
+                for row, lead in zip(rows, leads):
+                    row['archived'] = lead.archived
+        return jsonify({'leads': rows, 'next_cursor': next_cursor})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/leads/search', methods=['GET'])
+@login_required
+@cached_lead_read()
+def search_leads():
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'q is required'}), 400
+    try:
+        limit = max(1, min(_parse_int_arg(request.args, 'limit') or 20, 100))
+        offset = max(0, _parse_int_arg(request.args, 'offset') or 0)
+        fields = lead_fields_from_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        assigned_to_id = None if current_user.role == 'admin' else current_user.id
+        matches = search_lead_ids(query, assigned_to_id=assigned_to_id, limit=limit + 1, offset=offset)
+        has_more = len(matches) > limit
+        matches = matches[:limit]
+        leads = {lead.id: lead for lead in db.session.execute(
+            db.select(*lead_columns(fields)).where(Lead.id.in_([lead_id for lead_id, _ in matches])))}
+        return jsonify({'leads': [dict(lead_to_dict(leads[lead_id], fields), rank=rank)
+                                  for lead_id, rank in matches if lead_id in leads],
+            'next_offset': offset + limit if has_more else None})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/leads/<int:id>', methods=['GET'])
+@bp.route('/api/leads/export', methods=['GET'])
 @login_required
+def export_leads():
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Access denied'}), 403
+
+    export_format = request.args.get('format', 'ndjson')
+    if export_format == 'ndjson':
+        mimetype, serialize = 'application/x-ndjson', iter_ndjson_export
+    elif export_format == 'csv':
+        mimetype, serialize = 'text/csv', iter_csv_export
+    else:
+        return jsonify({'error': 'format must be ndjson or csv'}), 400
+    try:
+        filters = lead_filters_from_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    chunks = serialize(iter_lead_rows(filters))
+    headers = {'Content-Disposition': f'attachment; filename=leads.{export_format}'}
+    if request.args.get('gzip') in ('1', 'true'):
+        chunks = iter_gzip(chunks)
+        headers['Content-Encoding'] = 'gzip'
+    return Response(stream_with_context(chunks), mimetype=mimetype, headers=headers)
+
+@bp.route('/api/leads/<int:id>', methods=['GET'])
+@login_required
+@cached_lead_read()
 def get_lead(id):
+    include_archived = request.args.get('include_archived') == '1'
+    try:
+        fields = lead_fields_from_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     try:
-        lead = Lead.query.get_or_404(id)
-        return jsonify({
-            'id': lead.id,
-            'name': lead.name,
-            'company': lead.company,
-            'email': lead.email,
-            'phone': lead.phone,
-            'stage': lead.stage,
-            'notes': lead.notes,
-            'created_at': lead.created_at.isoformat(),
-            'updated_at': lead.updated_at.isoformat()
-        })
+        columns = lead_columns(fields)
+        lead = db.session.execute(db.select(*columns).where(Lead.id == id)).first()
+        if lead is None and include_archived:
+            lead = db.session.execute(db.select(*[lead_archive.c[column.key] for column in columns])
+                                      .where(lead_archive.c.id == id),
+                                      bind_arguments={'mapper': Lead}).first()
+            archived = lead is not None
+        else:
+            archived = False
+        if lead is None:
+            return jsonify({'error': 'Lead not found'}), 404
+        data = lead_to_dict(lead, fields)
+        if include_archived:
+            data['archived'] = archived
+        return jsonify(data)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/leads/restore', methods=['POST'])
+@login_required
+def restore_leads():
+    """Move archived leads back into the working set. Body: {"lead_ids": [...]}."""
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Access denied'}), 403
+    data = request.get_json(silent=True) or {}
+    try:
+        ids = [int(lead_id) for lead_id in data.get('lead_ids') or []]
+    except (ValueError, TypeError):
+        return jsonify({'error': 'lead_ids must be a list of integers'}), 400
+    if not ids:
+        return jsonify({'error': 'lead_ids is required'}), 400
+    if len(ids) > current_app.config['ARCHIVE_BATCH_SIZE']:
+        return jsonify({'error': f'At most {current_app.config["ARCHIVE_BATCH_SIZE"]} leads per request'}), 400
+    try:
+        restored, conflicts = restore_lead_ids(ids)
+        db.session.commit()
     except Exception as e:
+        db.session.rollback()
         return jsonify({'error': str(e)}), 500
+    if restored:
+        invalidate_lead_cache()
+        for lead_id in restored:
+            audit_event('lead.restore', 'lead', lead_id)
+    return jsonify({'restored': restored, 'conflicts': conflicts,
+                    'not_found': sorted(set(ids) - set(restored) - set(conflicts))})
 
-@app.route('/api/leads', methods=['POST'])
+@bp.route('/api/leads', methods=['POST'])
 @login_required
 def create_lead():
     if not request.is_json:
@@ -394,36 +2777,69 @@ def create_lead():
             email=data.get('email'),
             phone=data.get('phone'),
             notes=data.get('notes'),
+            industry=data.get('industry'),
             stage=data.get('stage', 'New'),
+            source=data.get('source') or 'api',
             created_by_id=current_user.id,
             assigned_to_id=current_user.id if current_user.role == 'client' else None,
             is_custom=current_user.role == 'client'
         )
         
         db.session.add(lead)
+        db.session.flush()
+        duplicate_ids = record_duplicate_candidates(lead)
         db.session.commit()
-        return jsonify({
-            'id': lead.id,
-            'name': lead.name,
-            'company': lead.company,
-            'email': lead.email,
-            'phone': lead.phone,
-            'stage': lead.stage,
-            'notes': lead.notes,
-            'created_at': lead.created_at.isoformat(),
-            'updated_at': lead.updated_at.isoformat()
-        }), 201
+        invalidate_lead_cache()
+        audit_event('lead.create', 'lead', lead.id)
+        return jsonify(dict(lead_to_dict(lead, DEFAULT_LEAD_FIELDS), possible_duplicates=duplicate_ids)), 201
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/leads/<int:id>', methods=['PUT'])
+@bp.route('/api/leads/import', methods=['POST'])
+@login_required
+def import_leads():
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Access denied'}), 403
+
+    upload = request.files.get('file')
+    if upload:
+        stream, filename = upload.stream, upload.filename or ''
+    else:
+        stream, filename = request.stream, ''
+    import_format = request.args.get('format')
+    if not import_format:
+        if filename.endswith('.csv') or request.mimetype == 'text/csv':
+            import_format = 'csv'
+        else:
+            import_format = 'ndjson'
+    if import_format not in ('csv', 'ndjson'):
+        return jsonify({'error': 'format must be csv or ndjson'}), 400
+
+    importer = LeadImporter(created_by_id=current_user.id)
+    try:
+        for row_number, record in iter_import_records(stream, import_format):
+            importer.add(row_number, record)
+        importer.flush()
+    except (UnicodeDecodeError, csv.Error) as e:
+        db.session.rollback()
+        report = importer.report()
+        report['error'] = f'Unreadable upload: {str(e)}'
+        return jsonify(report), 400
+    report = importer.report()
+    audit_event('lead.import', imported=report['imported'], skipped=report['skipped'],
+                errors=len(report['errors']), format=import_format)
+    return jsonify(report)
+
+@bp.route('/api/leads/<int:id>', methods=['PUT'])
 def update_lead_api(id):
     if not request.is_json:
         return jsonify({'error': 'Content-Type must be application/json'}), 400
     
     lead = Lead.query.get_or_404(id)
     data = request.get_json()
+    if 'version' in data and data['version'] != lead.version:
+        return jsonify({'error': 'Lead has been modified', 'version': lead.version}), 409
     
     try:
         if 'name' in data:
@@ -438,41 +2854,475 @@ def update_lead_api(id):
             lead.notes = data['notes']
         if 'stage' in data:
             lead.stage = data['stage']
+        if 'industry' in data:
+            lead.industry = data['industry']
         
+        changes = pending_lead_changes(lead)
+        db.session.commit()
+        invalidate_lead_cache()
+        if changes:
+            audit_event('lead.update', 'lead', lead.id, changes=changes)
+        return jsonify(lead_to_dict(lead, DEFAULT_LEAD_FIELDS))
+    except StaleDataError:
+        db.session.rollback()
+        return jsonify({'error': 'Lead has been modified'}), 409
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/leads', methods=['PATCH'])
+@login_required
+def patch_leads():
+    """Apply partial updates to many leads in one transaction.
+
+    Body: {"updates": [{"id": 1, "version": 3, "stage": "Qualified"}, ...], "atomic": false}.
+    Each item carries the version (or updated_at) it was read at and gets its
+    own result: updated, conflict, not_found, forbidden or invalid. With
+    "atomic": true, nothing is committed unless every item succeeds.
+    """
+    data = request.get_json(silent=True)
+    items = data.get('updates') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'updates must be a non-empty list'}), 400
+    if len(items) > LEAD_PATCH_MAX_ITEMS:
+        return jsonify({'error': f'At most {LEAD_PATCH_MAX_ITEMS} updates per request'}), 400
+
+    try:
+        results = apply_lead_patches(items, current_user)
+        updated = sum(result['status'] == 'updated' for result in results)
+        if data.get('atomic') and updated < len(results):
+            db.session.rollback()
+            results = [{'id': result['id'], 'status': 'rolled_back'} if result['status'] == 'updated' else result
+                       for result in results]
+            return jsonify({'results': results, 'updated': 0}), 409
         db.session.commit()
-        return jsonify({
-            'id': lead.id,
-            'name': lead.name,
-            'company': lead.company,
-            'email': lead.email,
-            'phone': lead.phone,
-            'stage': lead.stage,
-            'notes': lead.notes,
-            'created_at': lead.created_at.isoformat(),
-            'updated_at': lead.updated_at.isoformat()
-        })
+    except StaleDataError:
+        db.session.rollback()
+        return jsonify({'error': 'Leads were modified during the update; re-read them and retry'}), 409
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/leads/<int:id>', methods=['DELETE'])
+    if updated:
+        invalidate_lead_cache()
+        for item, result in zip(items, results):
+            if result['status'] == 'updated':
+                audit_event('lead.update', 'lead', item['id'],
+                            fields={field: item[field] for field in LEAD_PATCH_FIELDS if field in item})
+    return jsonify({'results': results, 'updated': updated})
+
+@bp.route('/api/leads/changes')
+@login_required
+def lead_changes():
+    """Lead changes after ?since=<seq>, one entry per lead with its current data.
+
+    Without since, returns only next_since: take it, load the leads, then
+    follow the feed from it. Returns 410 when since is older than the
+    retained log, in which case the client reloads its copy.
+    """
+    try:
+        since = _parse_int_arg(request.args, 'since')
+        limit = _parse_int_arg(request.args, 'limit') or current_app.config.get('CHANGE_FEED_PAGE_SIZE', 500)
+        limit = max(1, min(limit, current_app.config.get('CHANGE_FEED_MAX_PAGE_SIZE', 5000)))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if since is None:
+        return jsonify({'changes': [], 'next_since': latest_change_seq(), 'has_more': False})
+    try:
+        changes, next_since, has_more = read_lead_changes(since, current_user, limit)
+    except ChangeLogGone:
+        return jsonify({'error': 'since is older than the change log; reload the leads'}), 410
+    return jsonify({'changes': changes, 'next_since': next_since, 'has_more': has_more})
+
+@bp.route('/api/leads/changes/stream')
+@login_required
+def stream_lead_changes():
+    """Server-Sent Events feed of lead changes.
+
+    Each event carries the same changes as /api/leads/changes with its
+    next_since as the event id, so a reconnecting EventSource resumes from
+    Last-Event-ID. The stream polls the log and sleeps in between, which
+    yields to other requests under gevent workers; a sync worker is tied up
+    for the life of the stream. Streams close after CHANGE_FEED_STREAM_SECONDS
+    and the browser reconnects.
+    """
+    try:
+        since = _parse_int_arg(request.headers, 'Last-Event-ID')
+        if since is None:
+            since = _parse_int_arg(request.args, 'since')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if since is None:
+        since = latest_change_seq()
+    config = current_app.config
+    poll_interval = config.get('CHANGE_FEED_POLL_INTERVAL', 1)
+    heartbeat = config.get('CHANGE_FEED_HEARTBEAT_SECONDS', 15)
+    deadline = time.monotonic() + config.get('CHANGE_FEED_STREAM_SECONDS', 300)
+    limit = config.get('CHANGE_FEED_PAGE_SIZE', 500)
+    user = current_user._get_current_object()
+    # A long-lived stream would skew the latency histograms and look like an N+1
+    metrics.untrack_request()
+
+    def events():
+        nonlocal since
+        yield f'retry: {int(poll_interval * 1000) + 1000}\n\n'
+        last_sent = time.monotonic()
+        while time.monotonic() < deadline:
+            try:
+                changes, next_since, has_more = read_lead_changes(since, user, limit)
+            except ChangeLogGone:
+                yield 'event: reset\ndata: {}\n\n'
+                return
+            finally:
+                # Hand the connection back to the pool while sleeping
+                db.session.close()
+            if changes:
+                yield f'id: {next_since}\nevent: changes\ndata: {json.dumps(changes)}\n\n'
+                last_sent = time.monotonic()
+            since = next_since
+            if has_more:
+                continue
+            if time.monotonic() - last_sent >= heartbeat:
+                yield ': keepalive\n\n'
+                last_sent = time.monotonic()
+            time.sleep(poll_interval)
+
+    response = Response(stream_with_context(events()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@bp.route('/api/leads/<int:id>', methods=['DELETE'])
 def delete_lead_api(id):
     lead = Lead.query.get_or_404(id)
     try:
+        name, email = lead.name, lead.email
         db.session.delete(lead)
         db.session.commit()
+        invalidate_lead_cache()
+        audit_event('lead.delete', 'lead', id, name=name, email=email)
         return '', 204
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
-@app.route('/admin/login', methods=['GET', 'POST'])
+@bp.route('/api/leads/<int:id>/enrich', methods=['POST'])
+@login_required
+def enrich_lead(id):
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Access denied'}), 403
+    lead = Lead.query.get_or_404(id)
+    try:
+        enqueue_enrichment(leads_connection(), [lead.id])
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+    return jsonify({'success': True}), 202
+
+@bp.route('/api/enrichment/stats', methods=['GET'])
+@login_required
+def enrichment_stats():
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Access denied'}), 403
+    counts = db.session.execute(
+        db.select(EnrichmentJob.status, db.func.count(EnrichmentJob.id)).group_by(EnrichmentJob.status)
+    ).all()
+    return jsonify(dict(counts))
+
+@bp.route('/api/leads/duplicates', methods=['GET'])
+@login_required
+def get_duplicate_clusters():
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Access denied'}), 403
+    try:
+        limit = max(1, min(_parse_int_arg(request.args, 'limit') or 50, 500))
+        after = _parse_int_arg(request.args, 'after') or 0
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        cluster_ids = db.session.scalars(
+            db.select(LeadDuplicate.cluster_id).where(LeadDuplicate.cluster_id > after)
+            .group_by(LeadDuplicate.cluster_id).having(db.func.count() > 1)
+            .order_by(LeadDuplicate.cluster_id).limit(limit + 1)
+        ).all()
+        has_more = len(cluster_ids) > limit
+        cluster_ids = cluster_ids[:limit]
+        rows = db.session.execute(
+            db.select(LeadDuplicate, Lead).join(Lead, Lead.id == LeadDuplicate.lead_id)
+            .where(LeadDuplicate.cluster_id.in_(cluster_ids))
+            .order_by(LeadDuplicate.cluster_id, Lead.id)
+        ).all()
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+    clusters = {}
+    for duplicate, lead in rows:
+        summary = dict(_duplicate_summary(lead), match_keys=duplicate.match_keys.split(','))
+        clusters.setdefault(duplicate.cluster_id, []).append(summary)
+    return jsonify({
+        'clusters': [{'cluster_id': cluster_id, 'leads': leads}
+                     for cluster_id, leads in clusters.items() if len(leads) > 1],
+        'next_after': cluster_ids[-1] if has_more else None
+    })
+
+@bp.route('/api/leads/<int:id>/duplicates', methods=['GET'])
+@login_required
+def get_lead_duplicates(id):
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Access denied'}), 403
+    lead = Lead.query.get_or_404(id)
+    matches = find_duplicate_ids(lead)
+    leads = Lead.query.filter(Lead.id.in_(matches)).order_by(Lead.id).all() if matches else []
+    return jsonify({'lead_id': lead.id, 'duplicates': [
+        dict(_duplicate_summary(match), match_keys=matches[match.id]) for match in leads
+    ]})
+
+@bp.route('/api/pipeline/summary', methods=['GET'])
+@login_required
+@cached_lead_read()
+def pipeline_summary():
+    query = (db.select(LeadStageCount.stage, LeadStageCount.assignee_id, LeadStageCount.lead_count)
+             .where(LeadStageCount.lead_count > 0))
+    if current_user.role != 'admin':
+        query = query.where(LeadStageCount.assignee_id == current_user.id)
+    try:
+        rows = db.session.execute(query).all()
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+    stages, assignees = {}, {}
+    for stage, assignee_id, count in rows:
+        stages[stage] = stages.get(stage, 0) + count
+        assignees.setdefault(str(assignee_id) if assignee_id else 'unassigned', {})[stage] = count
+    return jsonify({'total': sum(stages.values()), 'stages': stages, 'assignees': assignees})
+
+ANALYTICS_GROUPS = {'assignee': LeadStageDaily.assignee_id, 'source': LeadStageDaily.source}
+
+@bp.route('/api/analytics/funnel', methods=['GET'])
+@login_required
+@cached_lead_read()
+def stage_funnel():
+    """Leads entering each stage, from the daily rollups, optionally per assignee or source.
+
+    Filters: since, until (dates), assigned_to_id, source; group_by=assignee|source.
+    """
+    group_by = request.args.get('group_by')
+    if group_by and group_by not in ANALYTICS_GROUPS:
+        return jsonify({'error': f'group_by must be one of {", ".join(ANALYTICS_GROUPS)}'}), 400
+    try:
+        filters = stage_rollup_filters(request.args, current_user)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    columns = [ANALYTICS_GROUPS[group_by]] if group_by else []
+    rows = db.session.execute(
+        db.select(*columns, LeadStageDaily.stage, db.func.sum(LeadStageDaily.entered))
+        .where(*filters).group_by(*columns, LeadStageDaily.stage)
+    ).all()
+    groups = {}
+    for row in rows:
+        key = row[0] if group_by else 'all'
+        groups.setdefault(str(key) if key not in (None, '') else 'unknown', {})[row[-2]] = int(row[-1] or 0)
+    funnels = {key: [{'stage': stage, 'entered': counts[stage]} for stage in _ordered_stages(counts)]
+               for key, counts in groups.items()}
+    if not group_by:
+        return jsonify({'stages': funnels.get('all', [])})
+    return jsonify({'group_by': group_by, 'groups': funnels})
+
+@bp.route('/api/analytics/conversion', methods=['GET'])
+@login_required
+@cached_lead_read()
+def stage_conversion():
+    """Step-to-step conversion along FUNNEL_STAGES, plus win and loss rates, from the daily rollups."""
+    try:
+        filters = stage_rollup_filters(request.args, current_user)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    entered = dict(db.session.execute(
+        db.select(LeadStageDaily.stage, db.func.sum(LeadStageDaily.entered))
+        .where(*filters).group_by(LeadStageDaily.stage)
+    ).all())
+    entered = {stage: int(count or 0) for stage, count in entered.items()}
+
+    def rate(numerator, denominator):
+        return round(numerator / denominator, 4) if denominator else None
+
+    steps = [{'from': from_stage, 'to': to_stage, 'from_count': entered.get(from_stage, 0),
+              'to_count': entered.get(to_stage, 0),
+              'rate': rate(entered.get(to_stage, 0), entered.get(from_stage, 0))}
+             for from_stage, to_stage in zip(FUNNEL_STAGES, FUNNEL_STAGES[1:])]
+    started = entered.get(FUNNEL_STAGES[0], 0)
+    return jsonify({'steps': steps,
+                    'win_rate': rate(entered.get('Closed Won', 0), started),
+                    'loss_rate': rate(entered.get('Closed Lost', 0), started)})
+
+@bp.route('/api/analytics/time_in_stage', methods=['GET'])
+@login_required
+@cached_lead_read()
+def time_in_stage():
+    """Average time leads spent in each stage before leaving it, from the daily rollups."""
+    try:
+        filters = stage_rollup_filters(request.args, current_user)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    rows = db.session.execute(
+        db.select(LeadStageDaily.stage, db.func.sum(LeadStageDaily.exited),
+                  db.func.sum(LeadStageDaily.exited_seconds))
+        .where(*filters).group_by(LeadStageDaily.stage)
+        .having(db.func.sum(LeadStageDaily.exited) > 0)
+    ).all()
+    totals = {stage: (int(exited), float(seconds or 0)) for stage, exited, seconds in rows}
+    return jsonify({'stages': [{
+        'stage': stage,
+        'exited': totals[stage][0],
+        'average_seconds': round(totals[stage][1] / totals[stage][0], 1),
+        'average_days': round(totals[stage][1] / totals[stage][0] / 86400, 2)
+    } for stage in _ordered_stages(totals)]})
+
+@bp.route('/api/webhooks', methods=['GET'])
+@login_required
+def list_webhooks():
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Access denied'}), 403
+    return jsonify([{
+        'id': endpoint.id,
+        'url': endpoint.url,
+        'events': endpoint.events.split(','),
+        'rate_limit': endpoint.rate_limit,
+        'active': endpoint.active,
+        'created_at': endpoint.created_at.isoformat()
+    } for endpoint in WebhookEndpoint.query.order_by(WebhookEndpoint.id)])
+
+@bp.route('/api/webhooks', methods=['POST'])
+@login_required
+def create_webhook():
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Access denied'}), 403
+    data = request.get_json(silent=True) or {}
+    if not str(data.get('url', '')).startswith(('http://', 'https://')):
+        return jsonify({'error': 'A http(s) url is required'}), 400
+    events = data.get('events') or ['*']
+    if any(event != '*' and event not in WEBHOOK_EVENTS for event in events):
+        return jsonify({'error': f'events must be drawn from {", ".join(WEBHOOK_EVENTS)}'}), 400
+
+    endpoint = WebhookEndpoint(url=data['url'], events=','.join(events), secret=data.get('secret'),
+                               rate_limit=data.get('rate_limit'))
+    try:
+        db.session.add(endpoint)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+    return jsonify({'id': endpoint.id, 'url': endpoint.url, 'events': events}), 201
+
+@bp.route('/api/webhooks/<int:id>', methods=['DELETE'])
+@login_required
+def delete_webhook(id):
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Access denied'}), 403
+    endpoint = WebhookEndpoint.query.get_or_404(id)
+    endpoint.active = False
+    # Nothing will deliver these any more
+    db.session.execute(db.update(WebhookDelivery)
+                       .where(WebhookDelivery.endpoint_id == id, WebhookDelivery.status == 'pending')
+                       .values(status='cancelled'))
+    db.session.commit()
+    return '', 204
+
+@bp.route('/api/webhooks/<int:id>/deliveries', methods=['GET'])
+@login_required
+def get_webhook_deliveries(id):
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Access denied'}), 403
+    try:
+        limit = max(1, min(_parse_int_arg(request.args, 'limit') or 50, 500))
+        before = _parse_int_arg(request.args, 'before')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    query = WebhookDelivery.query.filter_by(endpoint_id=id)
+    if request.args.get('status'):
+        query = query.filter_by(status=request.args['status'])
+    if before:
+        query = query.filter(WebhookDelivery.id < before)
+    deliveries = query.order_by(WebhookDelivery.id.desc()).limit(limit).all()
+    return jsonify({'deliveries': [{
+        'id': delivery.id,
+        'event_id': delivery.event_id,
+        'status': delivery.status,
+        'attempts': delivery.attempts,
+        'last_status_code': delivery.last_status_code,
+        'last_error': delivery.last_error,
+        'next_attempt_at': delivery.next_attempt_at.isoformat() if delivery.next_attempt_at else None,
+        'delivered_at': delivery.delivered_at.isoformat() if delivery.delivered_at else None
+    } for delivery in deliveries],
+        'next_before': deliveries[-1].id if len(deliveries) == limit else None})
+
+@bp.route('/api/user_cache/stats', methods=['GET'])
+@login_required
+def user_cache_stats():
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Access denied'}), 403
+    return jsonify(user_cache.stats())
+
+@bp.route('/api/audit', methods=['GET'])
+@login_required
+def get_audit_events():
+    """Audit events, newest first, filtered by actor_id, action, entity_type, entity_id, since and until."""
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Access denied'}), 403
+    try:
+        limit = max(1, min(_parse_int_arg(request.args, 'limit') or AUDIT_PAGE_SIZE, AUDIT_MAX_PAGE_SIZE))
+        filters = audit_filters_from_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # Include what this worker has not written yet
+    audit.flush()
+    events = (AuditEvent.query.filter(*filters)
+              .order_by(AuditEvent.occurred_at.desc(), AuditEvent.id.desc())
+              .limit(limit + 1).all())
+    next_cursor = encode_audit_cursor(events[limit - 1]) if len(events) > limit else None
+    return jsonify({'events': [{
+        'id': event.id,
+        'occurred_at': event.occurred_at.isoformat(),
+        'actor_id': event.actor_id,
+        'actor_username': event.actor_username,
+        'action': event.action,
+        'entity_type': event.entity_type,
+        'entity_id': event.entity_id,
+        'ip_address': event.ip_address,
+        'details': json.loads(event.details) if event.details else None
+    } for event in events[:limit]], 'next_cursor': next_cursor})
+
+@bp.route('/api/audit/stats', methods=['GET'])
+@login_required
+def audit_stats():
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Access denied'}), 403
+    return jsonify(audit.stats())
+
+@bp.route('/api/metrics/samples', methods=['GET'])
+@login_required
+def metrics_samples():
+    """Recent slow-query and N+1 samples, newest first."""
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Access denied'}), 403
+    return jsonify({'samples': metrics.recent_samples()})
+
+def rotate_session():
+    """Give the session a new id when the user changes, against session fixation."""
+    if hasattr(session, 'regenerate'):
+        session.regenerate()
+
+@bp.route('/admin/login', methods=['GET', 'POST'])
 def admin_login():
     if current_user.is_authenticated:
         if current_user.role == 'admin':
-            return redirect(url_for('index'))
+            return redirect(url_for('main.index'))
         flash('Access denied. Admin privileges required.', 'danger')
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     
     if request.method == 'POST':
         username = request.form['username']
@@ -482,16 +3332,19 @@ def admin_login():
         user = User.query.filter_by(username=username, role='admin').first()
         if user and user.check_password(password):
             login_user(user, remember=remember)
+            rotate_session()
+            audit_event('login', 'user', user.id, actor=user)
             next_page = request.args.get('next')
-            return redirect(next_page if next_page else url_for('index'))
+            return redirect(next_page if next_page else url_for('main.index'))
         
+        audit_event('login_failed', username=username, role='admin')
         flash('Invalid administrator credentials', 'danger')
     return render_template('admin_login.html')
 
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     if current_user.is_authenticated:
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     
     if request.method == 'POST':
         username = request.form['username']
@@ -501,18 +3354,21 @@ def login():
         user = User.query.filter_by(username=username, role='client').first()
         if user and user.check_password(password):
             login_user(user, remember=remember)
+            rotate_session()
+            audit_event('login', 'user', user.id, actor=user)
             next_page = request.args.get('next')
-            return redirect(next_page if next_page else url_for('index'))
+            return redirect(next_page if next_page else url_for('main.index'))
         
+        audit_event('login_failed', username=username, role='client')
         flash('Invalid username or password', 'danger')
     return render_template('login.html')
 
-@app.route('/register', methods=['GET', 'POST'])
+@bp.route('/register', methods=['GET', 'POST'])
 def register():
     # Only allow admin users to access the registration page
     if not current_user.is_authenticated or current_user.role != 'admin':
         flash('Only administrators can register new users', 'danger')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     
     if request.method == 'POST':
         username = request.form['username']
@@ -544,9 +3400,10 @@ def register():
             db.session.add(mysql_user)
             
             db.session.commit()
+            audit_event('user.create', 'user', user.id, username=username, role=role)
             
             flash('User registration successful!', 'success')
-            return redirect(url_for('index'))
+            return redirect(url_for('main.index'))
         except Exception as e:
             db.session.rollback()
             flash(f'Registration failed: {str(e)}', 'danger')
@@ -554,37 +3411,125 @@ def register():
     
     return render_template('register.html')
 
-@app.route('/logout')
+@bp.route('/logout')
 @login_required
 def logout():
+    audit_event('logout', 'user', current_user.id)
     logout_user()
-    return redirect(url_for('index'))
+    rotate_session()
+    return redirect(url_for('main.index'))
+
+@bp.cli.command('reconcile-pipeline')
+def reconcile_pipeline_command():
+    """Rebuild the pipeline summary table from the lead table."""
+    rebuild_pipeline_summary()
+    db.session.commit()
+    click.echo('Pipeline summary rebuilt.')
+
+@bp.cli.command('rebuild-stage-rollups')
+def rebuild_stage_rollups_command():
+    """Backfill missing stage history and rebuild the daily stage rollups from it."""
+    backfilled = backfill_stage_transitions()
+    rows = rebuild_stage_rollups()
+    db.session.commit()
+    click.echo(f'Backfilled {backfilled} leads; wrote {rows} daily rollup rows.')
+
+@bp.cli.command('archive-leads')
+@click.option('--limit', type=int, default=None, help='Archive at most this many leads.')
+@click.option('--dry-run', is_flag=True, help='Only count the leads that would be archived.')
+def archive_leads_command(limit, dry_run):
+    """Move closed and stale leads to the archive table; run it daily."""
+    if dry_run:
+        count = db.session.scalar(db.select(db.func.count(Lead.id)).where(archivable_lead_conditions()))
+        click.echo(f'{count} leads would be archived.')
+        return
+    archived = archive_leads(limit=limit)
+    if archived:
+        invalidate_lead_cache()
+        audit_event('lead.archive', archived=archived)
+    click.echo(f'Archived {archived} leads.')
+
+@bp.cli.command('restore-leads')
+@click.argument('lead_ids', nargs=-1, type=int, required=True)
+def restore_leads_command(lead_ids):
+    """Move archived leads back into the lead table."""
+    restored, conflicts = restore_lead_ids(list(lead_ids))
+    db.session.commit()
+    invalidate_lead_cache()
+    for lead_id in restored:
+        audit_event('lead.restore', 'lead', lead_id)
+    click.echo(f'Restored {len(restored)} leads.')
+    if conflicts:
+        click.echo(f'Not restored, id already in use: {", ".join(map(str, conflicts))}')
+
+@bp.cli.command('score-leads')
+@click.option('--all', 'rescore_all', is_flag=True, help='Rescore every lead, e.g. after changing rules.')
+def score_leads_command(rescore_all):
+    """Score unscored leads in batches."""
+    scored = rescore_leads(rescore_all=rescore_all)
+    click.echo(f'Scored {scored} leads.')
+
+@bp.cli.command('dedupe-leads')
+def dedupe_leads_command():
+    """Backfill blocking keys and rebuild duplicate lead clusters."""
+    updated = backfill_blocking_keys()
+    clusters = rebuild_duplicate_clusters()
+    click.echo(f'Backfilled keys for {updated} leads; found {clusters} duplicate clusters.')
+
+@bp.cli.command('prune-lead-changes')
+@click.option('--days', type=int, default=None, help='Keep this many days (default CHANGE_FEED_RETENTION_DAYS).')
+def prune_lead_changes_command(days):
+    """Delete old rows from the lead change log."""
+    days = days if days is not None else current_app.config['CHANGE_FEED_RETENTION_DAYS']
+    deleted = prune_lead_changes(days)
+    db.session.commit()
+    click.echo(f'Deleted {deleted} lead changes older than {days} days.')
+
+@bp.cli.command('sweep-sessions')
+def sweep_sessions_command():
+    """Delete expired sessions from the session table."""
+    if not isinstance(current_app.session_interface, DatabaseSessionInterface):
+        click.echo('SESSION_TYPE is not database; nothing to sweep.')
+        return
+    deleted = current_app.session_interface.sweep()
+    click.echo(f'Deleted {deleted} expired sessions.')
+
+def configure_worker_logging():
+    """Log worker progress to stderr unless logging is already configured."""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+@bp.cli.command('webhook-worker')
+@click.option('--once', is_flag=True, help='Process one round of events and exit.')
+def webhook_worker_command(once):
+    """Deliver webhook events from the outbox."""
+    import webhooks
+    worker = webhooks.WebhookWorker.from_config(current_app.config)
+    if once:
+        click.echo(f'Delivered {worker.run_once()} batches.')
+    else:
+        configure_worker_logging()
+        worker.run_forever()
+
+@bp.cli.command('enrichment-worker')
+@click.option('--once', is_flag=True, help='Process one batch of jobs and exit.')
+def enrichment_worker_command(once):
+    """Enrich leads from the enrichment job queue."""
+    import enrichment
+    worker = enrichment.EnrichmentWorker.from_config(current_app.config)
+    if once:
+        click.echo(f'Processed {worker.run_once()} jobs.')
+    else:
+        configure_worker_logging()
+        worker.run_forever()
+
+@bp.cli.command('init-db')
+def init_db_command():
+    """Create or upgrade the database schema and the default admin user."""
+    init_db()
+    click.echo('Database initialized.')
 
 if __name__ == '__main__':
+    app = create_app()
     with app.app_context():
-        try:
-            # Create tables for SQLite database (User model)
-            db.create_all()
-            print('SQLite database initialized successfully')
-            
-            # Create tables for MySQL database (Lead model)
-            if 'leads' in app.config['SQLALCHEMY_BINDS']:
-                try:
-                    leads_engine = db.engines['leads']
-                    MySQLUser.__table__.create(bind=leads_engine, checkfirst=True)
-                    Lead.__table__.create(bind=leads_engine, checkfirst=True)
-                    print('MySQL database initialized successfully')
-                except Exception as mysql_error:
-                    print(f'Error initializing MySQL database: {str(mysql_error)}')
-                    print('Continuing with SQLite database only...')
-        except Exception as e:
-            print(f'Error initializing database: {str(e)}')
-            if 'SQLite' in str(e):
-                print('Error with SQLite database initialization')
-            elif 'MySQL' in str(e):
-                print('Error with MySQL database initialization')
-                print('Continuing with SQLite database only...')
-            else:
-                print('Unknown database error occurred')
-
-    app.run(debug=True)
\ No newline at end of file
+        init_db()
+    app.run(debug=True)
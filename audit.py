@@ -0,0 +1,179 @@
+"""Write-behind audit log.
+
+Requests hand audit events to an in-process buffer and carry on; a
+background thread writes them as multi-row INSERTs once AUDIT_BATCH_SIZE
+events are waiting or every AUDIT_FLUSH_INTERVAL seconds. Whatever is still
+buffered when the process exits is written by an atexit hook, which runs on
+a graceful gunicorn worker shutdown. When the buffer is full, new events are
+dropped and counted instead of making the request wait. A batch that still
+fails after AUDIT_MAX_RETRIES flushes is written one event at a time, and
+events the database rejects while it is reachable are dropped and counted,
+so one bad event cannot hold up the log.
+
+Events are plain dicts holding every column of the audit table except the
+primary key.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+
+import sqlalchemy as sa
+
+logger = logging.getLogger(__name__)
+
+
+class AuditLog:
+    """Buffers audit events for one process and writes them in batches."""
+
+    def __init__(self):
+        self.enabled = False
+        self.engine = None
+        self.table = None
+        self.batch_size = 500
+        self.flush_interval = 2.0
+        self.max_retries = 3
+        self._queue = queue.Queue()
+        self._retry = []
+        self._failures = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self.recorded = self.written = self.dropped = self.rejected = self.failed_flushes = 0
+        atexit.register(self.close)
+
+    def init_app(self, app, engine, table):
+        """Write to ``table`` through ``engine``, configured from AUDIT_* settings."""
+        self.enabled = app.config.get('AUDIT_ENABLED', True) and engine is not None
+        self.engine = engine
+        self.table = table
+        self.batch_size = app.config.get('AUDIT_BATCH_SIZE', 500)
+        self.flush_interval = app.config.get('AUDIT_FLUSH_INTERVAL', 2.0)
+        self.max_retries = app.config.get('AUDIT_MAX_RETRIES', 3)
+        self._queue = queue.Queue(maxsize=app.config.get('AUDIT_BUFFER_SIZE', 10000))
+        app.extensions['audit'] = self
+
+    def record(self, event):
+        """Buffer an event without blocking; returns False if it was dropped."""
+        if not self.enabled:
+            return False
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        with self._lock:
+            self.recorded += 1
+        self._ensure_thread()
+        if self._queue.qsize() >= self.batch_size:
+            self._wakeup.set()
+        return True
+
+    def _ensure_thread(self):
+        # Started lazily, and again in each forked worker, which inherits no threads
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name='audit-log-writer', daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def _take_batch(self):
+        batch, self._retry = self._retry, []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def flush(self):
+        """Write every buffered event now; returns how many were written.
+
+        A batch that fails to insert is kept and retried on the next flush,
+        while new events keep buffering (and are dropped once it is full).
+        """
+        if not self.enabled:
+            return 0
+        written = 0
+        with self._flush_lock:
+            while True:
+                batch = self._take_batch()
+                if not batch:
+                    return written
+                try:
+                    with self.engine.begin() as connection:
+                        connection.execute(self.table.insert().values(batch))
+                    count = len(batch)
+                except Exception as e:
+                    self._failures += 1
+                    with self._lock:
+                        self.failed_flushes += 1
+                    if self._failures < self.max_retries:
+                        logger.warning('Audit log flush failed, will retry %d events: %s', len(batch), e)
+                        self._retry = batch
+                        return written
+                    count = self._write_singly(batch)
+                    if count is None:
+                        return written
+                self._failures = 0
+                written += count
+                with self._lock:
+                    self.written += count
+                if len(batch) < self.batch_size:
+                    return written
+
+    def _write_singly(self, batch):
+        """Write a repeatedly failing batch event by event, dropping the events the
+        database rejects; returns how many were written, or None if the database
+        is unreachable and the batch was kept for the next flush."""
+        try:
+            with self.engine.connect() as connection:
+                connection.execute(sa.text('SELECT 1'))
+        except Exception as e:
+            logger.warning('Audit log database unreachable, will retry %d events: %s', len(batch), e)
+            self._retry = batch
+            return None
+        written = rejected = 0
+        for event in batch:
+            try:
+                with self.engine.begin() as connection:
+                    connection.execute(self.table.insert().values(event))
+                written += 1
+            except Exception as e:
+                rejected += 1
+                logger.error('Audit event rejected by the database and dropped: %s (%s)', event.get('action'), e)
+        with self._lock:
+            self.rejected += rejected
+        return written
+
+    def close(self, timeout=5):
+        """Stop the writer thread and write what is left; safe to call more than once."""
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout)
+        self._pid = None
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            return {'recorded': self.recorded, 'written': self.written, 'dropped': self.dropped,
+                    'rejected': self.rejected, 'failed_flushes': self.failed_flushes,
+                    'buffered': self._queue.qsize() + len(self._retry)}
+
+
+audit = AuditLog()
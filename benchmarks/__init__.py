@@ -0,0 +1,4 @@
+"""Benchmark suite: synthetic data generator and latency/throughput runner.
+
+See ``python -m benchmarks.run --help``.
+"""
@@ -0,0 +1,283 @@
+"""Benchmark the main routes and compare the results with a stored baseline.
+
+By default each scenario is driven serially through the Flask test client,
+which measures the application without network or server overhead. With
+``--gunicorn`` the suite starts a multi-worker gunicorn server and drives
+each scenario from ``--concurrency`` threads for ``--duration`` seconds.
+
+The run fails (exit status 1) when a scenario's p95 latency grows, or its
+throughput drops, by more than ``--threshold`` against the baseline. The
+baseline must come from the same mode and dataset size.
+
+    python -m benchmarks.run --leads 10000 --save-baseline
+    python -m benchmarks.run --leads 10000
+"""
+import argparse
+import json
+import math
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.cookiejar import CookieJar
+
+from benchmarks.seed import CLIENT_PASSWORD, DEFAULT_DATA_DIR, bench_config, client_name, load_dataset, seed
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+SCENARIOS = ('index', 'get_leads', 'unassigned_leads', 'assign_lead', 'view_table', 'login')
+GET_PATHS = {'index': '/', 'get_leads': '/api/leads', 'unassigned_leads': '/api/unassigned_leads',
+             'view_table': '/dashboard/lead'}
+
+
+def scenario_request(name, rng, dataset):
+    """Return (method, path, form, json) for one request of scenario ``name``."""
+    if name == 'assign_lead':
+        lead_id = rng.randint(1, dataset['leads'])
+        return 'POST', f'/api/leads/{lead_id}/assign', None, {'user_id': rng.choice(dataset['client_ids'])}
+    if name == 'login':
+        username = client_name(rng.choice(dataset['client_ids']))
+        return 'POST', '/login', {'username': username, 'password': CLIENT_PASSWORD}, None
+    return 'GET', GET_PATHS[name], None, None
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of a sorted list."""
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def summarize(latencies, errors, elapsed):
+    latencies.sort()
+    if not latencies:
+        return {'requests': 0, 'errors': errors}
+    return {'requests': len(latencies), 'errors': errors,
+            'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+            'throughput': round(len(latencies) / elapsed, 1)}
+
+
+def run_test_client(data_dir, dataset, scenarios, iterations, warmup, rng):
+    from app import create_app
+
+    app = create_app(bench_config(data_dir))
+    admin = app.test_client()
+    admin.post('/admin/login', data={'username': 'admin', 'password': 'admin'})
+    results = {}
+    for name in scenarios:
+        latencies, errors = [], 0
+        started = time.perf_counter()
+        for iteration in range(warmup + iterations):
+            method, path, form, payload = scenario_request(name, rng, dataset)
+            # Each login starts from a fresh, anonymous session
+            client = app.test_client() if name == 'login' else admin
+            request_started = time.perf_counter()
+            response = client.open(path, method=method, data=form, json=payload)
+            duration = time.perf_counter() - request_started
+            if iteration == warmup - 1:
+                started = time.perf_counter()
+            if iteration < warmup:
+                continue
+            if response.status_code >= 400:
+                errors += 1
+            latencies.append(duration)
+        results[name] = summarize(latencies, errors, time.perf_counter() - started)
+        print(f'  {name}: {results[name]}')
+    # ru_maxrss is reported in kilobytes on Linux
+    return results, round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def http_opener(base_url, login=True):
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()), NoRedirect)
+    if login:
+        data = urllib.parse.urlencode({'username': 'admin', 'password': 'admin'}).encode()
+        http_call(opener, base_url, 'POST', '/admin/login', data, {})
+    return opener
+
+
+def http_call(opener, base_url, method, path, data, headers):
+    request = urllib.request.Request(base_url + path, data=data, method=method, headers=headers)
+    try:
+        with opener.open(request, timeout=60) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        e.read()
+        return e.code
+
+
+def http_worker(base_url, name, dataset, deadline, seed_value, latencies, counters):
+    rng = random.Random(seed_value)
+    opener = http_opener(base_url, login=name != 'login')
+    while time.monotonic() < deadline:
+        method, path, form, payload = scenario_request(name, rng, dataset)
+        headers, data = {}, None
+        if form is not None:
+            data = urllib.parse.urlencode(form).encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+            opener = http_opener(base_url, login=False)
+        elif payload is not None:
+            data = json.dumps(payload).encode()
+            headers['Content-Type'] = 'application/json'
+        started = time.perf_counter()
+        status = http_call(opener, base_url, method, path, data, headers)
+        latencies.append(time.perf_counter() - started)
+        if status >= 400:
+            counters['errors'] += 1
+
+
+def worker_peak_rss(master_pid):
+    """Largest peak RSS in MB among the gunicorn workers, from /proc (Linux only)."""
+    peak = 0
+    for pid in filter(str.isdigit, os.listdir('/proc')):
+        try:
+            with open(f'/proc/{pid}/status') as f:
+                fields = dict(line.split(':', 1) for line in f if ':' in line)
+        except OSError:
+            continue
+        if int(fields.get('PPid', '0').strip()) == master_pid and 'VmHWM' in fields:
+            peak = max(peak, int(fields['VmHWM'].split()[0]))
+    return round(peak / 1024, 1)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_server(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('gunicorn did not start')
+
+
+def run_gunicorn(data_dir, dataset, scenarios, workers, concurrency, duration, seed_value):
+    port = free_port()
+    env = dict(os.environ, BENCH_DATA_DIR=data_dir)
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-w', str(workers), '-b', f'127.0.0.1:{port}',
+                               '--log-level', 'warning', 'benchmarks.wsgi:app'], cwd=ROOT, env=env)
+    base_url = f'http://127.0.0.1:{port}'
+    results = {}
+    try:
+        wait_for_server(port)
+        for name in scenarios:
+            latencies, counters = [], {'errors': 0}
+            deadline = time.monotonic() + duration
+            threads = [threading.Thread(target=http_worker,
+                                        args=(base_url, name, dataset, deadline, seed_value + number, latencies, counters))
+                       for number in range(concurrency)]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            results[name] = summarize(latencies, counters['errors'], time.perf_counter() - started)
+            print(f'  {name}: {results[name]}')
+        return results, worker_peak_rss(server.pid)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def compare(results, baseline, threshold):
+    """Return a list of regression messages; empty when the run is within ``threshold``."""
+    if baseline['meta'] != results['meta']:
+        raise SystemExit(f'Baseline was recorded with {baseline["meta"]}, this run uses {results["meta"]}')
+    regressions = []
+    for name, current in results['scenarios'].items():
+        previous = baseline['scenarios'].get(name)
+        if not previous or not current.get('requests') or not previous.get('requests'):
+            continue
+        if current['p95_ms'] > previous['p95_ms'] * (1 + threshold):
+            regressions.append(f'{name}: p95 {current["p95_ms"]}ms vs baseline {previous["p95_ms"]}ms')
+        if current['throughput'] < previous['throughput'] * (1 - threshold):
+            regressions.append(f'{name}: throughput {current["throughput"]}/s vs baseline {previous["throughput"]}/s')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--leads', type=int, default=10000)
+    parser.add_argument('--skew', type=float, default=1.1)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--reseed', action='store_true', help='Regenerate the data even if it matches.')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--iterations', type=int, default=100, help='Requests per scenario (test client).')
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--gunicorn', action='store_true', help='Load test a multi-worker gunicorn server.')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10, help='Seconds per scenario (gunicorn).')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--threshold', type=float, default=0.2)
+    parser.add_argument('--output', help='Also write the results to this JSON file.')
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f'unknown scenarios: {", ".join(sorted(unknown))}')
+
+    dataset = load_dataset(args.data_dir)
+    wanted = {'users': args.users, 'leads': args.leads, 'skew': args.skew, 'seed': args.seed}
+    if args.reseed or dataset is None or any(dataset.get(key) != value for key, value in wanted.items()):
+        print(f'Seeding {args.users} users and {args.leads} leads...')
+        dataset = seed(args.data_dir, args.users, args.leads, args.skew, args.seed)
+    if not dataset['client_ids']:
+        scenarios = [name for name in scenarios if name not in ('assign_lead', 'login')]
+
+    mode = f'gunicorn-{args.workers}x{args.concurrency}' if args.gunicorn else 'test-client'
+    print(f'Running {", ".join(scenarios)} ({mode})')
+    if args.gunicorn:
+        scenario_results, peak_rss = run_gunicorn(args.data_dir, dataset, scenarios, args.workers,
+                                                  args.concurrency, args.duration, args.seed)
+    else:
+        scenario_results, peak_rss = run_test_client(args.data_dir, dataset, scenarios, args.iterations,
+                                                     args.warmup, random.Random(args.seed))
+    results = {'meta': dict(wanted, mode=mode), 'scenarios': scenario_results, 'peak_rss_mb': peak_rss}
+    print(f'Peak RSS: {peak_rss} MB')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'Saved baseline to {args.baseline}')
+        return
+    if not os.path.exists(args.baseline):
+        print('No baseline to compare against; rerun with --save-baseline to record one.')
+        return
+    with open(args.baseline) as f:
+        regressions = compare(results, json.load(f), args.threshold)
+    if regressions:
+        print('Performance regressions:')
+        for message in regressions:
+            print(f'  {message}')
+        sys.exit(1)
+    print('No regressions against the baseline.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+"""Seed benchmark SQLite databases with synthetic users and leads.
+
+The data is skewed the way production data is: a few reps own most of the
+assigned leads, a fifth of the leads are unassigned, early stages dominate,
+recent leads outnumber old ones and a few companies account for many leads.
+Generation is deterministic for a given ``--seed``.
+
+    python -m benchmarks.seed --users 50 --leads 100000
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from werkzeug.security import generate_password_hash
+
+from config import DevelopmentConfig
+
+DEFAULT_DATA_DIR = os.path.join(tempfile.gettempdir(), 'leadbox-benchmark')
+CLIENT_PASSWORD = 'benchmark'
+STAGE_WEIGHTS = {'New': 35, 'Contacted': 20, 'Qualified': 15, 'Proposal': 10,
+                 'Negotiation': 7, 'Closed Won': 6, 'Closed Lost': 7}
+INDUSTRIES = ('software', 'retail', 'finance', 'healthcare', 'manufacturing', None)
+UNASSIGNED_SHARE = 0.2
+DUPLICATE_SHARE = 0.02
+BATCH_SIZE = 10000
+
+
+def bench_config(data_dir):
+    """A configuration whose databases and session files all live in ``data_dir``."""
+    class BenchmarkConfig(DevelopmentConfig):
+        DEBUG = False
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{os.path.join(data_dir, "users.db")}'
+        SQLALCHEMY_BINDS = {'leads': f'sqlite:///{os.path.join(data_dir, "leads.db")}'}
+        SESSION_FILE_DIR = os.path.join(data_dir, 'sessions')
+    return BenchmarkConfig
+
+
+def zipf_weights(count, skew):
+    return [1 / rank ** skew for rank in range(1, count + 1)]
+
+
+def client_name(number):
+    return f'client{number}'
+
+
+def generate_leads(count, creator_id, client_ids, rng, skew=1.1, days=730):
+    """Yield lead column dicts in batches of ``BATCH_SIZE``."""
+    stages, stage_weights = list(STAGE_WEIGHTS), list(STAGE_WEIGHTS.values())
+    companies = [f'Company {number}' for number in range(max(1, count // 20))]
+    company_weights = zipf_weights(len(companies), skew)
+    client_weights = zipf_weights(len(client_ids), skew) if client_ids else []
+    now = datetime.utcnow()
+    batch = []
+    for number in range(1, count + 1):
+        company = rng.choices(companies, company_weights)[0]
+        domain = company.lower().replace(' ', '') + '.example.com'
+        # Reuse an earlier contact now and then so duplicate detection has work to do
+        person = rng.randint(1, number) if rng.random() < DUPLICATE_SHARE else number
+        created_at = now - timedelta(days=days * rng.random() ** 2, seconds=rng.randint(0, 86399))
+        assigned = client_ids and rng.random() >= UNASSIGNED_SHARE
+        batch.append({
+            'name': f'Lead {person}',
+            'email': f'lead{person}@{domain}',
+            'phone': f'555{person:07d}' if rng.random() < 0.8 else None,
+            'company': company,
+            'stage': rng.choices(stages, stage_weights)[0],
+            'notes': 'Imported by the benchmark seeder. ' * rng.randint(0, 4) or None,
+            'industry': rng.choice(INDUSTRIES),
+            'created_at': created_at,
+            'updated_at': created_at,
+            'created_by_id': creator_id,
+            'assigned_to_id': rng.choices(client_ids, client_weights)[0] if assigned else None,
+        })
+        if len(batch) >= BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def seed(data_dir, users, leads, skew=1.1, seed_value=42):
+    """Recreate the benchmark databases in ``data_dir``; returns the dataset description."""
+    from app import create_app, db, init_db, Lead, MySQLUser, User, lead_blocking_keys, \
+        score_rows, rebuild_pipeline_summary, leads_connection, backfill_stage_transitions, \
+        rebuild_stage_rollups
+
+    os.makedirs(data_dir, exist_ok=True)
+    for name in ('users.db', 'leads.db', 'dataset.json'):
+        path = os.path.join(data_dir, name)
+        if os.path.exists(path):
+            os.remove(path)
+
+    rng = random.Random(seed_value)
+    app = create_app(bench_config(data_dir))
+    started = time.perf_counter()
+    with app.app_context():
+        init_db()
+        password_hash = generate_password_hash(CLIENT_PASSWORD)
+        admin = User.query.filter_by(username='admin').one()
+        client_ids = list(range(admin.id + 1, admin.id + 1 + users))
+        clients = [{'id': user_id, 'username': client_name(user_id), 'email': f'{client_name(user_id)}@example.com',
+                    'role': 'client', 'created_at': datetime.utcnow()} for user_id in client_ids]
+        if clients:
+            db.session.execute(db.insert(User.__table__), [dict(client, password_hash=password_hash) for client in clients])
+        # Mirror the admin and the clients into the leads bind, as registration does
+        db.session.execute(db.insert(MySQLUser.__table__), clients + [
+            {'id': admin.id, 'username': admin.username, 'email': admin.email, 'role': admin.role,
+             'created_at': datetime.utcnow()}])
+        db.session.commit()
+
+        connection = leads_connection()
+        connection.exec_driver_sql('PRAGMA synchronous=OFF')
+        # Core inserts skip the per-row mapper events, so derive keys and scores here
+        for batch in generate_leads(leads, admin.id, client_ids, rng, skew):
+            for row in batch:
+                row.update(lead_blocking_keys(row['email'], row['phone'], row['company']))
+            for row, (score, _) in zip(batch, score_rows(batch)):
+                row['score'] = score
+                row['scored_at'] = row['created_at']
+                row['stage_changed_at'] = row['created_at']
+            connection.execute(db.insert(Lead.__table__), batch)
+        rebuild_pipeline_summary()
+        backfill_stage_transitions()
+        rebuild_stage_rollups()
+        db.session.commit()
+
+    dataset = {'users': users, 'leads': leads, 'skew': skew, 'seed': seed_value,
+               'client_ids': client_ids, 'seconds': round(time.perf_counter() - started, 1)}
+    with open(os.path.join(data_dir, 'dataset.json'), 'w') as f:
+        json.dump(dataset, f)
+    return dataset
+
+
+def load_dataset(data_dir):
+    try:
+        with open(os.path.join(data_dir, 'dataset.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--leads', type=int, default=10000)
+    parser.add_argument('--skew', type=float, default=1.1, help='Zipf exponent for reps and companies.')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    dataset = seed(args.data_dir, args.users, args.leads, args.skew, args.seed)
+    print(f'Seeded {dataset["users"]} users and {dataset["leads"]} leads into {args.data_dir} '
+          f'in {dataset["seconds"]}s')
+
+
+if __name__ == '__main__':
+    main()
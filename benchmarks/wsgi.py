@@ -0,0 +1,7 @@
+"""WSGI entry point for gunicorn load tests against the benchmark databases."""
+import os
+
+from app import create_app
+from benchmarks.seed import DEFAULT_DATA_DIR, bench_config
+
+app = create_app(bench_config(os.environ.get('BENCH_DATA_DIR', DEFAULT_DATA_DIR)))
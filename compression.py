@@ -0,0 +1,74 @@
+"""Negotiated response compression.
+
+Text and JSON responses of at least COMPRESS_MIN_SIZE bytes are compressed
+with brotli when the client accepts ``br`` and the optional ``brotli``
+package is installed, and with gzip otherwise, if accepted. Streamed
+responses (exports, the change feed stream) and files are left alone, as is
+anything that already has a Content-Encoding.
+"""
+import gzip
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = frozenset((
+    'application/json', 'application/x-ndjson', 'text/html', 'text/plain', 'text/csv',
+    'text/css', 'application/javascript', 'text/javascript',
+))
+
+
+class Compression:
+    """Compresses one application's responses according to Accept-Encoding."""
+
+    def __init__(self):
+        self.enabled = False
+        self.min_size = 1024
+        self.gzip_level = 6
+        self.br_quality = 4
+
+    def init_app(self, app):
+        self.enabled = app.config.get('COMPRESS_ENABLED', True)
+        if not self.enabled:
+            return
+        self.min_size = app.config.get('COMPRESS_MIN_SIZE', 1024)
+        self.gzip_level = app.config.get('COMPRESS_GZIP_LEVEL', 6)
+        self.br_quality = app.config.get('COMPRESS_BR_QUALITY', 4)
+        app.extensions['compression'] = self
+        app.after_request(self._compress)
+
+    @property
+    def encodings(self):
+        return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+    def compress(self, data, encoding):
+        if encoding == 'br':
+            return brotli.compress(data, quality=self.br_quality)
+        return gzip.compress(data, compresslevel=self.gzip_level, mtime=0)
+
+    def _compress(self, response):
+        if (response.direct_passthrough or response.is_streamed
+                or response.status_code < 200 or response.status_code in (204, 304)
+                or 'Content-Encoding' in response.headers
+                or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = request.accept_encodings.best_match(self.encodings)
+        if encoding is None:
+            return response
+        data = response.get_data()
+        if len(data) < self.min_size:
+            return response
+        response.set_data(self.compress(data, encoding))
+        response.headers['Content-Encoding'] = encoding
+        # The body differs per encoding, so a strong validator would be wrong
+        if response.headers.get('ETag') and not response.headers['ETag'].startswith('W/'):
+            etag, _ = response.get_etag()
+            response.set_etag(etag, weak=True)
+        return response
+
+
+compression = Compression()
@@ -13,9 +13,21 @@ class Config:
         'pool_pre_ping': True
     }
     
+    # Leads bind: optional read replicas (comma-separated URLs) and per-engine pool sizes.
+    # Reads of GET requests go to a replica unless the user wrote within READ_YOUR_WRITES_SECONDS.
+    LEADS_REPLICA_URLS = [url.strip() for url in os.getenv('LEADS_REPLICA_URLS', '').split(',') if url.strip()]
+    LEADS_POOL_SIZE = int(os.getenv('LEADS_POOL_SIZE', 0)) or None
+    LEADS_REPLICA_POOL_SIZE = int(os.getenv('LEADS_REPLICA_POOL_SIZE', 0)) or None
+    READ_YOUR_WRITES_SECONDS = float(os.getenv('READ_YOUR_WRITES_SECONDS', 5))
+
     # Session Configuration
     PERMANENT_SESSION_LIFETIME = timedelta(days=1)
-    SESSION_TYPE = os.getenv('SESSION_TYPE', 'filesystem')  # Default to filesystem if Redis is not configured
+    # 'database' keeps sessions in the user_session table of the users database (shared by
+    # every node), 'cookie' uses Flask's signed cookies; any other value goes to Flask-Session.
+    SESSION_TYPE = os.getenv('SESSION_TYPE', 'database')
+    SESSION_REFRESH_INTERVAL = int(os.getenv('SESSION_REFRESH_INTERVAL', 600))  # Min seconds between expiry-only writes
+    SESSION_SWEEP_INTERVAL = int(os.getenv('SESSION_SWEEP_INTERVAL', 300))  # 0 disables the background sweeper
+    SESSION_SWEEP_BATCH_SIZE = int(os.getenv('SESSION_SWEEP_BATCH_SIZE', 1000))
     if SESSION_TYPE == 'redis':
         SESSION_REDIS_HOST = os.getenv('REDIS_HOST', 'localhost')
         SESSION_REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
@@ -26,6 +38,77 @@ class Config:
         CACHE_REDIS_HOST = os.getenv('REDIS_HOST', 'localhost')
         CACHE_REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
     CACHE_DEFAULT_TIMEOUT = 300
+    LEADS_CACHE_TIMEOUT = int(os.getenv('LEADS_CACHE_TIMEOUT', 300))
+
+    # Response compression: br (with the optional brotli package) or gzip, as the client accepts
+    COMPRESS_ENABLED = os.getenv('COMPRESS_ENABLED', 'true').lower() == 'true'
+    COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', 1024))
+    COMPRESS_GZIP_LEVEL = int(os.getenv('COMPRESS_GZIP_LEVEL', 6))
+    COMPRESS_BR_QUALITY = int(os.getenv('COMPRESS_BR_QUALITY', 4))
+
+    # In-process cache of authenticated user identities
+    USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', 1024))
+    USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', 300))
+
+    # Webhook delivery worker
+    WEBHOOK_CONCURRENCY = int(os.getenv('WEBHOOK_CONCURRENCY', 8))
+    WEBHOOK_BATCH_SIZE = int(os.getenv('WEBHOOK_BATCH_SIZE', 50))
+    WEBHOOK_TIMEOUT = float(os.getenv('WEBHOOK_TIMEOUT', 10))
+    WEBHOOK_MAX_ATTEMPTS = int(os.getenv('WEBHOOK_MAX_ATTEMPTS', 8))
+    WEBHOOK_BACKOFF_BASE = int(os.getenv('WEBHOOK_BACKOFF_BASE', 30))
+    WEBHOOK_BACKOFF_MAX = int(os.getenv('WEBHOOK_BACKOFF_MAX', 3600))
+    WEBHOOK_POLL_INTERVAL = float(os.getenv('WEBHOOK_POLL_INTERVAL', 2))
+
+    # Lead enrichment worker; the provider is an import path to an EnrichmentProvider
+    ENRICHMENT_PROVIDER = os.getenv('ENRICHMENT_PROVIDER', 'enrichment.FakeEnrichmentProvider')
+    ENRICHMENT_CONCURRENCY = int(os.getenv('ENRICHMENT_CONCURRENCY', 10))
+    ENRICHMENT_BATCH_SIZE = int(os.getenv('ENRICHMENT_BATCH_SIZE', 200))
+    ENRICHMENT_MAX_ATTEMPTS = int(os.getenv('ENRICHMENT_MAX_ATTEMPTS', 5))
+    ENRICHMENT_CACHE_SIZE = int(os.getenv('ENRICHMENT_CACHE_SIZE', 10000))
+    ENRICHMENT_CACHE_TTL = int(os.getenv('ENRICHMENT_CACHE_TTL', 86400))
+    ENRICHMENT_POLL_INTERVAL = float(os.getenv('ENRICHMENT_POLL_INTERVAL', 2))
+
+    # Lead change feed (/api/leads/changes and its Server-Sent Events stream)
+    CHANGE_FEED_PAGE_SIZE = int(os.getenv('CHANGE_FEED_PAGE_SIZE', 500))
+    CHANGE_FEED_MAX_PAGE_SIZE = int(os.getenv('CHANGE_FEED_MAX_PAGE_SIZE', 5000))
+    # Longer than the slowest lead-writing transaction, so in-flight changes are not skipped
+    CHANGE_FEED_SETTLE_SECONDS = float(os.getenv('CHANGE_FEED_SETTLE_SECONDS', 5))
+    CHANGE_FEED_POLL_INTERVAL = float(os.getenv('CHANGE_FEED_POLL_INTERVAL', 1))
+    CHANGE_FEED_HEARTBEAT_SECONDS = float(os.getenv('CHANGE_FEED_HEARTBEAT_SECONDS', 15))
+    CHANGE_FEED_STREAM_SECONDS = float(os.getenv('CHANGE_FEED_STREAM_SECONDS', 300))
+    CHANGE_FEED_RETENTION_DAYS = int(os.getenv('CHANGE_FEED_RETENTION_DAYS', 7))
+
+    # Audit log: events are buffered per process and written in batches
+    AUDIT_ENABLED = os.getenv('AUDIT_ENABLED', 'true').lower() == 'true'
+    AUDIT_BUFFER_SIZE = int(os.getenv('AUDIT_BUFFER_SIZE', 10000))
+    AUDIT_BATCH_SIZE = int(os.getenv('AUDIT_BATCH_SIZE', 500))
+    AUDIT_FLUSH_INTERVAL = float(os.getenv('AUDIT_FLUSH_INTERVAL', 2))
+    AUDIT_MAX_RETRIES = int(os.getenv('AUDIT_MAX_RETRIES', 3))  # Failed flushes before bad events are dropped
+
+    # Lead archival (flask archive-leads): closed leads untouched for ARCHIVE_CLOSED_AFTER_DAYS,
+    # and any lead untouched for ARCHIVE_STALE_AFTER_DAYS if set, move to lead_archive
+    ARCHIVE_CLOSED_AFTER_DAYS = int(os.getenv('ARCHIVE_CLOSED_AFTER_DAYS', 365))
+    ARCHIVE_STALE_AFTER_DAYS = int(os.getenv('ARCHIVE_STALE_AFTER_DAYS', 0)) or None
+    ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', 1000))
+
+    # Lead scoring rule sets keyed by lowercase industry; 'default' applies
+    # to leads whose industry has no rule set. Scores are clamped to 0-100.
+    LEAD_SCORING_RULES = {
+        'default': {
+            'fields': {'email': 25, 'phone': 20, 'company': 20, 'notes': 10, 'industry': 5},
+            'stages': {'Contacted': 5, 'Qualified': 10, 'Proposal': 15, 'Negotiation': 20, 'Closed Won': 20},
+        },
+    }
+
+    # Seconds before reflected table metadata for the dashboard is reloaded
+    SCHEMA_CACHE_TTL = int(os.getenv('SCHEMA_CACHE_TTL', 300))
+
+    # Request and SQL instrumentation served in Prometheus text format on /metrics
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+    SLOW_QUERY_THRESHOLD = float(os.getenv('SLOW_QUERY_THRESHOLD', 0.25))
+    SLOW_QUERY_SAMPLES = int(os.getenv('SLOW_QUERY_SAMPLES', 100))
+    # Flag a request that runs the same SELECT at least this many times
+    N_PLUS_ONE_THRESHOLD = int(os.getenv('N_PLUS_ONE_THRESHOLD', 10))
 
 class DevelopmentConfig(Config):
     DEBUG = True
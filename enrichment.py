@@ -0,0 +1,249 @@
+"""Lead enrichment worker.
+
+New leads queue a row in the enrichment_job table (see app.py). This worker
+runs as its own process and claims due jobs in bounded batches. For each
+batch it looks up company data through a pluggable EnrichmentProvider with
+bounded asyncio concurrency, then writes the results back to the leads.
+Company lookups are cached by email domain, so a domain is only paid for
+once per cache lifetime.
+
+Run it with ``flask enrichment-worker``.
+"""
+import asyncio
+import logging
+import re
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from sqlalchemy.orm.exc import StaleDataError
+from werkzeug.utils import import_string
+
+from app import configure_worker_logging, create_app, db, invalidate_lead_cache, Lead, EnrichmentJob
+
+logger = logging.getLogger(__name__)
+
+FREE_MAIL_DOMAINS = {'gmail.com', 'googlemail.com', 'yahoo.com', 'hotmail.com', 'outlook.com',
+                     'live.com', 'aol.com', 'icloud.com', 'proton.me', 'protonmail.com'}
+EMAIL_PATTERN = re.compile(r'^[^@\s]+@[^@\s]+\.[a-z]{2,}$')
+MISSING = object()
+
+
+class EnrichmentProvider:
+    """Interface for company data sources."""
+
+    async def lookup_company(self, domain):
+        """Return a dict with any of 'company', 'industry' and 'company_size', or None."""
+        raise NotImplementedError
+
+
+class FakeEnrichmentProvider(EnrichmentProvider):
+    """Deterministic in-process provider for development and tests."""
+
+    SIZES = ('1-10', '11-50', '51-200', '201-1000', '1000+')
+    INDUSTRIES = ('software', 'retail', 'finance', 'healthcare', 'manufacturing')
+
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.calls = 0
+
+    async def lookup_company(self, domain):
+        self.calls += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        seed = sum(domain.encode())
+        return {'company': domain.split('.')[0].title(),
+                'industry': self.INDUSTRIES[seed % len(self.INDUSTRIES)],
+                'company_size': self.SIZES[seed % len(self.SIZES)]}
+
+
+class LookupCache:
+    """LRU cache whose entries expire ``ttl`` seconds after they are stored."""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None and time.monotonic() - entry[1] <= self.ttl:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+        self._entries.pop(key, None)
+        self.misses += 1
+        return MISSING
+
+    def put(self, key, value):
+        self._entries[key] = (value, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+def company_domain(email):
+    """The company domain of an email address, or None for free-mail and malformed addresses."""
+    domain = (email or '').strip().lower().rpartition('@')[2]
+    if not domain or '.' not in domain or domain in FREE_MAIL_DOMAINS:
+        return None
+    return domain
+
+
+class EnrichmentWorker:
+    def __init__(self, provider, concurrency=10, batch_size=200, max_attempts=5,
+                 cache_size=10000, cache_ttl=86400, poll_interval=2, lock_timeout=600):
+        self.provider = provider
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.lock_timeout = timedelta(seconds=lock_timeout)
+        self.cache = LookupCache(cache_size, cache_ttl)
+
+    @classmethod
+    def from_config(cls, config, provider=None):
+        if provider is None:
+            provider = import_string(config['ENRICHMENT_PROVIDER'])()
+        return cls(provider,
+                   concurrency=config['ENRICHMENT_CONCURRENCY'],
+                   batch_size=config['ENRICHMENT_BATCH_SIZE'],
+                   max_attempts=config['ENRICHMENT_MAX_ATTEMPTS'],
+                   cache_size=config['ENRICHMENT_CACHE_SIZE'],
+                   cache_ttl=config['ENRICHMENT_CACHE_TTL'],
+                   poll_interval=config['ENRICHMENT_POLL_INTERVAL'])
+
+    def claim(self):
+        """Mark up to ``batch_size`` due jobs as running and return them.
+
+        Only one batch is held at a time, so a backlog of queued jobs stays in
+        the table instead of in worker memory. Jobs left running by a crashed
+        worker are reclaimed after ``lock_timeout``, unless they have used up
+        ``max_attempts``: those are marked failed, so a job that crashes the
+        worker every time cannot loop forever.
+        """
+        now = datetime.utcnow()
+        jobs = db.session.execute(
+            db.select(EnrichmentJob.id, EnrichmentJob.lead_id, EnrichmentJob.attempts, EnrichmentJob.status)
+            .where(db.or_(
+                db.and_(EnrichmentJob.status == 'pending', EnrichmentJob.run_after <= now),
+                db.and_(EnrichmentJob.status == 'running', EnrichmentJob.locked_at < now - self.lock_timeout)
+            ))
+            .order_by(EnrichmentJob.id).limit(self.batch_size)
+            .with_for_update(skip_locked=True)
+        ).all()
+        exhausted = [job.id for job in jobs if job.status == 'running' and job.attempts >= self.max_attempts]
+        if exhausted:
+            db.session.execute(
+                db.update(EnrichmentJob)
+                .where(EnrichmentJob.id.in_(exhausted))
+                .values(status='failed', finished_at=now, locked_at=None,
+                        last_error='Worker stopped while processing the job')
+            )
+            jobs = [job for job in jobs if job.id not in exhausted]
+        if jobs:
+            db.session.execute(
+                db.update(EnrichmentJob)
+                .where(EnrichmentJob.id.in_([job.id for job in jobs]))
+                .values(status='running', locked_at=now, attempts=EnrichmentJob.attempts + 1)
+            )
+        db.session.commit()
+        return jobs
+
+    async def lookup(self, domain, semaphore):
+        cached = self.cache.get(domain)
+        if cached is not MISSING:
+            return cached
+        async with semaphore:
+            result = await self.provider.lookup_company(domain)
+        self.cache.put(domain, result)
+        return result
+
+    async def lookup_all(self, domains):
+        """Look up each distinct domain once, with at most ``concurrency`` provider calls in flight."""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        domains = list(domains)
+        results = await asyncio.gather(*(self.lookup(domain, semaphore) for domain in domains),
+                                       return_exceptions=True)
+        return dict(zip(domains, results))
+
+    def apply(self, jobs, leads, companies):
+        now = datetime.utcnow()
+        done, failed = [], []
+        for job in jobs:
+            lead = leads.get(job.lead_id)
+            if lead is None:
+                done.append(job.id)
+                continue
+            domain = company_domain(lead.email)
+            company = companies.get(domain) if domain else None
+            if isinstance(company, Exception):
+                failed.append((job, str(company)[:500]))
+                continue
+            if company:
+                lead.company = lead.company or company.get('company')
+                lead.industry = lead.industry or company.get('industry')
+                lead.company_size = company.get('company_size') or lead.company_size
+            lead.contact_valid = bool(EMAIL_PATTERN.match((lead.email or '').strip().lower())) or bool(lead.phone_key)
+            lead.enriched_at = now
+            done.append(job.id)
+
+        try:
+            if done:
+                db.session.execute(db.update(EnrichmentJob).where(EnrichmentJob.id.in_(done))
+                                   .values(status='done', finished_at=now, locked_at=None))
+            for job, error in failed:
+                values = {'last_error': error, 'locked_at': None}
+                if job.attempts + 1 >= self.max_attempts:
+                    values.update(status='failed', finished_at=now)
+                else:
+                    values.update(status='pending', run_after=now + timedelta(seconds=30 * 2 ** job.attempts))
+                db.session.execute(db.update(EnrichmentJob).where(EnrichmentJob.id == job.id).values(**values))
+            db.session.commit()
+            if done:
+                invalidate_lead_cache()
+        except StaleDataError:
+            # A lead was changed concurrently (bulk assign, PATCH); run the batch
+            # again with fresh data, without spending an attempt
+            db.session.rollback()
+            for job in jobs:
+                db.session.execute(db.update(EnrichmentJob).where(EnrichmentJob.id == job.id)
+                                   .values(status='pending', run_after=now, locked_at=None, attempts=job.attempts))
+            db.session.commit()
+
+    def run_once(self):
+        """Claim and process one batch of jobs; returns the number of jobs claimed."""
+        jobs = self.claim()
+        if not jobs:
+            return 0
+        leads = {lead.id: lead for lead in Lead.query.filter(Lead.id.in_({job.lead_id for job in jobs}))}
+        domains = {company_domain(lead.email) for lead in leads.values()} - {None}
+        companies = asyncio.run(self.lookup_all(domains)) if domains else {}
+        self.apply(jobs, leads, companies)
+        return len(jobs)
+
+    def run_forever(self):
+        logger.info('Enrichment worker started')
+        try:
+            while True:
+                try:
+                    processed = self.run_once()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.exception('Error enriching leads: %s', e)
+                    processed = 0
+                finally:
+                    db.session.remove()
+                if not processed:
+                    time.sleep(self.poll_interval)
+        except KeyboardInterrupt:
+            logger.info('Enrichment worker stopped')
+
+
+if __name__ == '__main__':
+    configure_worker_logging()
+    app = create_app()
+    with app.app_context():
+        EnrichmentWorker.from_config(app.config).run_forever()
@@ -0,0 +1,204 @@
+"""Per-request latency and SQL instrumentation.
+
+Every request is timed per endpoint, and every SQL statement is counted and
+timed per bind through SQLAlchemy engine events. Statements slower than
+SLOW_QUERY_THRESHOLD are kept as samples, as are requests that run the same
+SELECT N_PLUS_ONE_THRESHOLD or more times (usually a lazy relationship load
+inside a loop). Totals are served in Prometheus text format on /metrics.
+
+Metrics live in process memory, so each gunicorn worker reports its own.
+"""
+import bisect
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+
+from flask import Response, current_app, g, has_request_context, request
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250, 500, 1000)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            yield bound, total
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+class Metrics:
+    """Collects request and query metrics for one process."""
+
+    def __init__(self):
+        self.enabled = False
+        self.slow_query_threshold = 0.25
+        self.n_plus_one_threshold = 10
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self, max_samples=100):
+        with self._lock:
+            self.requests = Counter()
+            self.latency = {}
+            self.request_queries = {}
+            self.request_query_seconds = Counter()
+            self.query_latency = {}
+            self.slow_queries = Counter()
+            self.n_plus_one = Counter()
+            self.samples = deque(maxlen=max_samples)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('METRICS_ENABLED', True)
+        if not self.enabled:
+            return
+        self.slow_query_threshold = app.config.get('SLOW_QUERY_THRESHOLD', 0.25)
+        self.n_plus_one_threshold = app.config.get('N_PLUS_ONE_THRESHOLD', 10)
+        self.reset(app.config.get('SLOW_QUERY_SAMPLES', 100))
+        app.before_request(self._start_request)
+        app.after_request(self._record_status)
+        app.teardown_request(self._finish_request)
+        app.add_url_rule('/metrics', 'metrics', self.render_view)
+
+    def instrument_engine(self, engine, bind):
+        """Count and time every statement executed on ``engine`` under the ``bind`` label."""
+        if not self.enabled:
+            return
+
+        @event.listens_for(engine, 'before_cursor_execute')
+        def _before(conn, cursor, statement, parameters, context, executemany):
+            context._metrics_started = time.perf_counter()
+
+        @event.listens_for(engine, 'after_cursor_execute')
+        def _after(conn, cursor, statement, parameters, context, executemany):
+            self._record_query(bind, statement, time.perf_counter() - context._metrics_started)
+
+    def _record_query(self, bind, statement, duration):
+        endpoint = None
+        if has_request_context():
+            current = g.get('metrics')
+            if current is not None:
+                current['queries'] += 1
+                current['query_seconds'] += duration
+                current['statements'][statement] += 1
+                endpoint = request.endpoint
+        with self._lock:
+            histogram = self.query_latency.get(bind)
+            if histogram is None:
+                histogram = self.query_latency[bind] = Histogram(LATENCY_BUCKETS)
+            histogram.observe(duration)
+            if duration >= self.slow_query_threshold:
+                self.slow_queries[bind] += 1
+                self.samples.append({'kind': 'slow_query', 'bind': bind, 'endpoint': endpoint,
+                                     'seconds': round(duration, 4), 'statement': statement[:1000],
+                                     'at': datetime.utcnow().isoformat()})
+
+    def _start_request(self):
+        g.metrics = {'started': time.perf_counter(), 'queries': 0, 'query_seconds': 0.0,
+                     'statements': Counter(), 'status': 500}
+
+    def untrack_request(self):
+        """Leave the current request out of the request metrics, e.g. for long-lived streams."""
+        g.pop('metrics', None)
+
+    def _record_status(self, response):
+        current = g.get('metrics')
+        if current is not None:
+            current['status'] = response.status_code
+        return response
+
+    def _finish_request(self, exc=None):
+        # Runs when the request context is popped, i.e. after streamed bodies finish
+        current = g.pop('metrics', None)
+        if current is None:
+            return
+        duration = time.perf_counter() - current['started']
+        endpoint = request.endpoint or 'unmatched'
+        repeated = [(statement, count) for statement, count in current['statements'].items()
+                    if count >= self.n_plus_one_threshold and statement.lstrip()[:6].upper() == 'SELECT']
+        with self._lock:
+            self.requests[(endpoint, request.method, current['status'])] += 1
+            key = (endpoint, request.method)
+            if key not in self.latency:
+                self.latency[key] = Histogram(LATENCY_BUCKETS)
+            self.latency[key].observe(duration)
+            if endpoint not in self.request_queries:
+                self.request_queries[endpoint] = Histogram(QUERY_COUNT_BUCKETS)
+            self.request_queries[endpoint].observe(current['queries'])
+            self.request_query_seconds[endpoint] += current['query_seconds']
+            for statement, count in repeated:
+                self.n_plus_one[endpoint] += 1
+                self.samples.append({'kind': 'n_plus_one', 'endpoint': endpoint, 'count': count,
+                                     'statement': statement[:1000], 'at': datetime.utcnow().isoformat()})
+        for statement, count in repeated:
+            current_app.logger.warning('Possible N+1 query in %s: %d executions of %s',
+                                       endpoint, count, ' '.join(statement.split())[:200])
+
+    def recent_samples(self):
+        with self._lock:
+            return list(reversed(self.samples))
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        def histogram(name, histogram, **labels):
+            for bound, total in histogram.cumulative():
+                lines.append(f'{name}_bucket{_labels(**labels, le=bound)} {total}')
+            lines.append(f'{name}_sum{_labels(**labels)} {histogram.sum:.6f}')
+            lines.append(f'{name}_count{_labels(**labels)} {histogram.count}')
+
+        with self._lock:
+            family('leadbox_http_requests_total', 'counter', 'Requests by endpoint, method and status.')
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                lines.append(f'leadbox_http_requests_total{_labels(endpoint=endpoint, method=method, status=status)} {count}')
+            family('leadbox_http_request_duration_seconds', 'histogram', 'Request latency by endpoint.')
+            for (endpoint, method), values in sorted(self.latency.items()):
+                histogram('leadbox_http_request_duration_seconds', values, endpoint=endpoint, method=method)
+            family('leadbox_http_request_queries', 'histogram', 'SQL statements executed per request.')
+            for endpoint, values in sorted(self.request_queries.items()):
+                histogram('leadbox_http_request_queries', values, endpoint=endpoint)
+            family('leadbox_http_request_query_seconds_total', 'counter', 'Time spent in SQL by endpoint.')
+            for endpoint, seconds in sorted(self.request_query_seconds.items()):
+                lines.append(f'leadbox_http_request_query_seconds_total{_labels(endpoint=endpoint)} {seconds:.6f}')
+            family('leadbox_db_query_duration_seconds', 'histogram', 'SQL statement latency by bind.')
+            for bind, values in sorted(self.query_latency.items()):
+                histogram('leadbox_db_query_duration_seconds', values, bind=bind)
+            family('leadbox_db_slow_queries_total', 'counter', 'Statements slower than SLOW_QUERY_THRESHOLD.')
+            for bind, count in sorted(self.slow_queries.items()):
+                lines.append(f'leadbox_db_slow_queries_total{_labels(bind=bind)} {count}')
+            family('leadbox_db_n_plus_one_total', 'counter', 'Repeated SELECTs within a single request.')
+            for endpoint, count in sorted(self.n_plus_one.items()):
+                lines.append(f'leadbox_db_n_plus_one_total{_labels(endpoint=endpoint)} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def render_view(self):
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
+
+
+metrics = Metrics()
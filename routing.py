@@ -0,0 +1,96 @@
+"""Read/write routing for the leads bind.
+
+With LEADS_REPLICA_URLS set, the ORM session sends the leads-bind reads of
+read-only requests (GET, HEAD, OPTIONS) to a replica and everything else to
+the primary:
+
+- INSERT/UPDATE/DELETE, flushes, SELECT ... FOR UPDATE and non-SELECT text
+  statements use the primary, and so does the rest of that session;
+- after a request writes to the leads bind, the user's reads stay on the
+  primary for READ_YOUR_WRITES_SECONDS, so replication lag never hides
+  their own changes;
+- CLI commands and workers run outside requests and always use the primary.
+
+Pass ``bind_arguments={'primary': True}`` to force the primary for a read.
+"""
+import itertools
+import time
+
+import sqlalchemy as sa
+from flask import current_app, has_request_context, request, session as http_session
+from flask_sqlalchemy.session import Session
+
+READ_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS'))
+PRIMARY_UNTIL_KEY = '_leads_primary_until'
+WROTE_KEY = 'leads_wrote'
+REPLICA_KEY = 'leads_replica'
+
+
+def configure_pools(app, bind_key='leads'):
+    """Apply LEADS_POOL_SIZE to the bind's engine options; call before db.init_app."""
+    pool_size = app.config.get('LEADS_POOL_SIZE')
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    url = binds.get(bind_key)
+    if pool_size and isinstance(url, str):
+        binds[bind_key] = {'url': url, 'pool_size': pool_size}
+        app.config['SQLALCHEMY_BINDS'] = binds
+
+
+def _is_write(clause):
+    if isinstance(clause, sa.sql.dml.UpdateBase):
+        return True
+    if isinstance(clause, sa.sql.Select):
+        return clause._for_update_arg is not None
+    if isinstance(clause, sa.sql.elements.TextClause):
+        return clause.text.lstrip()[:6].upper() != 'SELECT'
+    return False
+
+
+class ReplicaRouter:
+    """Replica engines for one application's leads bind, picked round robin."""
+
+    def __init__(self, app, primary):
+        self.primary = primary
+        self.window = app.config.get('READ_YOUR_WRITES_SECONDS', 5)
+        options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+        if app.config.get('LEADS_REPLICA_POOL_SIZE'):
+            options['pool_size'] = app.config['LEADS_REPLICA_POOL_SIZE']
+        self.replicas = [sa.create_engine(url, **options) for url in app.config.get('LEADS_REPLICA_URLS') or []]
+        self._turn = itertools.count()
+        app.extensions['leads_router'] = self
+        if self.replicas:
+            app.after_request(self._remember_write)
+
+    def next_replica(self):
+        return self.replicas[next(self._turn) % len(self.replicas)]
+
+    def reads_from_replica(self):
+        """Whether this request's reads may use a replica."""
+        return (request.method in READ_METHODS
+                and http_session.get(PRIMARY_UNTIL_KEY, 0) < time.time())
+
+    def _remember_write(self, response):
+        registry = current_app.extensions['sqlalchemy'].session.registry
+        if registry.has() and registry().info.get(WROTE_KEY):
+            http_session[PRIMARY_UNTIL_KEY] = time.time() + self.window
+        return response
+
+
+class RoutingSession(Session):
+    """Flask-SQLAlchemy session that routes leads-bind reads to a replica."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, primary=False, **kwargs):
+        engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        if not has_request_context():
+            return engine
+        router = current_app.extensions.get('leads_router')
+        if router is None or not router.replicas or engine is not router.primary:
+            return engine
+        if self._flushing or _is_write(clause):
+            self.info[WROTE_KEY] = True
+        if primary or self.info.get(WROTE_KEY) or not router.reads_from_replica():
+            return engine
+        # Keep one replica per session so a request sees a single snapshot
+        if REPLICA_KEY not in self.info:
+            self.info[REPLICA_KEY] = router.next_replica()
+        return self.info[REPLICA_KEY]
@@ -0,0 +1,170 @@
+"""Server-side sessions kept in a database table.
+
+The cookie carries only a random session id. The row, keyed by a hash of
+that id, holds the session as tagged JSON (the format Flask uses for cookie
+sessions) and its expiry. A request writes only when the session changed,
+or to push the expiry forward at most once per SESSION_REFRESH_INTERVAL, so
+most requests do one primary-key read. Requests that store nothing in the
+session create no row. The id is replaced whenever the logged-in user
+changes (login, logout), so an id planted before login is useless after
+it. Each process deletes expired rows in batches from a background thread
+every SESSION_SWEEP_INTERVAL seconds (``flask sweep-sessions`` does the
+same on demand), so any number of app nodes can share the table.
+"""
+import hashlib
+import logging
+import os
+import secrets
+import threading
+import time
+from datetime import datetime, timedelta
+
+import sqlalchemy as sa
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+logger = logging.getLogger(__name__)
+
+
+class DatabaseSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False, payload=None, expires_at=None):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        # The stored form, expiry and user as loaded, to tell whether a write is needed
+        self.payload = payload
+        self.expires_at = expires_at
+        self.user_id = (initial or {}).get('_user_id')
+        self.replaced_sid = None
+
+    def regenerate(self):
+        """Move the session to a fresh id; the old id's row is deleted when it is saved."""
+        if not self.new:
+            self.replaced_sid = self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.new = True
+        self.modified = True
+
+
+class DatabaseSessionInterface(SessionInterface):
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, app, engine, table):
+        self.engine = engine
+        self.table = table
+        self.refresh_interval = timedelta(seconds=app.config.get('SESSION_REFRESH_INTERVAL', 600))
+        self.sweep_interval = app.config.get('SESSION_SWEEP_INTERVAL', 300)
+        self.sweep_batch_size = app.config.get('SESSION_SWEEP_BATCH_SIZE', 1000)
+        self._lock = threading.Lock()
+        self._pid = None
+
+    @staticmethod
+    def _key(sid):
+        return hashlib.sha256(sid.encode()).hexdigest()
+
+    def open_session(self, app, request):
+        self._ensure_sweeper()
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            table = self.table
+            with self.engine.connect() as connection:
+                row = connection.execute(
+                    sa.select(table.c.data, table.c.expires_at)
+                    .where(table.c.id == self._key(sid), table.c.expires_at > datetime.utcnow())
+                ).first()
+            if row is not None:
+                try:
+                    data = self.serializer.loads(row.data)
+                except ValueError:
+                    data = None
+                if isinstance(data, dict):
+                    return DatabaseSession(data, sid=sid, payload=row.data, expires_at=row.expires_at)
+        return DatabaseSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        # Guard against session fixation
+        if session.get('_user_id') != session.user_id and not session.new:
+            session.regenerate()
+
+        table = self.table
+        key = self._key(session.sid)
+        if not session:
+            if not session.new or session.replaced_sid:
+                with self.engine.begin() as connection:
+                    connection.execute(sa.delete(table).where(
+                        table.c.id == self._key(session.replaced_sid or session.sid)))
+                response.delete_cookie(name, domain=domain, path=path, secure=secure,
+                                       samesite=samesite, httponly=httponly)
+            return
+
+        payload = self.serializer.dumps(dict(session))
+        now = datetime.utcnow()
+        lifetime = app.permanent_session_lifetime
+        expires_at = now + lifetime
+        wrote = True
+        with self.engine.begin() as connection:
+            if session.replaced_sid:
+                connection.execute(sa.delete(table).where(table.c.id == self._key(session.replaced_sid)))
+            if session.new:
+                connection.execute(table.insert().values(id=key, data=payload, expires_at=expires_at))
+            elif payload != session.payload:
+                updated = connection.execute(
+                    table.update().where(table.c.id == key).values(data=payload, expires_at=expires_at)
+                ).rowcount
+                if not updated:
+                    # Swept while the request ran
+                    connection.execute(table.insert().values(id=key, data=payload, expires_at=expires_at))
+            elif session.expires_at - now < lifetime - self.refresh_interval:
+                connection.execute(table.update().where(table.c.id == key).values(expires_at=expires_at))
+            else:
+                wrote = False
+
+        if session.new or (wrote and self.should_set_cookie(app, session)):
+            response.set_cookie(name, session.sid, expires=self.get_expiration_time(app, session),
+                                httponly=httponly, domain=domain, path=path, secure=secure, samesite=samesite)
+
+    def sweep(self):
+        """Delete expired sessions in batches; returns how many were deleted."""
+        table = self.table
+        deleted = 0
+        while True:
+            with self.engine.begin() as connection:
+                ids = connection.execute(
+                    sa.select(table.c.id).where(table.c.expires_at < datetime.utcnow())
+                    .limit(self.sweep_batch_size)
+                ).scalars().all()
+                if ids:
+                    connection.execute(sa.delete(table).where(table.c.id.in_(ids)))
+            deleted += len(ids)
+            if len(ids) < self.sweep_batch_size:
+                return deleted
+
+    def _ensure_sweeper(self):
+        # Started lazily, and again in each forked worker, which inherits no threads
+        if not self.sweep_interval or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                threading.Thread(target=self._sweep_forever, name='session-sweeper', daemon=True).start()
+                self._pid = os.getpid()
+
+    def _sweep_forever(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.warning('Session sweep failed: %s', e)
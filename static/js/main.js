@@ -1,7 +1,135 @@
+// Lead table: the first page is rendered by the server, later pages are
+// fetched as HTML rows when the "Load more" button scrolls into view.
+const leadsTableBody = document.getElementById('leadsTableBody');
+const loadMoreButton = document.getElementById('loadMoreLeads');
+let nextCursor = loadMoreButton.dataset.nextCursor;
+let pageRequest = 0;
+let loadingPage = false;
+
+function leadFilterParams() {
+    const params = new URLSearchParams();
+    const fields = { name: 'searchName', company: 'searchCompany', email: 'searchEmail', stage: 'filterStage' };
+    Object.entries(fields).forEach(([param, id]) => {
+        const value = document.getElementById(id).value.trim();
+        if (value) {
+            params.set(param, value);
+        }
+    });
+    return params;
+}
+
+function updateTableState() {
+    loadMoreButton.classList.toggle('d-none', !nextCursor);
+    document.getElementById('noLeads').classList.toggle('d-none', leadsTableBody.rows.length > 0);
+}
+
+function loadLeads(reset) {
+    if (!reset && (loadingPage || !nextCursor)) {
+        return;
+    }
+    const params = leadFilterParams();
+    if (!reset) {
+        params.set('cursor', nextCursor);
+    }
+    // A newer request (e.g. the filters changed again) supersedes this one
+    const request = ++pageRequest;
+    loadingPage = true;
+    fetch(`${leadsTableBody.dataset.rowsUrl}?${params}`)
+        .then(response => {
+            if (!response.ok) {
+                throw new Error('Failed to load leads');
+            }
+            return response.json();
+        })
+        .then(data => {
+            if (request !== pageRequest) {
+                return;
+            }
+            if (reset) {
+                leadsTableBody.innerHTML = '';
+            }
+            leadsTableBody.insertAdjacentHTML('beforeend', data.html);
+            nextCursor = data.next_cursor || '';
+            updateTableState();
+        })
+        .catch(error => {
+            console.error('Error:', error);
+            alert(error.message);
+        })
+        .finally(() => {
+            if (request === pageRequest) {
+                loadingPage = false;
+            }
+        });
+}
+
+loadMoreButton.addEventListener('click', () => loadLeads(false));
+if ('IntersectionObserver' in window) {
+    new IntersectionObserver(entries => {
+        if (entries.some(entry => entry.isIntersecting)) {
+            loadLeads(false);
+        }
+    }, { rootMargin: '400px' }).observe(loadMoreButton);
+}
+
+// Filters are applied by the server, so changing one reloads from the first page
+let filterTimer = null;
+document.querySelectorAll('#searchForm input, #searchForm select').forEach(element => {
+    element.addEventListener('input', () => {
+        clearTimeout(filterTimer);
+        filterTimer = setTimeout(() => loadLeads(true), 300);
+    });
+});
+document.getElementById('searchForm').addEventListener('submit', e => e.preventDefault());
+
+function replaceLeadRow(leadId, html) {
+    const row = leadsTableBody.querySelector(`tr[data-lead-id="${leadId}"]`);
+    if (row) {
+        row.insertAdjacentHTML('afterend', html);
+        row.remove();
+    }
+}
+
+function refreshLeadRow(leadId) {
+    return fetch(`/leads/${leadId}/row`)
+        .then(response => response.json())
+        .then(data => {
+            if (data.html) {
+                replaceLeadRow(leadId, data.html);
+            }
+        });
+}
+
+// Stage changes are saved in the background and only the changed row is redrawn
+leadsTableBody.addEventListener('change', function(e) {
+    const form = e.target.closest('.stage-form');
+    if (!form) {
+        return;
+    }
+    const leadId = form.closest('tr').dataset.leadId;
+    fetch(form.action, {
+        method: 'POST',
+        headers: { 'X-Requested-With': 'XMLHttpRequest' },
+        body: new FormData(form)
+    })
+    .then(response => {
+        if (!response.ok) {
+            throw new Error('Failed to update stage');
+        }
+        return response.json();
+    })
+    .then(data => replaceLeadRow(leadId, data.html))
+    .catch(error => {
+        console.error('Error:', error);
+        alert(error.message);
+        refreshLeadRow(leadId);
+    });
+});
+
 // Lead assignment functionality
 function assignLead(leadId) {
     document.getElementById('leadId').value = leadId;
-    
+
     // Fetch available clients
     fetch('/api/clients')
         .then(response => {
@@ -13,17 +141,16 @@ function assignLead(leadId) {
         .then(clients => {
             const userSelect = document.getElementById('userId');
             userSelect.innerHTML = '<option value="">Select a client...</option>';
-            
+
             clients.forEach(client => {
                 const option = document.createElement('option');
                 option.value = client.id;
-                option.textContent = `${client.name} (${client.email})`;
+                option.textContent = `${client.username} (${client.email})`;
                 userSelect.appendChild(option);
             });
-            
+
             // Show the modal
-            const modal = new bootstrap.Modal(document.getElementById('assignLeadModal'));
-            modal.show();
+            bootstrap.Modal.getOrCreateInstance(document.getElementById('assignLeadModal')).show();
         })
         .catch(error => {
             console.error('Error:', error);
@@ -34,15 +161,15 @@ function assignLead(leadId) {
 // Handle lead assignment form submission
 document.getElementById('assignLeadForm').addEventListener('submit', function(e) {
     e.preventDefault();
-    
+
     const leadId = document.getElementById('leadId').value;
     const userId = document.getElementById('userId').value;
-    
+
     if (!userId) {
         alert('Please select a client');
         return;
     }
-    
+
     fetch(`/api/leads/${leadId}/assign`, {
         method: 'POST',
         headers: {
@@ -60,14 +187,42 @@ document.getElementById('assignLeadForm').addEventListener('submit', function(e)
     })
     .then(data => {
         // Close the modal
-        const modal = bootstrap.Modal.getInstance(document.getElementById('assignLeadModal'));
-        modal.hide();
-        
-        // Refresh the page to show updated assignments
-        window.location.reload();
+        bootstrap.Modal.getInstance(document.getElementById('assignLeadModal')).hide();
+
+        // Redraw only the assigned lead's row
+        return refreshLeadRow(leadId);
     })
     .catch(error => {
         console.error('Error:', error);
         alert(error.message);
     });
-});
\ No newline at end of file
+});
+
+// Keep visible rows in step with changes made elsewhere (other users, imports)
+function openChangeFeed() {
+    const changeFeed = new EventSource('/api/leads/changes/stream');
+    changeFeed.addEventListener('changes', e => {
+        JSON.parse(e.data).forEach(change => {
+            const row = leadsTableBody.querySelector(`tr[data-lead-id="${change.id}"]`);
+            if (!row) {
+                return;
+            }
+            if (change.op === 'delete') {
+                row.remove();
+                updateTableState();
+            } else {
+                refreshLeadRow(change.id);
+            }
+        });
+    });
+    // The log no longer reaches back to our position: reload the table and follow from now
+    changeFeed.addEventListener('reset', () => {
+        changeFeed.close();
+        loadLeads(true);
+        openChangeFeed();
+    });
+}
+
+if ('EventSource' in window) {
+    openChangeFeed();
+}
@@ -0,0 +1,28 @@
+import os
+
+import pytest
+
+from app import create_app, db, init_db, MySQLUser
+from config import DevelopmentConfig
+
+
+@pytest.fixture
+def app(tmp_path):
+    class TestConfig(DevelopmentConfig):
+        TESTING = True
+        DEBUG = False
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{os.path.join(tmp_path, "users.db")}'
+        SQLALCHEMY_BINDS = {'leads': f'sqlite:///{os.path.join(tmp_path, "leads.db")}'}
+        AUDIT_ENABLED = False
+        METRICS_ENABLED = False
+        SESSION_SWEEP_INTERVAL = 0
+
+    app = create_app(TestConfig)
+    with app.app_context():
+        init_db()
+        db.session.add(MySQLUser(id=1, username='admin', email='admin@example.com', role='admin'))
+        db.session.commit()
+        yield app
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
@@ -0,0 +1,101 @@
+from datetime import datetime, timedelta
+
+from app import db, leads_cache_version, EnrichmentJob, Lead
+from enrichment import EnrichmentWorker, FakeEnrichmentProvider
+
+
+class FailingProvider(FakeEnrichmentProvider):
+    async def lookup_company(self, domain):
+        self.calls += 1
+        raise RuntimeError(f'lookup failed for {domain}')
+
+
+def add_lead(email='jane@acme.com'):
+    lead = Lead(name='Jane', email=email, created_by_id=1)
+    db.session.add(lead)
+    db.session.commit()
+    return lead.id
+
+
+def job_for(lead_id):
+    db.session.expire_all()
+    return db.session.execute(db.select(EnrichmentJob).where(EnrichmentJob.lead_id == lead_id)).scalar_one()
+
+
+def make_due(job_id):
+    db.session.execute(db.update(EnrichmentJob).where(EnrichmentJob.id == job_id)
+                       .values(run_after=datetime.utcnow() - timedelta(seconds=1)))
+    db.session.commit()
+
+
+def test_run_once_enriches_leads_and_finishes_jobs(app):
+    lead_id = add_lead()
+    version = leads_cache_version()
+    provider = FakeEnrichmentProvider()
+
+    assert EnrichmentWorker(provider).run_once() == 1
+
+    job = job_for(lead_id)
+    assert (job.status, job.attempts, job.locked_at) == ('done', 1, None)
+    lead = db.session.get(Lead, lead_id)
+    assert lead.company == 'Acme'
+    assert lead.industry in FakeEnrichmentProvider.INDUSTRIES
+    assert lead.enriched_at is not None
+    assert provider.calls == 1
+    assert leads_cache_version() > version
+    assert EnrichmentWorker(provider).run_once() == 0
+
+
+def test_claim_skips_jobs_held_by_another_worker(app):
+    lead_id = add_lead()
+    provider = FakeEnrichmentProvider()
+
+    claimed = EnrichmentWorker(provider).claim()
+
+    assert [job.lead_id for job in claimed] == [lead_id]
+    assert job_for(lead_id).status == 'running'
+    assert EnrichmentWorker(provider).claim() == []
+
+
+def test_failed_lookup_is_retried_with_backoff_until_attempts_run_out(app):
+    lead_id = add_lead()
+    worker = EnrichmentWorker(FailingProvider(), max_attempts=2)
+
+    worker.run_once()
+    job = job_for(lead_id)
+    assert (job.status, job.attempts) == ('pending', 1)
+    assert 'lookup failed for acme.com' in job.last_error
+    assert job.run_after > datetime.utcnow() + timedelta(seconds=20)
+    assert worker.run_once() == 0
+
+    make_due(job.id)
+    worker.run_once()
+    job = job_for(lead_id)
+    assert (job.status, job.attempts) == ('failed', 2)
+    assert job.finished_at is not None
+    assert db.session.get(Lead, lead_id).enriched_at is None
+
+
+def test_stale_running_job_is_reclaimed(app):
+    lead_id = add_lead()
+    worker = EnrichmentWorker(FakeEnrichmentProvider(), lock_timeout=60)
+    worker.claim()
+    db.session.execute(db.update(EnrichmentJob).values(locked_at=datetime.utcnow() - timedelta(seconds=120)))
+    db.session.commit()
+
+    assert worker.run_once() == 1
+    job = job_for(lead_id)
+    assert (job.status, job.attempts) == ('done', 2)
+
+
+def test_stale_running_job_that_used_up_its_attempts_fails(app):
+    lead_id = add_lead()
+    worker = EnrichmentWorker(FakeEnrichmentProvider(), max_attempts=1, lock_timeout=60)
+    worker.claim()
+    db.session.execute(db.update(EnrichmentJob).values(locked_at=datetime.utcnow() - timedelta(seconds=120)))
+    db.session.commit()
+
+    assert worker.claim() == []
+    job = job_for(lead_id)
+    assert (job.status, job.attempts) == ('failed', 1)
+    assert job.last_error == 'Worker stopped while processing the job'
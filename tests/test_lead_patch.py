@@ -0,0 +1,20 @@
+from app import apply_lead_patches, db, Lead, MySQLUser
+
+
+def test_patch_applies_changes_and_rejects_bool_id_and_version(app):
+    lead = Lead(name='Jane', created_by_id=1)
+    db.session.add(lead)
+    db.session.commit()
+    admin = db.session.get(MySQLUser, 1)
+
+    results = apply_lead_patches([
+        {'id': True, 'version': lead.version, 'stage': 'Contacted'},
+        {'id': lead.id, 'version': True, 'stage': 'Contacted'},
+        {'id': lead.id, 'version': lead.version, 'stage': 'Qualified'},
+    ], admin)
+    db.session.commit()
+
+    assert [result['status'] for result in results] == ['invalid', 'invalid', 'updated']
+    assert results[0]['error'] == 'id is required'
+    assert results[1]['error'] == 'version must be an integer'
+    assert db.session.get(Lead, lead.id).stage == 'Qualified'
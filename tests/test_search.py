@@ -0,0 +1,31 @@
+from app import _like_search_lead_ids, _search_terms, db, search_lead_ids, Lead
+
+
+def add_leads(*leads):
+    objects = [Lead(created_by_id=1, **values) for values in leads]
+    db.session.add_all(objects)
+    db.session.commit()
+    return [lead.id for lead in objects]
+
+
+def test_full_text_search_matches_term_prefixes(app):
+    jane, _ = add_leads({'name': 'Jane Doe', 'company': 'Acme'}, {'name': 'John Roe', 'company': 'Globex'})
+
+    assert [lead_id for lead_id, _ in search_lead_ids('acm ja')] == [jane]
+
+
+def test_like_search_needs_every_term_and_ranks_by_matching_columns(app):
+    both, name_only, _ = add_leads({'name': 'Acme Buyer', 'company': 'Acme'},
+                                   {'name': 'Acme Reseller', 'company': 'Initech'},
+                                   {'name': 'Jane Doe', 'company': 'Globex'})
+
+    assert _like_search_lead_ids(_search_terms('ACME')) == [(both, 2), (name_only, 1)]
+    assert _like_search_lead_ids(_search_terms('acme init')) == [(name_only, 2)]
+    assert _like_search_lead_ids(_search_terms('acme'), assigned_to_id=7) == []
+
+
+def test_like_search_treats_underscores_literally(app):
+    [snake] = add_leads({'name': 'Snake', 'email': 'first_last@acme.com'})
+    add_leads({'name': 'Plain', 'email': 'firstXlast@acme.com'})
+
+    assert _like_search_lead_ids(_search_terms('first_last')) == [(snake, 1)]
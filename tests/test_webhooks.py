@@ -0,0 +1,142 @@
+import hashlib
+import hmac
+import json
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app import db, Lead, WebhookAttempt, WebhookDelivery, WebhookEndpoint
+from webhooks import WebhookWorker
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.received.append((dict(self.headers), body))
+        status = self.server.statuses.pop(0) if self.server.statuses else 200
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stub():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.received, server.statuses = [], []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def worker(app):
+    worker = WebhookWorker(concurrency=2, timeout=5, max_attempts=3, backoff_base=30, backoff_max=3600)
+    yield worker
+    worker.executor.shutdown(wait=True)
+    worker.pool.close()
+
+
+def add_endpoint(stub, **values):
+    endpoint = WebhookEndpoint(url=f'http://127.0.0.1:{stub.server_port}/hook', secret='s3cret',
+                               events='lead.created', active=True, **values)
+    db.session.add(endpoint)
+    db.session.commit()
+    return endpoint.id
+
+
+def add_lead():
+    lead = Lead(name='Jane', email='jane@acme.com', created_by_id=1)
+    db.session.add(lead)
+    db.session.commit()
+    return lead.id
+
+
+def delivery():
+    db.session.expire_all()
+    return db.session.execute(db.select(WebhookDelivery)).scalar_one()
+
+
+def make_due():
+    db.session.execute(db.update(WebhookDelivery).values(next_attempt_at=datetime.utcnow() - timedelta(seconds=1)))
+    db.session.commit()
+
+
+def test_event_is_delivered_signed(app, stub, worker):
+    add_endpoint(stub)
+    lead_id = add_lead()
+
+    assert worker.run_once() == 1
+
+    [(headers, body)] = stub.received
+    expected = hmac.new(b's3cret', body, hashlib.sha256).hexdigest()
+    assert headers['X-LeadBox-Signature'] == f'sha256={expected}'
+    [event] = json.loads(body)['events']
+    assert (event['type'], event['data']['id']) == ('lead.created', lead_id)
+    sent = delivery()
+    assert (sent.status, sent.attempts, sent.last_status_code) == ('delivered', 1, 200)
+    assert sent.delivered_at is not None
+    assert worker.run_once() == 0
+
+
+def test_failed_delivery_is_retried_with_backoff(app, stub, worker):
+    add_endpoint(stub)
+    add_lead()
+    stub.statuses = [503]
+
+    started = datetime.utcnow()
+    worker.run_once()
+    failed = delivery()
+    assert (failed.status, failed.attempts, failed.last_error) == ('pending', 1, 'HTTP 503')
+    assert started + timedelta(seconds=30) <= failed.next_attempt_at <= datetime.utcnow() + timedelta(seconds=33)
+    assert worker.run_once() == 0
+    assert len(stub.received) == 1
+
+    make_due()
+    assert worker.run_once() == 1
+    assert len(stub.received) == 2
+    assert (delivery().status, delivery().attempts) == ('delivered', 2)
+    statuses = db.session.scalars(db.select(WebhookAttempt.status_code).order_by(WebhookAttempt.id)).all()
+    assert statuses == [503, 200]
+
+
+def test_delivery_fails_after_max_attempts(app, stub, worker):
+    add_endpoint(stub)
+    add_lead()
+    stub.statuses = [500, 500, 500]
+
+    for _ in range(3):
+        make_due()
+        worker.run_once()
+
+    failed = delivery()
+    assert (failed.status, failed.attempts, failed.last_status_code) == ('failed', 3, 500)
+    make_due()
+    assert worker.run_once() == 0
+    assert len(stub.received) == 3
+
+
+def test_claimed_delivery_is_not_sent_by_another_worker(app, stub, worker):
+    add_endpoint(stub)
+    add_lead()
+    worker.dispatch_outbox()
+
+    assert len(worker.due_batches()) == 1
+    other = WebhookWorker(concurrency=2)
+    try:
+        assert other.run_once() == 0
+    finally:
+        other.executor.shutdown(wait=True)
+    assert stub.received == []
+
+
+def test_backoff_doubles_up_to_the_maximum(worker):
+    assert timedelta(seconds=30) <= worker._backoff(1) <= timedelta(seconds=33)
+    assert timedelta(seconds=120) <= worker._backoff(3) <= timedelta(seconds=132)
+    assert timedelta(seconds=3600) <= worker._backoff(20) <= timedelta(seconds=3960)
@@ -0,0 +1,304 @@
+"""Webhook delivery worker.
+
+Lead changes write events to the webhook_outbox table in the same transaction
+as the change (see app.py). This worker runs as its own process, fans events
+out to the subscribed endpoints and delivers them in batches over pooled
+keep-alive connections, retrying failures with exponential backoff.
+
+Run it with ``flask webhook-worker`` or ``python webhooks.py``.
+"""
+import hashlib
+import hmac
+import http.client
+import json
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+
+from app import (configure_worker_logging, create_app, db, WebhookEndpoint, WebhookOutbox,
+                 WebhookDelivery, WebhookAttempt)
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionPool:
+    """Idle keep-alive HTTP(S) connections per origin, shared by the delivery threads."""
+
+    def __init__(self, timeout, max_idle=4):
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._idle = {}
+
+    def _connect(self, scheme, netloc):
+        if scheme == 'https':
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout)
+        return http.client.HTTPConnection(netloc, timeout=self.timeout)
+
+    def _checkout(self, origin):
+        with self._lock:
+            idle = self._idle.get(origin)
+            if idle:
+                return idle.pop(), True
+        return self._connect(*origin), False
+
+    def _checkin(self, origin, connection):
+        with self._lock:
+            idle = self._idle.setdefault(origin, [])
+            if len(idle) < self.max_idle:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def post(self, url, body, headers):
+        """POST ``body`` and return the response status code."""
+        parts = urlsplit(url)
+        origin = (parts.scheme, parts.netloc)
+        path = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+        connection, reused = self._checkout(origin)
+        try:
+            connection.request('POST', path, body=body, headers=headers)
+            response = connection.getresponse()
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            connection.close()
+            if not reused:
+                raise
+            # The server dropped an idle keep-alive connection; retry on a fresh one
+            connection = self._connect(*origin)
+            connection.request('POST', path, body=body, headers=headers)
+            response = connection.getresponse()
+        except Exception:
+            connection.close()
+            raise
+        response.read()
+        if response.will_close:
+            connection.close()
+        else:
+            self._checkin(origin, connection)
+        return response.status
+
+    def close(self):
+        with self._lock:
+            for idle in self._idle.values():
+                for connection in idle:
+                    connection.close()
+            self._idle.clear()
+
+
+class TokenBucket:
+    """Allow ``rate`` requests per second with bursts of up to one second's worth."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.capacity = max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def take(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class WebhookWorker:
+    def __init__(self, concurrency=8, batch_size=50, timeout=10, max_attempts=8,
+                 backoff_base=30, backoff_max=3600, poll_interval=2, lock_timeout=600):
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.poll_interval = poll_interval
+        self.lock_timeout = timedelta(seconds=lock_timeout)
+        self.pool = ConnectionPool(timeout=timeout, max_idle=concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='webhook')
+        self.buckets = {}
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(concurrency=config['WEBHOOK_CONCURRENCY'],
+                   batch_size=config['WEBHOOK_BATCH_SIZE'],
+                   timeout=config['WEBHOOK_TIMEOUT'],
+                   max_attempts=config['WEBHOOK_MAX_ATTEMPTS'],
+                   backoff_base=config['WEBHOOK_BACKOFF_BASE'],
+                   backoff_max=config['WEBHOOK_BACKOFF_MAX'],
+                   poll_interval=config['WEBHOOK_POLL_INTERVAL'])
+
+    def dispatch_outbox(self, limit=1000):
+        """Create a pending delivery for every subscribed endpoint of each new outbox event."""
+        events = db.session.execute(
+            db.select(WebhookOutbox.id, WebhookOutbox.event_type)
+            .where(WebhookOutbox.dispatched_at.is_(None))
+            .order_by(WebhookOutbox.id).limit(limit)
+            .with_for_update(skip_locked=True)
+        ).all()
+        if not events:
+            db.session.commit()
+            return 0
+        endpoints = WebhookEndpoint.query.filter_by(active=True).all()
+        now = datetime.utcnow()
+        deliveries = [
+            {'event_id': event.id, 'endpoint_id': endpoint.id, 'status': 'pending',
+             'attempts': 0, 'next_attempt_at': now, 'created_at': now}
+            for event in events for endpoint in endpoints
+            if endpoint.events == '*' or event.event_type in endpoint.events.split(',')
+        ]
+        if deliveries:
+            db.session.execute(db.insert(WebhookDelivery), deliveries)
+        db.session.execute(
+            db.update(WebhookOutbox)
+            .where(WebhookOutbox.id.in_([event.id for event in events]))
+            .values(dispatched_at=now)
+        )
+        db.session.commit()
+        return len(deliveries)
+
+    def due_batches(self):
+        """Claim due deliveries in per-endpoint batches of up to ``batch_size`` events.
+
+        Deliveries to inactive endpoints are left out in SQL, so they cannot
+        fill the window and starve active endpoints. Claimed deliveries have
+        ``next_attempt_at`` pushed out by ``lock_timeout``, so other workers
+        skip them; those of a worker that dies mid-send are retried once that
+        passes. Batches for endpoints over their rate limit are not claimed.
+        """
+        now = datetime.utcnow()
+        due = db.session.execute(
+            db.select(WebhookDelivery.id, WebhookDelivery.endpoint_id,
+                      WebhookDelivery.event_id, WebhookDelivery.attempts)
+            .join(WebhookEndpoint, WebhookEndpoint.id == WebhookDelivery.endpoint_id)
+            .where(WebhookDelivery.status == 'pending',
+                   WebhookDelivery.next_attempt_at <= now,
+                   WebhookEndpoint.active.is_(True))
+            .order_by(WebhookDelivery.id)
+            .limit(self.concurrency * self.batch_size * 4)
+            .with_for_update(skip_locked=True, of=WebhookDelivery)
+        ).all()
+        if not due:
+            db.session.commit()
+            return []
+        endpoints = {endpoint.id: endpoint for endpoint in
+                     WebhookEndpoint.query.filter(WebhookEndpoint.id.in_({row.endpoint_id for row in due}))}
+        payloads = dict(db.session.execute(
+            db.select(WebhookOutbox.id, WebhookOutbox.payload)
+            .where(WebhookOutbox.id.in_({row.event_id for row in due}))
+        ).all())
+
+        batches = {}
+        for row in due:
+            endpoint = endpoints.get(row.endpoint_id)
+            if endpoint is None or not endpoint.active:
+                continue
+            pending = batches.setdefault(endpoint.id, [[]])
+            if len(pending[-1]) >= self.batch_size:
+                pending.append([])
+            pending[-1].append((row, payloads[row.event_id]))
+        batches = [(endpoints[endpoint_id], batch)
+                   for endpoint_id, pending in batches.items() for batch in pending
+                   if self._allowed(endpoints[endpoint_id])]
+        claimed = [row.id for _, batch in batches for row, _ in batch]
+        if claimed:
+            db.session.execute(
+                db.update(WebhookDelivery)
+                .where(WebhookDelivery.id.in_(claimed))
+                .values(next_attempt_at=now + self.lock_timeout)
+            )
+        db.session.commit()
+        return batches
+
+    def _allowed(self, endpoint):
+        if not endpoint.rate_limit:
+            return True
+        bucket = self.buckets.get(endpoint.id)
+        if bucket is None or bucket.rate != endpoint.rate_limit:
+            bucket = self.buckets[endpoint.id] = TokenBucket(endpoint.rate_limit)
+        return bucket.take()
+
+    def send(self, url, secret, batch):
+        """Deliver one batch; runs on a pool thread and touches no database state."""
+        events = []
+        for row, payload in batch:
+            event = json.loads(payload)
+            event['id'] = row.event_id
+            events.append(event)
+        body = json.dumps({'events': events}).encode()
+        headers = {'Content-Type': 'application/json', 'User-Agent': 'LeadBox-Webhooks'}
+        if secret:
+            signature = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+            headers['X-LeadBox-Signature'] = f'sha256={signature}'
+        started = time.monotonic()
+        try:
+            status, error = self.pool.post(url, body, headers), None
+        except Exception as e:
+            status, error = None, str(e)[:500]
+        return status, error, int((time.monotonic() - started) * 1000)
+
+    def _backoff(self, attempts):
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (attempts - 1))
+        return timedelta(seconds=delay * random.uniform(1.0, 1.1))
+
+    def record(self, batch, status, error, duration_ms):
+        now = datetime.utcnow()
+        delivered = status is not None and 200 <= status < 300
+        if not delivered and error is None:
+            error = f'HTTP {status}'
+        updates, attempts = [], []
+        for row, _ in batch:
+            count = row.attempts + 1
+            update = {'id': row.id, 'attempts': count, 'last_status_code': status, 'last_error': error}
+            if delivered:
+                update.update(status='delivered', delivered_at=now)
+            elif count >= self.max_attempts:
+                update.update(status='failed')
+            else:
+                update.update(next_attempt_at=now + self._backoff(count))
+            updates.append(update)
+            attempts.append({'delivery_id': row.id, 'attempted_at': now, 'status_code': status,
+                             'error': error, 'duration_ms': duration_ms})
+        db.session.execute(db.update(WebhookDelivery), updates)
+        db.session.execute(db.insert(WebhookAttempt), attempts)
+
+    def run_once(self):
+        """Dispatch new events and send one round of due batches; returns the batches sent."""
+        self.dispatch_outbox()
+        futures = [(batch, self.executor.submit(self.send, endpoint.url, endpoint.secret, batch))
+                   for endpoint, batch in self.due_batches()]
+        for batch, future in futures:
+            self.record(batch, *future.result())
+        db.session.commit()
+        return len(futures)
+
+    def run_forever(self):
+        logger.info('Webhook worker started')
+        try:
+            while True:
+                try:
+                    sent = self.run_once()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.exception('Error delivering webhooks: %s', e)
+                    sent = 0
+                finally:
+                    db.session.remove()
+                if not sent:
+                    time.sleep(self.poll_interval)
+        except KeyboardInterrupt:
+            logger.info('Webhook worker stopped')
+        finally:
+            self.executor.shutdown(wait=True)
+            self.pool.close()
+
+
+if __name__ == '__main__':
+    configure_worker_logging()
+    app = create_app()
+    with app.app_context():
+        WebhookWorker.from_config(app.config).run_forever()